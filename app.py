@@ -3,12 +3,21 @@ from flask import Flask
 from config import Config
 from extensions import db
 from database import init_db
+from logs import configure_logging, clear_operation_id
 from routes import initialize_routes
 from services import AppService
+import storage
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    configure_logging(
+        level=app.config['LOG_LEVEL'],
+        fmt=app.config['LOG_FORMAT'],
+        payload_sample_rate=app.config['LOG_PAYLOAD_SAMPLE_RATE'],
+        payload_max_chars=app.config['LOG_PAYLOAD_MAX_CHARS'],
+    )
+    app.before_request(clear_operation_id)
 
     db.init_app(app)
     
@@ -22,6 +31,15 @@ def create_app():
     # Create database tables
     with app.app_context():
         init_db(app)
+        if app.config['STORAGE_CLEAN_ON_STARTUP']:
+            storage.reconcile(app.config['STORAGE_ORPHAN_GRACE_SECONDS'], app.config['STORAGE_DELETE_ORPHANS'])
+
+    if app.config['JOB_EXECUTION'] == 'thread':
+        # Renews the leases of this instance's jobs and takes over those of instances that died.
+        service.job_runner.start()
+
+    if app.config['BATCH_RESUME_ON_STARTUP']:
+        service.batch_runner.resume_interrupted()
 
     return app
 
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Request bodies up to this size stay in memory; larger uploads spill to disk.
+SPOOL_MAX_BYTES = 1 << 20
+
+
+class ThreadOffloadASGI:
+    """
+    Serves a WSGI app (the Flask app) from an ASGI server such as uvicorn.
+
+    Connections are accepted and bodies are read and written on the event
+    loop, so idle and slow clients cost no threads. Each request's WSGI call
+    (and the iteration of streamed responses) runs on a dedicated pool of
+    `max_threads` small-stack threads, so thousands of handlers can block
+    on Vertex AI at once. Requests beyond `max_threads` wait for a thread
+    and are counted in genmedia_queue_depth{queue="asgi_offload"}.
+    """
+
+    def __init__(self, wsgi_app, max_threads=1000, thread_stack_kb=None):
+        self.wsgi_app = wsgi_app
+        self.max_threads = max_threads
+        self.thread_stack_kb = thread_stack_kb
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._waiting = metrics.queue_depth.labels(queue='asgi_offload')
+
+    @property
+    def executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                if self.thread_stack_kb:
+                    # Applies to every thread started from now on, including background workers.
+                    threading.stack_size(self.thread_stack_kb * 1024)
+                self._executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix='asgi')
+            return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+
+            loop = asyncio.get_running_loop()
+            leave_queue = self._enter_queue()
+            try:
+                await loop.run_in_executor(self.executor, self._run_wsgi, build_environ(scope, body), send, loop, leave_queue)
+            finally:
+                # A task cancelled while its job is still queued never runs _run_wsgi.
+                leave_queue()
+        finally:
+            body.close()
+
+    def _enter_queue(self):
+        """Counts a request waiting for a pool thread; the returned callable uncounts it once."""
+        self._waiting.inc()
+        waiting = threading.Lock()
+
+        def leave_queue():
+            if waiting.acquire(blocking=False):
+                self._waiting.dec()
+        return leave_queue
+
+    def _run_wsgi(self, environ, send, loop, leave_queue):
+        """Runs on a pool thread; every ASGI send is handed back to the event loop."""
+        leave_queue()
+
+        def call_soon(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            return lambda data: send_body(data, more=True)
+
+        def send_body(data, more):
+            if not response.get('started'):
+                response['started'] = True
+                call_soon({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+            call_soon({'type': 'http.response.body', 'body': data, 'more_body': more})
+
+        iterable = None
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+            for chunk in iterable:
+                if chunk:
+                    send_body(chunk, more=True)
+            send_body(b'', more=False)
+        except Exception:
+            logger.exception("Unhandled error serving %s %s", environ['REQUEST_METHOD'], environ['PATH_INFO'])
+            if not response.get('started'):
+                response.update(status=500, headers=[(b'content-type', b'text/plain; charset=utf-8')])
+                send_body(b'Internal Server Error', more=False)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+
+def build_environ(scope, body):
+    """Builds a PEP 3333 environ for an ASGI HTTP scope."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = name
+        else:
+            key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def create_asgi_app():
+    from app import app as flask_app
+    return ThreadOffloadASGI(
+        flask_app,
+        max_threads=flask_app.config['ASGI_MAX_THREADS'],
+        thread_stack_kb=flask_app.config['ASGI_THREAD_STACK_KB'],
+    )
+
+
+def __getattr__(name):
+    # `uvicorn asgi:app` looks the app up as a module attribute; build it on
+    # first use so importing this module does not start the Flask app.
+    if name == 'app':
+        globals()['app'] = create_asgi_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
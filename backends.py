@@ -0,0 +1,86 @@
+# Client factories for Vertex AI and GCS. By default every client talks to
+# Google Cloud with application default credentials. Setting
+# VERTEX_API_ENDPOINT and/or GCS_API_ENDPOINT (e.g. to a running
+# `python fake_backend.py`) points the app at a stand-in server instead, and
+# those clients then use placeholder credentials instead of ADC.
+import google.auth
+import google.auth.transport.requests
+import google.oauth2.credentials
+import vertexai
+from google import genai
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import aiplatform, storage
+from google.genai import types
+
+from config import Config
+
+EMULATOR_TOKEN = "emulator"
+
+
+def vertex_emulated():
+    return bool(Config.VERTEX_API_ENDPOINT)
+
+
+def vertex_base_url(location):
+    """Base URL for raw REST calls, e.g. https://us-central1-aiplatform.googleapis.com."""
+    if vertex_emulated():
+        return Config.VERTEX_API_ENDPOINT.rstrip('/')
+    return f"https://{location}-aiplatform.googleapis.com"
+
+
+def emulator_credentials():
+    # Anonymous credentials cannot be refreshed, which genai attempts before
+    # every call; a static token that never expires satisfies it.
+    return google.oauth2.credentials.Credentials(token=EMULATOR_TOKEN)
+
+
+def access_token(scopes=None):
+    """Returns a bearer token for raw REST calls to Vertex AI."""
+    if vertex_emulated():
+        return EMULATOR_TOKEN
+    creds, _ = google.auth.default(scopes=scopes)
+    creds.refresh(google.auth.transport.requests.Request())
+    return creds.token
+
+
+def init_vertexai(project_id, location):
+    if vertex_emulated():
+        vertexai.init(
+            project=project_id, location=location, credentials=emulator_credentials(),
+            api_endpoint=Config.VERTEX_API_ENDPOINT, api_transport='rest',
+        )
+    else:
+        vertexai.init(project=project_id, location=location)
+
+
+def genai_client(project_id, location):
+    if vertex_emulated():
+        return genai.Client(
+            vertexai=True, project=project_id, location=location, credentials=emulator_credentials(),
+            http_options=types.HttpOptions(base_url=Config.VERTEX_API_ENDPOINT),
+        )
+    return genai.Client(vertexai=True, project=project_id, location=location)
+
+
+def prediction_client(api_endpoint):
+    if vertex_emulated():
+        return aiplatform.gapic.PredictionServiceClient(
+            client_options={"api_endpoint": Config.VERTEX_API_ENDPOINT},
+            credentials=emulator_credentials(),
+            transport="rest",
+        )
+    return aiplatform.gapic.PredictionServiceClient(client_options={"api_endpoint": api_endpoint})
+
+
+def storage_client(project_id=None):
+    if Config.GCS_API_ENDPOINT:
+        return storage.Client(
+            project=project_id or Config.PROJECT_ID, credentials=AnonymousCredentials(),
+            client_options={"api_endpoint": Config.GCS_API_ENDPOINT},
+        )
+    return storage.Client(project=project_id)
+
+
+def poll_interval(default):
+    """Seconds between long-running operation polls; LRO_POLL_INTERVAL overrides each call site's default."""
+    return Config.LRO_POLL_INTERVAL if Config.LRO_POLL_INTERVAL is not None else default
@@ -0,0 +1,346 @@
+import base64
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from extensions import db
+from ids import new_ulid
+import logs
+import metrics
+import storage
+from models import BatchJob, BatchItem
+from vto import call_virtual_try_on
+
+logger = logging.getLogger(__name__)
+
+JOB_TYPES = ('vto', 'recontext')
+
+INT_FIELDS = ('seed', 'sample_count', 'base_steps')
+BOOL_FIELDS = ('disable_prompt_enhancement',)
+
+
+def parse_manifest(filename, content, job_type):
+    """
+    Parses a JSONL or CSV batch manifest into a list of item payloads.
+
+    JSONL lines are objects; CSV files need a header row. For recontext,
+    `image_uris` may be a list (JSONL) or a '|' separated string (CSV).
+
+    Returns:
+        A tuple (items, errors) where errors lists 'line N: reason' strings.
+    """
+    if job_type not in JOB_TYPES:
+        return [], [f"Unsupported job type '{job_type}'. Use one of: {', '.join(JOB_TYPES)}."]
+
+    text = content.decode('utf-8-sig') if isinstance(content, bytes) else content
+    if filename and filename.lower().endswith('.csv'):
+        rows = [(i + 2, row) for i, row in enumerate(csv.DictReader(io.StringIO(text)))]
+    else:
+        rows = []
+        for i, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                rows.append((i, json.loads(line)))
+            except json.JSONDecodeError as e:
+                rows.append((i, e))
+
+    items, errors = [], []
+    for line_no, row in rows:
+        if isinstance(row, Exception):
+            errors.append(f"line {line_no}: invalid JSON ({row})")
+            continue
+        if not isinstance(row, dict):
+            errors.append(f"line {line_no}: expected an object")
+            continue
+        try:
+            item = _normalize_item(row, job_type)
+        except ValueError as e:
+            errors.append(f"line {line_no}: {e}")
+            continue
+        items.append(item)
+    return items, errors
+
+
+def _normalize_item(row, job_type):
+    item = {k: v for k, v in row.items() if k and v not in (None, '')}
+    for field in INT_FIELDS:
+        if field in item:
+            try:
+                item[field] = int(item[field])
+            except (TypeError, ValueError):
+                raise ValueError(f"'{field}' must be an integer")
+    for field in BOOL_FIELDS:
+        if field in item and not isinstance(item[field], bool):
+            item[field] = str(item[field]).lower() == 'true'
+
+    if job_type == 'vto':
+        if not item.get('person_image_uri') or not item.get('product_image_uri'):
+            raise ValueError("'person_image_uri' and 'product_image_uri' are required")
+    else:
+        uris = item.get('image_uris') or item.get('image_uri')
+        if isinstance(uris, str):
+            uris = [uri.strip() for uri in uris.split('|') if uri.strip()]
+        if not uris:
+            raise ValueError("'image_uris' is required")
+        item.pop('image_uri', None)
+        item['image_uris'] = uris
+    return item
+
+
+def _unleased(now):
+    return db.or_(BatchJob.lease_expires_at.is_(None), BatchJob.lease_expires_at < now)
+
+
+def claim_job(job_id, worker_id, lease_seconds):
+    """
+    Leases a batch job to `worker_id` unless another process holds a live lease on it.
+
+    Like jobs.claim(), the lease is taken with a conditional UPDATE, so of
+    several processes resuming the same job at startup only one wins.
+    """
+    now = datetime.datetime.utcnow()
+    claimed = BatchJob.query.filter(BatchJob.job_id == job_id, _unleased(now)).update({
+        'lease_owner': worker_id,
+        'lease_expires_at': now + datetime.timedelta(seconds=lease_seconds),
+    }, synchronize_session=False)
+    db.session.commit()
+    return bool(claimed)
+
+
+def renew_job(job_id, worker_id, lease_seconds):
+    """Extends the lease on a job and its running items. Returns False if the lease was lost."""
+    expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=lease_seconds)
+    held = BatchJob.query.filter_by(job_id=job_id, lease_owner=worker_id).update(
+        {'lease_expires_at': expires}, synchronize_session=False)
+    if held:
+        BatchItem.query.filter_by(job_id=job_id, status='running').update(
+            {'lease_expires_at': expires}, synchronize_session=False)
+    db.session.commit()
+    return bool(held)
+
+
+def final_status(job_id):
+    """
+    'completed' if every item succeeded, 'failed' if none did, and
+    'completed_with_errors' if only some did.
+    """
+    counts = dict(db.session.query(BatchItem.status, db.func.count(BatchItem.id))
+                  .filter_by(job_id=job_id).group_by(BatchItem.status).all())
+    if not counts.get('failed'):
+        return 'completed'
+    return 'completed_with_errors' if counts.get('completed') else 'failed'
+
+
+class BatchRunner:
+    """
+    Runs batch job items on a bounded worker pool.
+
+    Every item's status is committed as it changes, so a job interrupted by a
+    restart can be resumed from the rows that are still pending. A job runs
+    under a lease renewed every JOB_HEARTBEAT_SECONDS, so with several
+    processes or instances each job, and each item, runs in only one of them.
+    """
+
+    def __init__(self, app, service, worker_id=None):
+        self.app = app
+        self.service = service
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{new_ulid()[-6:]}"
+        self.lease_seconds = app.config['JOB_LEASE_SECONDS']
+        self.heartbeat_seconds = app.config['JOB_HEARTBEAT_SECONDS']
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def start(self, job_id):
+        with self._lock:
+            if job_id in self._active:
+                return False
+            self._active.add(job_id)
+        threading.Thread(target=self._run, args=(job_id,), daemon=True).start()
+        return True
+
+    def is_active(self, job_id):
+        with self._lock:
+            return job_id in self._active
+
+    def resume_interrupted(self):
+        """Restarts jobs left queued or running by a process that no longer renews their lease."""
+        with self.app.app_context():
+            now = datetime.datetime.utcnow()
+            job_ids = [job.job_id for job in BatchJob.query.with_entities(BatchJob.job_id)
+                       .filter(BatchJob.status.in_(['queued', 'running']), _unleased(now))]
+        for job_id in job_ids:
+            self.start(job_id)
+        return job_ids
+
+    def _run(self, job_id):
+        lease_lost = threading.Event()
+        done = threading.Event()
+        try:
+            with self.app.app_context():
+                if not claim_job(job_id, self.worker_id, self.lease_seconds):
+                    logger.info("Batch job %s is already running in another process.", job_id)
+                    return
+                job = BatchJob.query.filter_by(job_id=job_id).first()
+                # Items a dead process left mid-flight never finished; run them again.
+                BatchItem.query.filter(
+                    BatchItem.job_id == job_id,
+                    BatchItem.status == 'running',
+                    db.or_(BatchItem.lease_expires_at.is_(None), BatchItem.lease_expires_at < datetime.datetime.utcnow()),
+                ).update({'status': 'pending'}, synchronize_session=False)
+                job_type = job.job_type
+                job.status = 'running'
+                job.started_at = job.started_at or datetime.datetime.utcnow()
+                job.finished_at = None
+                db.session.commit()
+                item_ids = [row.id for row in BatchItem.query.with_entities(BatchItem.id)
+                            .filter_by(job_id=job_id, status='pending').order_by(BatchItem.item_index)]
+
+            # Throughput is capped by the shared per-model rate limiter the
+            # predict calls go through; the semaphore only bounds in-flight work.
+            max_workers = self.app.config['BATCH_MAX_WORKERS']
+            in_flight = threading.BoundedSemaphore(max_workers)
+            threading.Thread(target=self._heartbeat_loop, args=(job_id, done, lease_lost), daemon=True).start()
+
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                for item_id in item_ids:
+                    in_flight.acquire()
+                    if lease_lost.is_set():
+                        break
+                    future = pool.submit(self._run_item, job_id, job_type, item_id)
+                    future.add_done_callback(lambda _: in_flight.release())
+
+            with self.app.app_context():
+                if lease_lost.is_set():
+                    logger.warning("Batch job %s was taken over by another process; stopped running it here.", job_id)
+                    return
+                self._release(job_id, {'status': final_status(job_id), 'finished_at': datetime.datetime.utcnow()})
+        except Exception as e:
+            logger.exception("Batch job %s stopped: %s", job_id, e)
+            with self.app.app_context():
+                self._release(job_id, {'status': 'failed'})
+        finally:
+            done.set()
+            with self._lock:
+                self._active.discard(job_id)
+
+    def _release(self, job_id, values):
+        """Records the job's final status and gives up its lease, if this process still holds it."""
+        BatchJob.query.filter_by(job_id=job_id, lease_owner=self.worker_id).update(
+            dict(values, lease_owner=None, lease_expires_at=None), synchronize_session=False)
+        db.session.commit()
+
+    def _heartbeat_loop(self, job_id, done, lease_lost):
+        while not done.wait(self.heartbeat_seconds):
+            try:
+                with self.app.app_context():
+                    if not renew_job(job_id, self.worker_id, self.lease_seconds):
+                        lease_lost.set()
+                        return
+            except Exception as e:
+                logger.warning("Renewing the lease on batch job %s failed: %s", job_id, e)
+
+    def _run_item(self, job_id, job_type, item_id):
+        with self.app.app_context(), logs.bind_operation_id(job_id):
+            item = db.session.get(BatchItem, item_id)
+            item.status = 'running'
+            item.attempts += 1
+            item.lease_expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=self.lease_seconds)
+            db.session.commit()
+            try:
+                with metrics.track_operation(f"batch_{job_type}"):
+                    image_paths = self._execute(job_type, job_id, item.item_index, json.loads(item.input_payload))
+                item.status = 'completed'
+                item.output_payload = json.dumps({'images': image_paths})
+                item.error_message = None
+            except Exception as e:
+                logger.warning("Batch item %s/%s failed: %s", job_id, item.item_index, e)
+                item.status = 'failed'
+                item.error_message = str(e)[:500]
+            item.lease_expires_at = None
+            db.session.commit()
+
+    def _execute(self, job_type, job_id, item_index, payload):
+        if job_type == 'vto':
+            response = call_virtual_try_on(
+                client=self.service.vto_client,
+                project_id=self.app.config['VTO_PROJECT_ID'],
+                location=self.app.config['LOCATION'],
+                model_endpoint_name=payload.get('model_endpoint_name', 'virtual-try-on-exp-05-31'),
+                person_image_uri=payload['person_image_uri'],
+                product_image_uri=payload['product_image_uri'],
+                prompt=payload.get('prompt'),
+                person_description=payload.get('person_description'),
+                product_description=payload.get('product_description'),
+                sample_count=payload.get('sample_count'),
+                base_steps=payload.get('base_steps'),
+                seed=payload.get('seed'),
+            )
+        else:
+            from prism import call_product_recontext
+
+            response = call_product_recontext(
+                image_uris_list=payload['image_uris'],
+                prompt=payload.get('prompt'),
+                product_description=payload.get('product_description'),
+                disable_prompt_enhancement=payload.get('disable_prompt_enhancement', False),
+                sample_count=payload.get('sample_count', 1),
+                base_steps=payload.get('base_steps'),
+                safety_setting=payload.get('safety_setting'),
+                person_generation=payload.get('person_generation'),
+                aspect_ratio=payload.get('aspect_ratio'),
+                resolution=payload.get('resolution'),
+                seed=payload.get('seed'),
+            )
+
+        image_paths = []
+        for i, prediction in enumerate(response.predictions):
+            image_paths.append(storage.save(storage.UPLOAD_DIR, base64.b64decode(prediction['bytesBase64Encoded']), '.png'))
+        if not image_paths:
+            raise RuntimeError("Model returned no images.")
+        return image_paths
+
+
+def job_progress(job):
+    """Aggregates item counts, throughput and ETA for a batch job."""
+    counts = {'pending': 0, 'running': 0, 'completed': 0, 'failed': 0}
+    rows = db.session.query(BatchItem.status, db.func.count(BatchItem.id)) \
+        .filter_by(job_id=job.job_id).group_by(BatchItem.status).all()
+    for status, count in rows:
+        counts[status] = count
+
+    done = counts['completed'] + counts['failed']
+    progress = job.to_dict()
+    progress['counts'] = counts
+    progress['percent_complete'] = round(done / job.total_items * 100, 2) if job.total_items else 100.0
+    progress['items_per_minute'] = None
+    progress['eta_seconds'] = None
+    if job.started_at and done:
+        elapsed = ((job.finished_at or datetime.datetime.utcnow()) - job.started_at).total_seconds()
+        if elapsed > 0:
+            rate = done / elapsed
+            progress['items_per_minute'] = round(rate * 60, 2)
+            if job.status == 'running':
+                progress['eta_seconds'] = round((job.total_items - done) / rate)
+    return progress
+
+
+def results_manifest(job_id):
+    """Yields one JSONL line per item with its inputs, status and outputs."""
+    query = BatchItem.query.filter_by(job_id=job_id).order_by(BatchItem.item_index)
+    for item in query.yield_per(500):
+        output = json.loads(item.output_payload) if item.output_payload else {}
+        yield json.dumps({
+            'item_index': item.item_index,
+            'status': item.status,
+            'input': json.loads(item.input_payload),
+            'images': output.get('images', []),
+            'error_message': item.error_message,
+            'attempts': item.attempts,
+        }) + '\n'
@@ -1,3 +1,4 @@
+import json
 import os
 
 class Config:
@@ -5,6 +6,111 @@ class Config:
     LOCATION = "us-central1"
     VIDEO_DIR = "static/videos"
     GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME", "gk-test-veo")
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///history.db'
+    # Web and worker processes (genmedia_worker.py) must point at the same database.
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", 'sqlite:///history.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     GEMINI_MODEL = "gemini-2.5-flash"
+    VTO_PROJECT_ID = "cloud-lvm-training-nonprod"
+    # /generate-prompt and /refine-prompt answers are reused for identical requests (same model,
+    # instructions, prompt and image) for PROMPT_CACHE_TTL_SECONDS. Requests with "fresh": true
+    # always sample a new answer; PROMPT_CACHE_MAX_ENTRIES=0 disables the cache.
+    PROMPT_CACHE_MAX_ENTRIES = int(os.environ.get("PROMPT_CACHE_MAX_ENTRIES", 1000))
+    PROMPT_CACHE_TTL_SECONDS = int(os.environ.get("PROMPT_CACHE_TTL_SECONDS", 3600))
+    # Prompt images up to this size are sent to Gemini inline; larger ones are uploaded to GCS
+    # first. Gemini caps an inline request at 20 MB, and base64 adds a third.
+    PROMPT_INLINE_IMAGE_MAX_BYTES = int(os.environ.get("PROMPT_INLINE_IMAGE_MAX_BYTES", 7 * 1024 * 1024))
+    # /generate-prompts: prompts per request, and how many run at once (still within RATE_LIMITS).
+    PROMPT_BATCH_MAX_ITEMS = int(os.environ.get("PROMPT_BATCH_MAX_ITEMS", 100))
+    PROMPT_BATCH_MAX_WORKERS = int(os.environ.get("PROMPT_BATCH_MAX_WORKERS", 8))
+
+    # Stand-in backends for offline load testing (see fake_backend.py), e.g. http://127.0.0.1:8089.
+    # Unset means the real Vertex AI / GCS endpoints with application default credentials.
+    VERTEX_API_ENDPOINT = os.environ.get("VERTEX_API_ENDPOINT")
+    GCS_API_ENDPOINT = os.environ.get("GCS_API_ENDPOINT")
+    # Overrides the per-call-site polling interval (seconds) of long-running operations.
+    LRO_POLL_INTERVAL = float(os.environ["LRO_POLL_INTERVAL"]) if os.environ.get("LRO_POLL_INTERVAL") else None
+
+    # ASGI serving mode (`uvicorn asgi:app`): blocking Flask handlers run on a pool of
+    # this many threads, started with a reduced stack size so thousands fit in memory.
+    ASGI_MAX_THREADS = int(os.environ.get("ASGI_MAX_THREADS", 1000))
+    ASGI_THREAD_STACK_KB = int(os.environ.get("ASGI_THREAD_STACK_KB", 1024))
+
+    # Fan-out of large VTO / product recontext variant sweeps
+    FANOUT_MAX_WORKERS = int(os.environ.get("FANOUT_MAX_WORKERS", 8))
+    VTO_MAX_SAMPLES_PER_CALL = int(os.environ.get("VTO_MAX_SAMPLES_PER_CALL", 4))
+    RECONTEXT_MAX_SAMPLES_PER_CALL = int(os.environ.get("RECONTEXT_MAX_SAMPLES_PER_CALL", 4))
+
+    # Catalog-scale batch jobs (VTO / product recontext manifests)
+    BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", 4))
+    BATCH_RESUME_ON_STARTUP = os.environ.get("BATCH_RESUME_ON_STARTUP", "true").lower() == "true"
+
+    # Where video / image-to-video / Veo edit generations run: 'thread' runs them on threads of
+    # the web process; 'worker' queues them in the generation_job table for `python -m genmedia_worker`.
+    JOB_EXECUTION = os.environ.get("JOB_EXECUTION", "thread")
+    WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", 8))
+    WORKER_POLL_INTERVAL = float(os.environ.get("WORKER_POLL_INTERVAL", 1.0))
+    # A worker renews the lease on each job it runs every JOB_HEARTBEAT_SECONDS. A job whose
+    # lease runs out (its worker died) is picked up by another worker, up to JOB_MAX_ATTEMPTS times.
+    JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 60))
+    JOB_HEARTBEAT_SECONDS = int(os.environ.get("JOB_HEARTBEAT_SECONDS", 15))
+    JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+
+    # Local disk budget for uploads and generated media (static/uploads, VIDEO_DIR); 0 means no limit.
+    # Past it, the least recently used files are evicted; with STORAGE_GCS_FALLBACK they are first
+    # copied to GCS_BUCKET_NAME under STORAGE_GCS_PREFIX and downloaded again when requested.
+    STORAGE_MAX_BYTES = int(os.environ.get("STORAGE_MAX_BYTES", 5 * 1024 ** 3))
+    STORAGE_GCS_FALLBACK = os.environ.get("STORAGE_GCS_FALLBACK", "true").lower() == "true"
+    STORAGE_GCS_PREFIX = os.environ.get("STORAGE_GCS_PREFIX", "artifacts/")
+    # Let a fronting proxy (nginx X-Accel / Apache mod_xsendfile) send media files instead of the app.
+    USE_X_SENDFILE = os.environ.get("USE_X_SENDFILE", "false").lower() == "true"
+    # Thumbnails (and, with PyAV installed, video posters and previews) for the history view,
+    # made on DERIVATIVE_WORKERS background threads after each output is stored.
+    DERIVATIVES_ENABLED = os.environ.get("DERIVATIVES_ENABLED", "true").lower() == "true"
+    DERIVATIVE_WORKERS = int(os.environ.get("DERIVATIVE_WORKERS", 2))
+    THUMBNAIL_MAX_PX = int(os.environ.get("THUMBNAIL_MAX_PX", 320))
+    # On startup, the storage index is reconciled with the disk. Files no history row refers to and
+    # older than the grace period are only logged, unless STORAGE_DELETE_ORPHANS is set.
+    STORAGE_CLEAN_ON_STARTUP = os.environ.get("STORAGE_CLEAN_ON_STARTUP", "true").lower() == "true"
+    STORAGE_DELETE_ORPHANS = os.environ.get("STORAGE_DELETE_ORPHANS", "false").lower() == "true"
+    STORAGE_ORPHAN_GRACE_SECONDS = int(os.environ.get("STORAGE_ORPHAN_GRACE_SECONDS", 3600))
+
+    # Duplicate submission handling for /generate-videos and /generate-image-video
+    IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_KEY_TTL_HOURS", 24))
+    COALESCE_INFLIGHT_REQUESTS = os.environ.get("COALESCE_INFLIGHT_REQUESTS", "true").lower() == "true"
+
+    # Logging: LOG_FORMAT is 'json' (one object per line, for Cloud Logging) or 'text'.
+    # Debug payload dumps are sampled and truncated so they cannot flood the logs.
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+    LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", 0.1))
+    LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", 500))
+
+    # Opt-in cProfile of hot handlers (/vto, /product-recontext, /imagen-edit, /segment-image):
+    # always on with PROFILING_ENABLED, or per request by sending the PROFILE_HEADER header.
+    PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() == "true"
+    PROFILE_HEADER = os.environ.get("PROFILE_HEADER", "X-Profile")
+    PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+    PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 200))
+
+    # Retries of transient Vertex AI / GCS errors (429, 5xx, connection resets)
+    RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", 5))
+    RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", 2.0))
+    RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", 60.0))
+    RETRY_MAX_RESUBMITS = int(os.environ.get("RETRY_MAX_RESUBMITS", 3))
+
+    # Per-model request quotas, keyed by model name prefix (longest prefix wins).
+    # Calls over the limit queue until a token is free. Override with a JSON
+    # object in RATE_LIMITS or at runtime through /save-settings.
+    RATE_LIMITS = {
+        'veo-3.0-fast': {'per_minute': 10, 'burst': 2},
+        'veo-3.0': {'per_minute': 10, 'burst': 2},
+        'veo-2.0': {'per_minute': 10, 'burst': 2},
+        'imagen-4.0': {'per_minute': 20, 'burst': 4},
+        'imagen-3.0-capability': {'per_minute': 60, 'burst': 5},
+        'imagen-3.0-generate': {'per_minute': 60, 'burst': 5},
+        'imagen-product-recontext': {'per_minute': 30, 'burst': 4},
+        'virtual-try-on': {'per_minute': 30, 'burst': 4},
+        'image-segmentation': {'per_minute': 60, 'burst': 5},
+        'gemini': {'per_minute': 300, 'burst': 10},
+    }
+    RATE_LIMITS.update(json.loads(os.environ.get("RATE_LIMITS", "{}")))
@@ -0,0 +1,141 @@
+"""
+Small derivatives of stored media for the history view: a WebP thumbnail of
+each image, and a WebP poster frame plus a short low-bitrate preview clip of
+each video. They are made on background threads after a file is stored, and
+recorded on its StoredFile row.
+
+Video derivatives need PyAV (`pip install av`). Without it, videos get none and
+the history view falls back to the full file.
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from PIL import Image
+
+import storage
+from extensions import db
+from models import StoredFile
+
+try:
+    import av
+except ImportError:
+    av = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+VIDEO_EXTENSIONS = ('.mp4',)
+WEBP_QUALITY = 80
+PREVIEW_SECONDS = 3
+PREVIEW_BIT_RATE = 250_000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='derivatives')
+        return _executor
+
+
+def schedule(key):
+    """Queues derivatives of a stored file. Returns the Future, or None if the file gets none."""
+    config = current_app.config
+    if not config['DERIVATIVES_ENABLED'] or not key.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+        return None
+    app = current_app._get_current_object()
+    return _get_executor(config['DERIVATIVE_WORKERS']).submit(_create_in_background, app, key)
+
+
+def _create_in_background(app, key):
+    try:
+        with app.app_context():
+            create(key)
+    except Exception as e:
+        logger.warning("Could not make derivatives of %s: %s", key, e)
+
+
+def create(key):
+    """Makes the missing derivatives of one stored file."""
+    record = StoredFile.query.filter_by(path=key).one_or_none()
+    if record is None or record.thumbnail_path:
+        return
+    path = storage.ensure_local(key)
+    if path is None:
+        return
+    max_px = current_app.config['THUMBNAIL_MAX_PX']
+    thumbnail_path = preview_path = None
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        with Image.open(path) as image:
+            thumbnail_path = storage.save(storage.UPLOAD_DIR, to_webp(image, max_px), '.webp', derive=False)
+    elif av is not None:
+        thumbnail_path = storage.save(storage.UPLOAD_DIR, video_poster(path, max_px), '.webp', derive=False)
+        partial = f"{path}.preview.part"
+        try:
+            write_preview(path, partial, max_px * 2)
+            preview_path = storage.save_file(current_app.config['VIDEO_DIR'], partial, '.mp4', derive=False)
+        except Exception as e:
+            # The poster is still worth keeping, e.g. if this FFmpeg build has no H.264 encoder.
+            logger.warning("Could not make a preview of %s: %s", key, e)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+    else:
+        return
+    StoredFile.query.filter_by(path=key).update({'thumbnail_path': thumbnail_path, 'preview_path': preview_path})
+    db.session.commit()
+
+
+def to_webp(image, max_px):
+    image = image.copy()
+    image.thumbnail((max_px, max_px))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    buf = io.BytesIO()
+    image.save(buf, format='WEBP', quality=WEBP_QUALITY)
+    return buf.getvalue()
+
+
+def video_poster(path, max_px):
+    """The first frame of a video, as a WebP thumbnail."""
+    with av.open(path) as container:
+        for frame in container.decode(video=0):
+            return to_webp(frame.to_image(), max_px)
+    raise ValueError("Video has no frames.")
+
+
+def write_preview(path, output_path, max_px):
+    """Writes the first PREVIEW_SECONDS of a video, scaled to `max_px` and without audio, as H.264."""
+    with av.open(path) as source, av.open(output_path, 'w', format='mp4') as output:
+        stream_in = source.streams.video[0]
+        scale = min(1.0, max_px / max(stream_in.width, stream_in.height))
+        stream_out = output.add_stream('libx264', rate=stream_in.average_rate or 24)
+        # H.264 with yuv420p needs even dimensions.
+        stream_out.width = max(2, int(stream_in.width * scale) // 2 * 2)
+        stream_out.height = max(2, int(stream_in.height * scale) // 2 * 2)
+        stream_out.pix_fmt = 'yuv420p'
+        stream_out.bit_rate = PREVIEW_BIT_RATE
+        for frame in source.decode(stream_in):
+            if frame.time is not None and frame.time >= PREVIEW_SECONDS:
+                break
+            scaled = frame.reformat(width=stream_out.width, height=stream_out.height, format='yuv420p')
+            output.mux(stream_out.encode(scaled))
+        output.mux(stream_out.encode(None))
+
+
+def for_paths(urls):
+    """Maps each media URL path to its derivative URLs, for those that have any."""
+    keys = sorted({url.lstrip('/') for url in urls if url})
+    found = {}
+    for start in range(0, len(keys), 500):
+        rows = StoredFile.query.filter(StoredFile.path.in_(keys[start:start + 500]), StoredFile.thumbnail_path.isnot(None))
+        for row in rows:
+            found[f"/{row.path}"] = {'thumbnail': row.thumbnail_path, 'preview': row.preview_path}
+    return found
@@ -0,0 +1,474 @@
+"""
+Local stand-in for the Vertex AI and GCS endpoints the app calls, for
+load tests and benchmarks that must not spend quota or touch the network.
+
+    python fake_backend.py --port 8089 --latency 0.5 --lro-seconds 20 --failure-rate 0.02
+
+Then start the app with:
+
+    VERTEX_API_ENDPOINT=http://127.0.0.1:8089 GCS_API_ENDPOINT=http://127.0.0.1:8089 \
+    LRO_POLL_INTERVAL=1 python app.py
+
+Emulated endpoints (any API version prefix):
+    POST .../models/<model>:predict                  VTO, recontext, Imagen, segmentation
+    POST .../models/<model>:predictLongRunning       Veo (REST and genai generate_videos)
+    POST .../models/<model>:fetchPredictOperation    Veo polling
+    POST .../models/<model>:generateContent          Gemini via genai
+    POST .../models/<model>:streamGenerateContent    Gemini streaming via genai (server-sent events)
+    GET  .../publishers/google/models/<model>        model lookup done by vertexai from_pretrained
+    GCS JSON API: bucket get, object upload (multipart/resumable), metadata and media download
+
+Latency, error rate and payload sizes are set on the command line and can be
+changed at runtime with POST /_fake/config; GET /_fake/stats returns request
+counts per endpoint.
+"""
+import argparse
+import base64
+import io
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+from PIL import Image
+
+SEGMENTATION_SCHEMA = "gs://google-cloud-aiplatform/schema/predict/instance/image_segmentation_model_1.0.0.yaml"
+IMAGE_GENERATION_SCHEMA = "gs://google-cloud-aiplatform/schema/predict/instance/vision_generative_model_1.0.0.yaml"
+
+DEFAULT_CONFIG = {
+    'latency': 0.2,          # mean seconds added to every Vertex AI call
+    'latency_jitter': 0.1,   # +/- uniform jitter around `latency`
+    'gcs_latency': 0.02,     # seconds added to every GCS call
+    'lro_seconds': 5.0,      # time until a long-running operation reports done
+    'failure_rate': 0.0,     # fraction of Vertex AI calls answered with an HTTP error
+    'failure_status': 503,   # HTTP status used for injected failures (429 for quota)
+    'lro_failure_rate': 0.0, # fraction of operations that finish with RESOURCE_EXHAUSTED
+    'image_size': 1024,      # width/height in pixels of generated images and masks
+    'video_bytes': 2 << 20,  # size of generated videos
+    'text_chars': 800,       # length of generated Gemini text
+    'stream_chunks': 4,      # chunks a streamed Gemini answer is split into
+    'stream_chunk_interval': 0.05,  # seconds between streamed chunks (`latency` precedes the first)
+}
+
+MODEL_PATH = re.compile(r'/models/(?P<model>[^/:]+):(?P<method>\w+)$')
+PUBLISHER_MODEL_PATH = re.compile(r'/publishers/google/models/(?P<model>[^/:]+)$')
+BUCKET_PATH = re.compile(r'^/storage/v1/b/(?P<bucket>[^/]+)$')
+OBJECT_PATH = re.compile(r'^/(?:download/)?storage/v1/b/(?P<bucket>[^/]+)/o/(?P<name>.+)$')
+UPLOAD_PATH = re.compile(r'^/upload/storage/v1/b/(?P<bucket>[^/]+)/o$')
+
+
+class FakeBackend:
+    """State shared by all handler threads: config, operations, blobs and stats."""
+
+    def __init__(self, seed=0, **config):
+        self.config = dict(DEFAULT_CONFIG, **config)
+        self.random = random.Random(seed)
+        self.operations = {}
+        self.blobs = {}
+        self.uploads = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        self._payload_cache = {}
+
+    def update_config(self, values):
+        with self.lock:
+            unknown = set(values) - set(self.config)
+            if unknown:
+                raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+            self.config.update(values)
+            self._payload_cache.clear()
+            return dict(self.config)
+
+    def count(self, endpoint):
+        with self.lock:
+            self.stats[endpoint] = self.stats.get(endpoint, 0) + 1
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def delay(self, seconds, jitter=0.0):
+        with self.lock:
+            seconds += self.random.uniform(-jitter, jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def _cached(self, key, build):
+        with self.lock:
+            value = self._payload_cache.get(key)
+        if value is None:
+            value = build()
+            with self.lock:
+                self._payload_cache[key] = value
+        return value
+
+    def image_b64(self, mode='RGB'):
+        size = self.config['image_size']
+
+        def build():
+            # Noise compresses poorly, so PNG sizes resemble real photos.
+            image = Image.frombytes(mode, (size, size), random.Random(size).randbytes(size * size * len(mode)))
+            buf = io.BytesIO()
+            image.save(buf, format='PNG')
+            return base64.b64encode(buf.getvalue()).decode('utf-8')
+        return self._cached(('image', mode, size), build)
+
+    def video_bytes(self):
+        size = self.config['video_bytes']
+        # An mp4 `ftyp` box followed by filler; enough for clients that sniff the type.
+        header = b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom'
+        return self._cached(('video', size), lambda: header + random.Random(size).randbytes(max(size - len(header), 0)))
+
+    def text(self, prompt):
+        chars = self.config['text_chars']
+        body = f"Cinematic shot. {prompt[:200]} " * (chars // 100 + 1)
+        return json.dumps({'prompt': body[:chars]})
+
+
+class FakeBackendHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeVertex/1.0'
+
+    @property
+    def backend(self):
+        return self.server.backend
+
+    def log_message(self, format, *args):
+        pass
+
+    # -- plumbing ---------------------------------------------------------
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def send_json(self, body, status=200, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status, message):
+        statuses = {400: 'INVALID_ARGUMENT', 404: 'NOT_FOUND', 429: 'RESOURCE_EXHAUSTED', 503: 'UNAVAILABLE'}
+        self.send_json({'error': {'code': status, 'message': message, 'status': statuses.get(status, 'INTERNAL')}}, status)
+
+    def inject_failure(self):
+        config = self.backend.config
+        if self.backend.roll(config['failure_rate']):
+            self.backend.count('injected_failure')
+            self.send_error_json(config['failure_status'], "Injected failure from fake backend.")
+            return True
+        return False
+
+    # -- dispatch ---------------------------------------------------------
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/_fake/stats':
+            with self.backend.lock:
+                return self.send_json({'requests': dict(self.backend.stats), 'config': dict(self.backend.config)})
+        match = PUBLISHER_MODEL_PATH.search(url.path)
+        if match:
+            return self.publisher_model(match['model'])
+        self.backend.delay(self.backend.config['gcs_latency'])
+        match = BUCKET_PATH.match(url.path)
+        if match:
+            self.backend.count('gcs.get_bucket')
+            return self.send_json({'kind': 'storage#bucket', 'name': match['bucket'], 'id': match['bucket']})
+        match = OBJECT_PATH.match(url.path)
+        if match:
+            return self.get_object(match['bucket'], unquote(match['name']), parse_qs(url.query))
+        self.send_error_json(404, f"No fake handler for GET {url.path}")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.read_body()
+        if url.path == '/_fake/config':
+            try:
+                return self.send_json(self.backend.update_config(json.loads(body or b'{}')))
+            except ValueError as e:
+                return self.send_error_json(400, str(e))
+        match = UPLOAD_PATH.match(url.path)
+        if match:
+            self.backend.delay(self.backend.config['gcs_latency'])
+            return self.start_upload(match['bucket'], parse_qs(url.query), body)
+        match = MODEL_PATH.search(url.path)
+        if not match:
+            return self.send_error_json(404, f"No fake handler for POST {url.path}")
+
+        model, method = match['model'], match['method']
+        self.backend.count(f"{method}.{model}")
+        config = self.backend.config
+        self.backend.delay(config['latency'], config['latency_jitter'])
+        if self.inject_failure():
+            return
+        request = json.loads(body or b'{}')
+        if method == 'predict':
+            return self.predict(model, request)
+        if method == 'predictLongRunning':
+            return self.predict_long_running(model, url.path, request)
+        if method == 'fetchPredictOperation':
+            return self.fetch_operation(request)
+        if method == 'generateContent':
+            return self.generate_content(request)
+        if method == 'streamGenerateContent':
+            return self.stream_generate_content(request)
+        self.send_error_json(404, f"Method {method} is not emulated.")
+
+    def do_PUT(self):
+        url = urlparse(self.path)
+        body = self.read_body()
+        self.backend.delay(self.backend.config['gcs_latency'])
+        upload_id = parse_qs(url.query).get('upload_id', [None])[0]
+        if UPLOAD_PATH.match(url.path) and upload_id:
+            return self.continue_upload(upload_id, body)
+        self.send_error_json(404, f"No fake handler for PUT {url.path}")
+
+    # -- Vertex AI --------------------------------------------------------
+
+    def publisher_model(self, model):
+        self.backend.count(f"publisher_model.{model}")
+        schema = SEGMENTATION_SCHEMA if 'segmentation' in model else IMAGE_GENERATION_SCHEMA
+        self.send_json({
+            'name': f"publishers/google/models/{model}",
+            'publisherModelTemplate': f"projects/{{user-project}}/locations/{{location}}/publishers/google/models/{model}",
+            'predictSchemata': {'instanceSchemaUri': schema},
+        })
+
+    def predict(self, model, request):
+        parameters = request.get('parameters') or {}
+        if 'segmentation' in model:
+            predictions = [{
+                'bytesBase64Encoded': self.backend.image_b64('L'),
+                'mimeType': 'image/png',
+                'labels': [{'label': 'foreground', 'score': 0.97}],
+            }]
+        else:
+            count = int(parameters.get('sampleCount') or 1) * max(len(request.get('instances') or [1]), 1)
+            predictions = [{'bytesBase64Encoded': self.backend.image_b64(), 'mimeType': 'image/png'} for _ in range(count)]
+        self.send_json({'predictions': predictions, 'deployedModelId': 'fake'})
+
+    def predict_long_running(self, model, path, request):
+        prefix = path[:path.index('/models/')]
+        name = f"{prefix.split('/v1', 1)[-1].split('/', 1)[-1]}/models/{model}/operations/{uuid.uuid4()}"
+        name = name.lstrip('/')
+        with self.backend.lock:
+            self.backend.operations[name] = {
+                'done_at': time.monotonic() + self.backend.config['lro_seconds'],
+                'parameters': request.get('parameters') or {},
+                'fails': self.backend.random.random() < self.backend.config['lro_failure_rate'],
+            }
+        self.send_json({'name': name})
+
+    def fetch_operation(self, request):
+        name = request.get('operationName')
+        with self.backend.lock:
+            operation = self.backend.operations.get(name)
+        if operation is None:
+            return self.send_error_json(404, f"Operation {name} not found.")
+        if time.monotonic() < operation['done_at']:
+            return self.send_json({'name': name, 'done': False})
+        if operation['fails']:
+            return self.send_json({'name': name, 'done': True, 'error': {'code': 8, 'message': 'Resource exhausted (fake).'}})
+
+        parameters = operation['parameters']
+        video_bytes = self.backend.video_bytes()
+        videos = []
+        for i in range(int(parameters.get('sampleCount') or 1)):
+            storage_uri = parameters.get('storageUri')
+            if storage_uri:
+                bucket, _, prefix = storage_uri[len('gs://'):].partition('/')
+                object_name = f"{prefix.rstrip('/')}/{name.rsplit('/', 1)[-1]}/sample_{i}.mp4".lstrip('/')
+                with self.backend.lock:
+                    self.backend.blobs[(bucket, object_name)] = (video_bytes, 'video/mp4')
+                videos.append({'gcsUri': f"gs://{bucket}/{object_name}", 'mimeType': 'video/mp4'})
+            else:
+                videos.append({'bytesBase64Encoded': base64.b64encode(video_bytes).decode('utf-8'), 'mimeType': 'video/mp4'})
+        self.send_json({
+            'name': name,
+            'done': True,
+            'response': {
+                '@type': 'type.googleapis.com/cloud.ai.large_models.vision.GenerateVideoResponse',
+                'raiMediaFilteredCount': 0,
+                'videos': videos,
+            },
+        })
+
+    @staticmethod
+    def prompt_text(request):
+        prompt = ''
+        for content in request.get('contents') or []:
+            for part in content.get('parts') or []:
+                prompt += part.get('text', '')
+        return prompt
+
+    def content_response(self, prompt, text, finished=True):
+        response = {
+            'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}}],
+            'modelVersion': 'fake',
+        }
+        if finished:
+            response['candidates'][0]['finishReason'] = 'STOP'
+            response['usageMetadata'] = {
+                'promptTokenCount': len(prompt) // 4, 'candidatesTokenCount': self.backend.config['text_chars'] // 4,
+            }
+        return response
+
+    def generate_content(self, request):
+        prompt = self.prompt_text(request)
+        self.send_json(self.content_response(prompt, self.backend.text(prompt)))
+
+    def stream_generate_content(self, request):
+        """Sends the answer as `data:` events (genai asks for ?alt=sse), one per chunk."""
+        prompt = self.prompt_text(request)
+        text = self.backend.text(prompt)
+        count = max(int(self.backend.config['stream_chunks']), 1)
+        size = -(-len(text) // count)
+        chunks = [text[i:i + size] for i in range(0, len(text), size)] or ['']
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for i, chunk in enumerate(chunks):
+            if i:
+                self.backend.delay(self.backend.config['stream_chunk_interval'])
+            event = self.content_response(prompt, chunk, finished=i == len(chunks) - 1)
+            self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode())
+            self.wfile.flush()
+
+    # -- GCS --------------------------------------------------------------
+
+    def object_resource(self, bucket, name, data, content_type):
+        return {
+            'kind': 'storage#object', 'bucket': bucket, 'name': name, 'id': f"{bucket}/{name}/1",
+            'size': str(len(data)), 'contentType': content_type, 'generation': '1', 'metageneration': '1',
+            'selfLink': f"/storage/v1/b/{bucket}/o/{quote(name, safe='')}",
+        }
+
+    def get_object(self, bucket, name, query):
+        with self.backend.lock:
+            blob = self.backend.blobs.get((bucket, name))
+        if blob is None:
+            return self.send_error_json(404, f"No such object: {bucket}/{name}")
+        data, content_type = blob
+        if query.get('alt') != ['media']:
+            self.backend.count('gcs.get_metadata')
+            return self.send_json(self.object_resource(bucket, name, data, content_type))
+
+        self.backend.count('gcs.download')
+        status, start, end = 200, 0, len(data) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+        if match:
+            status, start = 206, int(match[1])
+            end = min(int(match[2]), end) if match[2] else end
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(data)}")
+        self.end_headers()
+        self.wfile.write(data[start:end + 1])
+
+    def start_upload(self, bucket, query, body):
+        upload_type = query.get('uploadType', ['media'])[0]
+        if upload_type == 'multipart':
+            metadata, data, content_type = self.parse_multipart(body)
+            return self.store_object(bucket, metadata.get('name') or query.get('name', [''])[0], data, content_type)
+        if upload_type == 'resumable':
+            metadata = json.loads(body or b'{}')
+            upload_id = uuid.uuid4().hex
+            with self.backend.lock:
+                self.backend.uploads[upload_id] = {
+                    'bucket': bucket,
+                    'name': metadata.get('name') or query.get('name', [''])[0],
+                    'content_type': self.headers.get('X-Upload-Content-Type') or metadata.get('contentType') or 'application/octet-stream',
+                    'data': bytearray(),
+                }
+            location = f"http://{self.headers.get('Host')}/upload/storage/v1/b/{bucket}/o?uploadType=resumable&upload_id={upload_id}"
+            self.backend.count('gcs.upload_start')
+            return self.send_json({}, headers={'Location': location})
+        return self.store_object(bucket, query.get('name', [''])[0], body, self.headers.get('Content-Type') or 'application/octet-stream')
+
+    def continue_upload(self, upload_id, body):
+        with self.backend.lock:
+            upload = self.backend.uploads.get(upload_id)
+            if upload is None:
+                return self.send_error_json(404, "Unknown upload.")
+            upload['data'].extend(body)
+            size = len(upload['data'])
+        total = (self.headers.get('Content-Range') or '').rsplit('/', 1)[-1]
+        if total == '*':
+            self.send_response(308)
+            self.send_header('Range', f"bytes=0-{size - 1}")
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        with self.backend.lock:
+            self.backend.uploads.pop(upload_id, None)
+        self.store_object(upload['bucket'], upload['name'], bytes(upload['data']), upload['content_type'])
+
+    def store_object(self, bucket, name, data, content_type):
+        with self.backend.lock:
+            self.backend.blobs[(bucket, name)] = (data, content_type)
+        self.backend.count('gcs.upload')
+        self.send_json(self.object_resource(bucket, name, data, content_type))
+
+    def parse_multipart(self, body):
+        boundary = re.search(r'boundary="?([^";]+)"?', self.headers.get('Content-Type', ''))[1].encode()
+        parts = [p for p in body.split(b'--' + boundary) if p.strip() not in (b'', b'--')]
+        metadata, data, content_type = {}, b'', 'application/octet-stream'
+        for i, part in enumerate(parts):
+            head, _, content = part.lstrip(b'\r\n').partition(b'\r\n\r\n')
+            content = content[:-2] if content.endswith(b'\r\n') else content
+            if i == 0:
+                metadata = json.loads(content or b'{}')
+            else:
+                data = content
+                match = re.search(rb'content-type:\s*([^\r\n]+)', head, re.IGNORECASE)
+                content_type = match[1].decode() if match else metadata.get('contentType', content_type)
+        return metadata, data, content_type
+
+
+def create_server(host='127.0.0.1', port=8089, seed=0, **config):
+    """Creates (but does not start) a fake backend server; port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), FakeBackendHandler)
+    server.daemon_threads = True
+    server.backend = FakeBackend(seed=seed, **config)
+    return server
+
+
+def start_in_thread(**kwargs):
+    """Starts a fake backend on a daemon thread and returns (server, base_url)."""
+    server = create_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Vertex AI / GCS backend.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--seed', type=int, default=0, help="Seed for latency jitter and failure injection.")
+    for key, default in DEFAULT_CONFIG.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", dest=key, type=type(default), default=default)
+    args = vars(parser.parse_args())
+    server = create_server(**args)
+    print(f"Fake Vertex AI / GCS backend listening on http://{args['host']}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def plan_fan_out(sample_count, seeds=None, max_samples_per_call=4):
+    """
+    Splits a multi-variant request into predict calls the model will accept.
+
+    Each requested seed gets `sample_count` variants, spread over as many calls
+    as `max_samples_per_call` requires. Follow-up calls for the same seed use
+    seed + n so that the chunks don't return identical images.
+
+    Returns:
+        A list of dicts with 'first_sample', 'sample_count' and 'seed' keys.
+    """
+    sample_count = max(int(sample_count or 1), 1)
+    max_samples_per_call = max(int(max_samples_per_call or 1), 1)
+    chunks = []
+    next_sample = 0
+    for seed in (seeds or [None]):
+        remaining = sample_count
+        offset = 0
+        while remaining > 0:
+            count = min(remaining, max_samples_per_call)
+            chunk_seed = seed + offset if seed is not None else None
+            chunks.append({'first_sample': next_sample, 'sample_count': count, 'seed': chunk_seed})
+            next_sample += count
+            remaining -= count
+            offset += 1
+    return chunks
+
+
+def fan_out(call, chunks, max_workers=8):
+    """
+    Runs `call(sample_count=..., seed=...)` for every chunk on a bounded pool.
+
+    Yields one result per sample as soon as its chunk finishes, so callers can
+    stream images back before the slowest call returns. A failed chunk yields
+    an error entry for each sample it was supposed to produce.
+    """
+    if not chunks:
+        return
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks))))
+    try:
+        futures = {
+            executor.submit(call, sample_count=chunk['sample_count'], seed=chunk['seed']): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                predictions = list(future.result().predictions)
+                error = None
+            except Exception as e:
+                predictions = []
+                error = str(e)
+            for i in range(chunk['sample_count']):
+                result = {'sample': chunk['first_sample'] + i, 'seed': chunk['seed']}
+                if error:
+                    result['error'] = error
+                elif i < len(predictions):
+                    result['prediction'] = predictions[i]
+                else:
+                    result['error'] = "Model returned fewer samples than requested."
+                yield result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_each(call, items, max_workers=8):
+    """
+    Runs `call(item)` for every item on a bounded pool.
+
+    Yields (index, result, error) as each call finishes, in completion order.
+    A call that raises yields its exception as `error` (and None as result)
+    without affecting the others.
+    """
+    if not items:
+        return
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    try:
+        futures = {executor.submit(call, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_seeds(seeds):
+    """Parses a comma-separated seed list; an empty value means no explicit seeds."""
+    if not seeds:
+        return None
+    return [int(seed.strip()) for seed in str(seeds).split(',') if seed.strip()]
+
@@ -0,0 +1,60 @@
+"""
+Worker tier: runs queued video, image-to-video and Veo edit generations.
+
+    JOB_EXECUTION=worker gunicorn ... app:app      # web tier only queues jobs
+    JOB_EXECUTION=worker python -m genmedia_worker  # any number of these run them
+
+Both tiers must share the database (DATABASE_URL) and the static/ directory.
+Jobs are leased from the generation_job table (see jobs.Worker). A worker
+renews its leases with a heartbeat while the jobs run. If a worker dies, its
+leases expire and other workers pick the jobs up again.
+"""
+import argparse
+import os
+import signal
+
+from flask import Flask
+
+from config import Config
+from database import init_db
+from extensions import db
+from jobs import Worker
+import logs
+
+
+def create_worker_app():
+    """The web app's config, database and clients, without routes."""
+    from services import AppService
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    logs.configure_logging(
+        level=app.config['LOG_LEVEL'],
+        fmt=app.config['LOG_FORMAT'],
+        payload_sample_rate=app.config['LOG_PAYLOAD_SAMPLE_RATE'],
+        payload_max_chars=app.config['LOG_PAYLOAD_MAX_CHARS'],
+    )
+    db.init_app(app)
+    service = AppService(app)
+    service.init_clients(app.config['PROJECT_ID'], app.config['LOCATION'])
+    init_db(app)
+    os.makedirs(app.config['VIDEO_DIR'], exist_ok=True)
+    return app, service
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run queued generation jobs (JOB_EXECUTION=worker).")
+    parser.add_argument('--concurrency', type=int, help="Jobs run at once (default WORKER_CONCURRENCY).")
+    parser.add_argument('--worker-id', help="Lease owner name (default host:pid:random).")
+    options = parser.parse_args(argv)
+
+    app, service = create_worker_app()
+    worker = Worker.from_config(app, service, concurrency=options.concurrency, worker_id=options.worker_id)
+    # SIGTERM (e.g. a scale-down) stops claiming and lets running jobs finish.
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import datetime
+import hashlib
+import json
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import GenerationHistory, IdempotencyKey
+
+# Serializes the "look for an in-flight twin, else create" step within this process.
+coalesce_lock = threading.Lock()
+
+
+def request_fingerprint(endpoint, **fields):
+    """Hashes the fields that make two generation requests interchangeable."""
+    canonical = json.dumps({'endpoint': endpoint, **fields}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def find_inflight(fingerprint):
+    """Returns a queued or running GenerationHistory row with the same fingerprint, if any."""
+    return GenerationHistory.query.filter(
+        GenerationHistory.request_fingerprint == fingerprint,
+        GenerationHistory.status.in_(['queued', 'running']),
+    ).order_by(GenerationHistory.id).first()
+
+
+def begin(key, endpoint, request_hash, ttl_hours, wait_seconds=5.0):
+    """
+    Claims an Idempotency-Key for a new request.
+
+    Returns None when the caller should go ahead and process the request, or
+    a response to send back instead: the stored response of the original
+    request, or an error if the key was reused for a different request.
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=ttl_hours)
+    IdempotencyKey.query.filter(IdempotencyKey.key == key, IdempotencyKey.created_at < cutoff).delete()
+    db.session.add(IdempotencyKey(key=key, endpoint=endpoint, request_hash=request_hash))
+    try:
+        db.session.commit()
+        return None
+    except IntegrityError:
+        db.session.rollback()
+
+    # Another request owns the key; give it a moment to finish submitting.
+    deadline = time.monotonic() + wait_seconds
+    while True:
+        record = IdempotencyKey.query.filter_by(key=key).first()
+        if record is None:
+            return begin(key, endpoint, request_hash, ttl_hours, wait_seconds)
+        if record.endpoint != endpoint or record.request_hash != request_hash:
+            return {'error': 'Idempotency-Key was already used for a different request.'}, 422
+        if record.response is not None:
+            return json.loads(record.response)
+        if time.monotonic() >= deadline:
+            return {'error': 'A request with this Idempotency-Key is still being processed.'}, 409
+        time.sleep(0.1)
+        db.session.expire_all()
+
+
+def complete(key, response):
+    """Stores the response for replay to later requests with the same key."""
+    record = IdempotencyKey.query.filter_by(key=key).first()
+    record.response = json.dumps(response)
+    db.session.commit()
+
+
+def release(key):
+    """Frees a key whose request failed, so the client may retry with it."""
+    IdempotencyKey.query.filter_by(key=key, response=None).delete()
+    db.session.commit()
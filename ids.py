@@ -0,0 +1,47 @@
+import os
+import threading
+import time
+
+# Crockford base32: no I, L, O or U, so IDs stay unambiguous and sort lexically.
+CROCKFORD32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+_RANDOM_BITS = 80
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+
+def _encode(value, length):
+    chars = []
+    for _ in range(length):
+        value, remainder = divmod(value, 32)
+        chars.append(CROCKFORD32[remainder])
+    return ''.join(reversed(chars))
+
+
+def new_ulid():
+    """
+    Returns a 26-character ULID: 48 bits of millisecond timestamp followed by
+    80 random bits.
+
+    IDs generated in the same millisecond (or after the clock steps back)
+    reuse the previous timestamp and increment the random part, so the
+    sequence is strictly increasing within the process and never collides.
+    """
+    global _last_ms, _last_random
+    with _lock:
+        now_ms = int(time.time() * 1000)
+        if now_ms > _last_ms:
+            _last_ms = now_ms
+            _last_random = int.from_bytes(os.urandom(_RANDOM_BITS // 8), 'big')
+        else:
+            _last_random += 1
+            if _last_random >= 1 << _RANDOM_BITS:
+                _last_ms += 1
+                _last_random = 0
+        return _encode(_last_ms, 10) + _encode(_last_random, 16)
+
+
+def new_operation_id(prefix):
+    """Returns an operation ID such as 'vto_op_01J9Z3K6V1XQ4M8T2N5R7B0C9D'."""
+    return f"{prefix}_{new_ulid()}"
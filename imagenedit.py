@@ -17,7 +17,6 @@ import io
 import os
 import urllib
 
-from google import genai
 from google.genai.types import (
     EditImageConfig,
     GenerateImagesConfig,
@@ -28,6 +27,24 @@ from google.genai.types import (
 )
 from PIL import Image as PIL_Image
 
+import metrics
+import backends
+from ratelimit import rate_limiter
+from retry import default_policy
+
+GENERATE_MODEL = "imagen-3.0-generate-002"
+EDIT_MODEL = "imagen-3.0-capability-001"
+
+
+def _call(model, method, **kwargs):
+    """Calls an Imagen client method within the model's rate limit, retrying transient errors."""
+    def call():
+        rate_limiter.acquire(model)
+        return method(model=model, **kwargs)
+
+    with metrics.track_model_call(model):
+        return default_policy.call(call)
+
 
 def get_bytes_from_pil(image: PIL_Image) -> bytes:
     """Gets the image bytes from a PIL Image object."""
@@ -38,13 +55,14 @@ def get_bytes_from_pil(image: PIL_Image) -> bytes:
 
 def initialize_imagen_client(project_id, location):
     """Initializes the Imagen client."""
-    return genai.Client(vertexai=True, project=project_id, location=location)
+    return backends.genai_client(project_id, location)
 
 
 def generate_image(client, prompt, aspect_ratio="1:1"):
     """Generates an image using Imagen 3."""
-    return client.models.generate_images(
-        model="imagen-3.0-generate-002",
+    return _call(
+        GENERATE_MODEL,
+        client.models.generate_images,
         prompt=prompt,
         config=GenerateImagesConfig(
             number_of_images=1,
@@ -75,8 +93,9 @@ def inpainting_insert(
         reference_image=mask_image,
         config=mask_config,
     )
-    return client.models.edit_image(
-        model="imagen-3.0-capability-001",
+    return _call(
+        EDIT_MODEL,
+        client.models.edit_image,
         prompt=edit_prompt,
         reference_images=[raw_ref_image, mask_ref_image],
         config=EditImageConfig(
@@ -98,8 +117,9 @@ def inpainting_remove(client, original_image, segmentation_classes):
             mask_mode="MASK_MODE_SEMANTIC", segmentation_classes=segmentation_classes
         ),
     )
-    return client.models.edit_image(
-        model="imagen-3.0-capability-001",
+    return _call(
+        EDIT_MODEL,
+        client.models.edit_image,
         prompt="",
         reference_images=[raw_ref_image, mask_ref_image],
         config=EditImageConfig(
@@ -119,8 +139,9 @@ def product_background_swap(client, prompt, product_image):
         reference_image=None,
         config=MaskReferenceConfig(mask_mode="MASK_MODE_BACKGROUND"),
     )
-    return client.models.edit_image(
-        model="imagen-3.0-capability-001",
+    return _call(
+        EDIT_MODEL,
+        client.models.edit_image,
         prompt=prompt,
         reference_images=[raw_ref_image, mask_ref_image],
         config=EditImageConfig(
@@ -157,8 +178,9 @@ def outpainting(client, prompt, initial_image, target_size=(1536, 1536)):
             mask_dilation=0.03,
         ),
     )
-    return client.models.edit_image(
-        model="imagen-3.0-capability-001",
+    return _call(
+        EDIT_MODEL,
+        client.models.edit_image,
         prompt=prompt,
         reference_images=[raw_ref_image, mask_ref_image],
         config=EditImageConfig(
@@ -173,8 +195,9 @@ def outpainting(client, prompt, initial_image, target_size=(1536, 1536)):
 def mask_free_edit(client, prompt, original_image):
     """Edits an image without a mask."""
     raw_ref_image = RawReferenceImage(reference_image=original_image, reference_id=0)
-    return client.models.edit_image(
-        model="imagen-3.0-capability-001",
+    return _call(
+        EDIT_MODEL,
+        client.models.edit_image,
         prompt=prompt,
         reference_images=[raw_ref_image],
         config=EditImageConfig(
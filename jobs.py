@@ -0,0 +1,374 @@
+import datetime
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from extensions import db
+from ids import new_ulid
+import logs
+import storage
+from models import GenerationHistory, GenerationJob
+
+logger = logging.getLogger(__name__)
+
+
+# Each handler runs one kind of background generation. It gets the AppService
+# (for its clients and app), the operation_id of the GenerationHistory row it
+# fills in, and the JSON payload given to dispatch(). Handlers record their own
+# success or failure on the history row.
+
+def _run_video(service, operation_id, payload):
+    from utils import generate_video_internal
+
+    generate_video_internal(
+        service.app.app_context(), service.client, payload['prompt'], operation_id, payload['model_name'],
+        payload['seed'], payload['aspect_ratio'], payload['negative_prompt'],
+    )
+
+
+def _run_image_video(service, operation_id, payload):
+    from utils import generate_image_video_internal
+
+    def load_image():
+        # The upload is saved under static/uploads before the job is queued; web
+        # and worker processes share that directory just as they share the database.
+        # It may have been evicted to GCS since if the job waited long in the queue.
+        with service.app.app_context():
+            image_path = storage.ensure_local(payload['image_path'])
+        if image_path is None:
+            raise FileNotFoundError(f"Input image {payload['image_path']} is no longer stored.")
+        with open(image_path, 'rb') as f:
+            return f.read()
+
+    # The image is only loaded if a new operation is submitted, so a job taken
+    # over from another instance can keep polling its recorded operation even
+    # if that instance's upload is not available here.
+    generate_image_video_internal(
+        service.app.app_context(), payload['prompt'], operation_id, load_image, payload['model_name'],
+        payload['seed'], payload['aspect_ratio'], payload['negative_prompt'],
+    )
+
+
+def _run_veo_edit(service, operation_id, payload):
+    service.veo_edit_internal(service.app.app_context(), operation_id, **payload)
+
+
+HANDLERS = {
+    'video': _run_video,
+    'image_video': _run_image_video,
+    'veo_edit': _run_veo_edit,
+}
+
+
+def run_handler(service, kind, operation_id, payload):
+    HANDLERS[kind](service, operation_id, payload)
+
+
+def enqueue(kind, operation_id, payload, owner=None, lease_seconds=None):
+    """
+    Queues a job for whichever worker claims it first, or, given an `owner`,
+    records it as already leased to that process. Must be called inside an app context.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'.")
+    job = GenerationJob(operation_id=operation_id, kind=kind, payload=json.dumps(payload))
+    if owner:
+        now = datetime.datetime.utcnow()
+        job.status = 'running'
+        job.lease_owner = owner
+        job.lease_expires_at = now + datetime.timedelta(seconds=lease_seconds)
+        job.heartbeat_at = now
+        job.attempts = 1
+    db.session.add(job)
+    db.session.commit()
+
+
+def _claimable(now):
+    return db.or_(
+        GenerationJob.status == 'queued',
+        db.and_(GenerationJob.status == 'running', GenerationJob.lease_expires_at < now),
+    )
+
+
+def claim(worker_id, lease_seconds, max_attempts):
+    """
+    Leases the oldest queued job, or a running job whose lease has expired
+    because its worker died, to `worker_id`.
+
+    The lease is taken with a conditional UPDATE, so two workers racing for
+    the same row cannot both win. Returns the claimed GenerationJob or None.
+    """
+    now = datetime.datetime.utcnow()
+    candidates = db.session.query(GenerationJob.id).filter(
+        _claimable(now), GenerationJob.attempts < max_attempts,
+    ).order_by(GenerationJob.id).limit(10).all()
+    for (job_pk,) in candidates:
+        claimed = GenerationJob.query.filter(GenerationJob.id == job_pk, _claimable(now)).update({
+            'status': 'running',
+            'lease_owner': worker_id,
+            'lease_expires_at': now + datetime.timedelta(seconds=lease_seconds),
+            'heartbeat_at': now,
+            'attempts': GenerationJob.attempts + 1,
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(GenerationJob, job_pk)
+    return None
+
+
+def heartbeat(worker_id, operation_ids, lease_seconds):
+    """Extends the leases `worker_id` still holds. Returns the operation_ids whose lease was lost."""
+    if not operation_ids:
+        return set()
+    now = datetime.datetime.utcnow()
+    held = GenerationJob.query.filter(
+        GenerationJob.operation_id.in_(operation_ids),
+        GenerationJob.lease_owner == worker_id,
+        GenerationJob.status == 'running',
+    )
+    held_ids = {job.operation_id for job in held.with_entities(GenerationJob.operation_id)}
+    held.update({
+        'lease_expires_at': now + datetime.timedelta(seconds=lease_seconds),
+        'heartbeat_at': now,
+    }, synchronize_session=False)
+    db.session.commit()
+    return set(operation_ids) - held_ids
+
+
+def finish(worker_id, operation_id, error=None):
+    """
+    Marks a job done, unless its lease was lost and another worker has taken it over.
+    A job that failed also fails its history row, if the handler raised before
+    recording the outcome there itself, so status polling always ends.
+    """
+    message = str(error)[:500] if error else None
+    updated = GenerationJob.query.filter_by(operation_id=operation_id, lease_owner=worker_id).update({
+        'status': 'failed' if error else 'completed',
+        'error_message': message,
+        'lease_expires_at': None,
+        'finished_at': datetime.datetime.utcnow(),
+    }, synchronize_session=False)
+    if updated and error:
+        GenerationHistory.query.filter(
+            GenerationHistory.operation_id == operation_id,
+            GenerationHistory.status.in_(['queued', 'running']),
+        ).update({'status': 'failed', 'error_message': message}, synchronize_session=False)
+    db.session.commit()
+    return bool(updated)
+
+
+def reap_abandoned(max_attempts):
+    """
+    Fails jobs whose lease expired after `max_attempts` claims, and their
+    history rows, so a request that keeps crashing workers stops being retried.
+    """
+    now = datetime.datetime.utcnow()
+    abandoned = GenerationJob.query.filter(
+        GenerationJob.status == 'running',
+        GenerationJob.lease_expires_at < now,
+        GenerationJob.attempts >= max_attempts,
+    ).all()
+    for job in abandoned:
+        message = f"Worker stopped responding {job.attempts} times while running this job."
+        job.status = 'failed'
+        job.error_message = message
+        job.lease_expires_at = None
+        job.finished_at = now
+        GenerationHistory.query.filter(
+            GenerationHistory.operation_id == job.operation_id,
+            GenerationHistory.status.in_(['queued', 'running']),
+        ).update({'status': 'failed', 'error_message': message}, synchronize_session=False)
+    db.session.commit()
+    return [job.operation_id for job in abandoned]
+
+
+def queue_counts():
+    """Number of jobs per status."""
+    rows = db.session.query(GenerationJob.status, db.func.count(GenerationJob.id)).group_by(GenerationJob.status).all()
+    return dict(rows)
+
+
+class LeaseLost(Exception):
+    """Another process has taken over the job, so this one must stop polling its operation."""
+
+
+# Jobs of this process whose lease a heartbeat found taken over.
+_lost_leases = set()
+_lost_lock = threading.Lock()
+
+
+class OperationLease:
+    """
+    A poller's handle on the lease of the job it runs. Create it inside an app context.
+
+    The poller records the remote operation name once it has submitted the
+    generation. If the job is later taken over, the new owner calls
+    take_remote_operation() and resumes polling that operation instead of
+    paying for a second generation. Between polls, check() raises LeaseLost
+    once another process owns the job, so every operation has one poller.
+    """
+
+    def __init__(self, operation_id):
+        self.operation_id = operation_id
+        job = GenerationJob.query.filter_by(operation_id=operation_id).one_or_none()
+        self._remote_operation = job.remote_operation if job else None
+
+    def take_remote_operation(self):
+        """The operation submitted by a previous owner, returned once (resubmits start fresh)."""
+        name, self._remote_operation = self._remote_operation, None
+        return name
+
+    def record(self, remote_operation):
+        GenerationJob.query.filter_by(operation_id=self.operation_id).update(
+            {'remote_operation': remote_operation}, synchronize_session=False)
+        db.session.commit()
+
+    def check(self):
+        with _lost_lock:
+            lost = self.operation_id in _lost_leases
+        if lost:
+            raise LeaseLost(f"Job {self.operation_id} was taken over by another process.")
+
+
+class Worker:
+    """
+    Runs jobs under a lease, renewing it with a heartbeat while they run.
+
+    A genmedia_worker process calls run(), which claims queued jobs while it
+    has free slots. A web process in JOB_EXECUTION=thread mode calls start()
+    and then submit() for each job it creates. That runs the job on its own
+    thread, as before, and takes over jobs whose process died.
+    """
+
+    def __init__(self, app, service, worker_id=None, concurrency=8, poll_interval=1.0,
+                 lease_seconds=60, heartbeat_seconds=15, max_attempts=3):
+        self.app = app
+        self.service = service
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{new_ulid()[-6:]}"
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_attempts = max_attempts
+        self.stopping = threading.Event()
+        self._active = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, app, service, **overrides):
+        options = {
+            'concurrency': app.config['WORKER_CONCURRENCY'],
+            'poll_interval': app.config['WORKER_POLL_INTERVAL'],
+            'lease_seconds': app.config['JOB_LEASE_SECONDS'],
+            'heartbeat_seconds': app.config['JOB_HEARTBEAT_SECONDS'],
+            'max_attempts': app.config['JOB_MAX_ATTEMPTS'],
+        }
+        options.update({k: v for k, v in overrides.items() if v is not None})
+        return cls(app, service, **options)
+
+    def active_count(self):
+        with self._lock:
+            return len(self._active)
+
+    def run(self):
+        """Runs until stop() is called, then waits for the jobs in flight to finish."""
+        logger.info("Worker %s started with %d slots.", self.worker_id, self.concurrency)
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job') as pool:
+            while not self.stopping.is_set():
+                if self.active_count() >= self.concurrency:
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                claimed = self._claim()
+                if not claimed:
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                pool.submit(self._execute, *claimed)
+            logger.info("Worker %s stopping; waiting for %d running jobs.", self.worker_id, self.active_count())
+        logger.info("Worker %s stopped.", self.worker_id)
+
+    def start(self):
+        """Starts the heartbeat and the takeover of jobs whose process stopped renewing their lease."""
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+        threading.Thread(target=self._takeover_loop, daemon=True).start()
+
+    def submit(self, kind, operation_id, payload):
+        """Creates a job leased to this process and runs it on a new thread. Call inside an app context."""
+        enqueue(kind, operation_id, payload, owner=self.worker_id, lease_seconds=self.lease_seconds)
+        self._start_thread(operation_id, kind, json.dumps(payload))
+
+    def stop(self):
+        self.stopping.set()
+
+    def _claim(self):
+        with self.app.app_context():
+            reap_abandoned(self.max_attempts)
+            job = claim(self.worker_id, self.lease_seconds, self.max_attempts)
+            if job is None:
+                return None
+            if job.attempts > 1:
+                logger.info("Took over job %s (attempt %d, operation %s).", job.operation_id, job.attempts, job.remote_operation)
+            claimed = (job.operation_id, job.kind, job.payload)
+        with self._lock:
+            self._active.add(claimed[0])
+        return claimed
+
+    def _start_thread(self, operation_id, kind, payload):
+        with self._lock:
+            self._active.add(operation_id)
+        threading.Thread(target=self._execute, args=(operation_id, kind, payload)).start()
+
+    def _takeover_loop(self):
+        while not self.stopping.wait(self.heartbeat_seconds):
+            try:
+                while (claimed := self._claim()) is not None:
+                    threading.Thread(target=self._execute, args=claimed).start()
+            except Exception as e:
+                logger.warning("Looking for jobs to take over failed: %s", e)
+
+    def _execute(self, operation_id, kind, payload):
+        error = None
+        try:
+            with logs.bind_operation_id(operation_id):
+                with self.app.app_context():
+                    history_item = GenerationHistory.get_by_operation_id(operation_id)
+                    # A previous worker finished the generation but died before marking the job done.
+                    already_done = history_item is not None and history_item.status in ('completed', 'failed')
+                if not already_done:
+                    run_handler(self.service, kind, operation_id, json.loads(payload))
+        except Exception as e:
+            logger.exception("Job %s (%s) failed: %s", operation_id, kind, e)
+            error = e
+        finally:
+            with self.app.app_context():
+                if not finish(self.worker_id, operation_id, error):
+                    logger.warning("Job %s was taken over by another worker before it finished here.", operation_id)
+            with self._lock:
+                self._active.discard(operation_id)
+            with _lost_lock:
+                _lost_leases.discard(operation_id)
+
+    def _heartbeat_loop(self):
+        while True:
+            with self._lock:
+                active = list(self._active)
+            if self.stopping.is_set() and not active:
+                return
+            if active:
+                try:
+                    with self.app.app_context():
+                        lost = heartbeat(self.worker_id, active, self.lease_seconds)
+                    with self._lock:
+                        lost &= self._active
+                    for operation_id in lost:
+                        logger.warning("Lost the lease on job %s; it will stop polling.", operation_id)
+                    with _lost_lock:
+                        _lost_leases.update(lost)
+                except Exception as e:
+                    # Keep heart-beating; a single failed renewal leaves plenty of lease left.
+                    logger.warning("Heartbeat failed: %s", e)
+            time.sleep(self.heartbeat_seconds)
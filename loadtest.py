@@ -0,0 +1,649 @@
+"""
+Load and benchmark suite for the Flask routes.
+
+By default the app is started in this process on a threaded HTTP server,
+backed by fake_backend.py and a throwaway SQLite database, so runs are
+offline and repeatable:
+
+    python loadtest.py                                   # every scenario
+    python loadtest.py --scenario image_burst --concurrency 32 --requests 400
+    python loadtest.py --url http://127.0.0.1:8080 --pid 4242   # an already running server
+
+Each run writes a JSON result (latency percentiles per route, throughput,
+peak RSS and thread count) to --output-dir. Two results can be compared to
+spot regressions between commits:
+
+    python loadtest.py --compare loadtest-results/BASE.json loadtest-results/NEW.json
+"""
+import argparse
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from PIL import Image
+
+import fake_backend
+from config import Config
+
+DEFAULT_OUTPUT_DIR = 'loadtest-results'
+TERMINAL_STATUSES = ('completed', 'failed')
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list; None when empty."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(q / 100.0 * len(sorted_values)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize_latencies(seconds):
+    values = sorted(seconds)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), 4),
+        'p50': round(percentile(values, 50), 4),
+        'p95': round(percentile(values, 95), 4),
+        'p99': round(percentile(values, 99), 4),
+        'max': round(values[-1], 4),
+    }
+
+
+def process_stats(pid):
+    """Current RSS (bytes) and thread count of `pid`, from /proc where available."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['VmRSS'].split()[0]) * 1024, int(fields['Threads'])
+    except (OSError, KeyError, ValueError):
+        pass
+    if pid == os.getpid():
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes on Linux.
+        return (peak if sys.platform == 'darwin' else peak * 1024), threading.active_count()
+    return None, None
+
+
+class ResourceSampler:
+    """Samples a process' RSS and thread count on a background thread and keeps the peaks."""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_bytes = None
+        self.peak_threads = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        rss, threads = process_stats(self.pid)
+        if rss is not None:
+            self.peak_rss_bytes = max(self.peak_rss_bytes or 0, rss)
+        if threads is not None:
+            self.peak_threads = max(self.peak_threads or 0, threads)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        if self.pid:
+            self.sample()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self.sample()
+
+
+class Recorder:
+    """Thread-safe collection of (route, seconds, status) samples for one scenario."""
+
+    def __init__(self):
+        self.samples = []
+        self.iterations = []
+        self.first_chunks = []
+        self._lock = threading.Lock()
+
+    def add(self, route, seconds, status):
+        with self._lock:
+            self.samples.append((route, seconds, status))
+
+    def add_first_chunk(self, route, seconds):
+        """Time to the first chunk of a streamed response; the request itself is recorded by add()."""
+        with self._lock:
+            self.first_chunks.append((route, seconds))
+
+    def add_iteration(self, seconds, ok):
+        with self._lock:
+            self.iterations.append((seconds, ok))
+
+    def summary(self, wall_seconds):
+        routes = {}
+        status_codes = {}
+        for route, seconds, status in self.samples:
+            routes.setdefault(route, {'latencies': [], 'errors': 0})
+            routes[route]['latencies'].append(seconds)
+            if not isinstance(status, int) or status >= 400:
+                routes[route]['errors'] += 1
+            status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+
+        iterations = [seconds for seconds, _ in self.iterations]
+        return {
+            'requests': len(self.samples),
+            'errors': sum(route['errors'] for route in routes.values()),
+            'iterations': len(self.iterations),
+            'failed_iterations': sum(1 for _, ok in self.iterations if not ok),
+            'wall_seconds': round(wall_seconds, 3),
+            'throughput_rps': round(len(self.samples) / wall_seconds, 2) if wall_seconds else None,
+            'iteration_latency': summarize_latencies(iterations),
+            'latency': summarize_latencies([seconds for _, seconds, _ in self.samples]),
+            'routes': {
+                route: dict(summarize_latencies(data['latencies']), errors=data['errors'])
+                for route, data in sorted(routes.items())
+            },
+            'status_codes': status_codes,
+            'time_to_first_chunk': {
+                route: summarize_latencies([seconds for name, seconds in self.first_chunks if name == route])
+                for route in sorted({name for name, _ in self.first_chunks})
+            },
+        }
+
+
+def _error_body(response):
+    if not response.headers.get('Content-Type', '').startswith('application/json'):
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    if isinstance(body, list) and body:
+        body = body[0]
+    return isinstance(body, dict) and 'error' in body
+
+
+class Client:
+    """A per-worker HTTP session that records every request it makes."""
+
+    def __init__(self, base_url, recorder, timeout=300):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, method, path, route=None, **kwargs):
+        route = route or f"{method} {path}"
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            self.recorder.add(route, time.perf_counter() - start, type(e).__name__)
+            return None
+        status = response.status_code
+        if status < 400 and _error_body(response):
+            # Some routes jsonify a (body, status) tuple and so report failures as 200.
+            status = f"{status}-error"
+        self.recorder.add(route, time.perf_counter() - start, status)
+        return response
+
+    def get(self, path, route=None, **kwargs):
+        return self.request('GET', path, route, **kwargs)
+
+    def post(self, path, route=None, **kwargs):
+        return self.request('POST', path, route, **kwargs)
+
+    def post_event_stream(self, path, route=None, **kwargs):
+        """
+        POSTs to a server-sent events endpoint and reads the whole stream.
+
+        Records the time to the end of the stream as the request's latency, and
+        the time to the first `chunk` event in the summary's time_to_first_chunk.
+        Returns the list of (event, data) pairs, or None if the request failed.
+        """
+        route = route or f"POST {path} (stream)"
+        headers = dict(kwargs.pop('headers', None) or {}, Accept='text/event-stream')
+        start = time.perf_counter()
+        try:
+            response = self.session.post(self.base_url + path, timeout=self.timeout, stream=True, headers=headers, **kwargs)
+            if response.status_code >= 400:
+                self.recorder.add(route, time.perf_counter() - start, response.status_code)
+                return None
+            events, event = [], None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith('event: '):
+                    event = line[len('event: '):]
+                elif line.startswith('data: '):
+                    if event == 'chunk' and not any(name == 'chunk' for name, _ in events):
+                        self.recorder.add_first_chunk(route, time.perf_counter() - start)
+                    events.append((event, json.loads(line[len('data: '):])))
+        except requests.RequestException as e:
+            self.recorder.add(route, time.perf_counter() - start, type(e).__name__)
+            return None
+        ok = bool(events) and events[-1][0] == 'done'
+        self.recorder.add(route, time.perf_counter() - start, response.status_code if ok else f"{response.status_code}-error")
+        return events
+
+
+def _png(size, color):
+    buf = io.BytesIO()
+    Image.new('RGB', (size, size), color).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+class Payloads:
+    """Request bodies shared by every scenario, built once per run."""
+
+    def __init__(self, image_size=512):
+        self.image = _png(image_size, (200, 120, 40))
+        self.other_image = _png(image_size, (40, 120, 200))
+        self.mask = _png(image_size, (255, 255, 255))
+        self.video = b'\x00\x00\x00\x18ftypmp42' + bytes(64 << 10)
+
+
+def _ok(response):
+    return response is not None and response.status_code < 400 and not _error_body(response)
+
+
+def _ndjson_ok(response):
+    """A streamed NDJSON response whose closing summary line reports no failed items."""
+    if not _ok(response):
+        return False
+    lines = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+    return bool(lines) and lines[-1].get('done') is True and not lines[-1].get('failed')
+
+
+def _wait_for_operations(client, operation_ids, poll_interval, timeout):
+    deadline = time.monotonic() + timeout
+    pending = set(operation_ids)
+    failed = False
+    while pending and time.monotonic() < deadline:
+        for operation_id in list(pending):
+            response = client.get(f'/video-status/{operation_id}', route='GET /video-status/<id>')
+            status = response.json().get('status') if _ok(response) else None
+            if status in TERMINAL_STATUSES:
+                pending.discard(operation_id)
+                failed = failed or status == 'failed'
+        if pending:
+            time.sleep(poll_interval)
+    return not pending and not failed
+
+
+def video_batch(client, i, payloads, options):
+    """Submits a batch of text-to-video prompts plus one image-to-video, then polls until all finish."""
+    prompts = [f"loadtest video {i}-{n}: a drone shot over a coastline" for n in range(options.video_batch_size)]
+    response = client.post('/generate-videos', json={
+        'prompts': prompts, 'model': 'veo-3.0-fast-generate-preview', 'seed': i, 'aspect_ratio': '16:9',
+    })
+    if not _ok(response):
+        return False
+    operation_ids = list(response.json()['operation_ids'])
+
+    response = client.post('/generate-image-video', data={'prompt': f"loadtest image video {i}", 'seed': i}, files={
+        'image': ('still.png', payloads.image, 'image/png'),
+    })
+    if _ok(response):
+        operation_ids.append(response.json()['operation_id'])
+    return _ok(response) and _wait_for_operations(client, operation_ids, options.poll_interval, options.video_timeout)
+
+
+def image_burst(client, i, payloads, options):
+    """One synchronous call to each image endpoint."""
+    responses = [
+        client.post('/vto', data={'seed': i, 'sample_count': 1}, files={
+            'person_image': ('person.png', payloads.image, 'image/png'),
+            'product_image': ('product.png', payloads.other_image, 'image/png'),
+        }),
+        client.post('/product-recontext', data={'prompt': f"on a marble table {i}", 'seed': i}, files={
+            'images': ('product.png', payloads.image, 'image/png'),
+        }),
+        client.post('/segment-image', data={'mode': 'foreground'}, files={
+            'image': ('photo.png', payloads.image, 'image/png'),
+        }),
+        client.post('/imagen-edit', data={'prompt': 'add a hat', 'edit_mode': 'inpainting-insert', 'mask_mode': 'user_provided'}, files={
+            'original_image': ('photo.png', payloads.image, 'image/png'),
+            'mask_image': ('mask.png', payloads.mask, 'image/png'),
+        }),
+        client.post('/generate-editor-image', json={'prompt': f"a red bicycle {i}", 'seed': i, 'aspect_ratio': '1:1'}),
+    ]
+    return all(_ok(response) for response in responses)
+
+
+def history_read(client, i, payloads, options):
+    """The reads behind the history, settings and usage views."""
+    history = client.get('/get-generation-history')
+    responses = [
+        history,
+        client.get('/get-usage-report', params={'range': '7d'}),
+        client.get('/get-system-instructions'),
+        client.get('/get-settings'),
+        client.get('/metrics'),
+    ]
+    if _ok(history) and history.json()['history']:
+        rows = history.json()['history']
+        operation_id = rows[i % len(rows)]['operation_id']
+        responses.append(client.get(f'/video-status/{operation_id}', route='GET /video-status/<id>'))
+    return all(_ok(response) for response in responses)
+
+
+def prompts(client, i, payloads, options):
+    """Gemini prompt generation and refinement, answered as one JSON body."""
+    responses = [
+        client.post('/generate-prompt', json={'user_prompt': f"a cat in space {i}", 'system_instructions': 'Write a Veo prompt.'}),
+        client.post('/refine-prompt', json={'current_prompt': f"a cat in space {i}", 'refine_instruction': 'make it night'}),
+    ]
+    return all(_ok(response) for response in responses)
+
+
+def prompts_stream(client, i, payloads, options):
+    """Prompt generation and refinement as the UI requests them, streamed as server-sent events."""
+    streams = [
+        client.post_event_stream('/generate-prompt', json={
+            'user_prompt': f"a cat in space {i}", 'system_instructions': 'Write a Veo prompt.', 'stream': True,
+        }),
+        client.post_event_stream('/refine-prompt', json={
+            'current_prompt': f"a cat in space {i}", 'refine_instruction': 'make it night', 'stream': True,
+        }),
+    ]
+    return all(events and events[-1][0] == 'done' for events in streams)
+
+
+def all_routes(client, i, payloads, options):
+    """Touches every remaining route once, so none is left out of the suite."""
+    responses = [client.get('/')]
+
+    name = f"loadtest-{os.getpid()}-{i}-{time.monotonic_ns()}"
+    client.post('/save-system-instruction', json={'name': name, 'content': 'Be concise.'})
+    instructions = client.get('/get-system-instructions')
+    if _ok(instructions):
+        for instruction in instructions.json()['instructions']:
+            if instruction['name'] == name:
+                responses.append(client.request('DELETE', f"/delete-system-instruction/{instruction['id']}", route='DELETE /delete-system-instruction/<id>'))
+
+    manifest = json.dumps({'prompt': 'on a shelf', 'image_uris': ['gs://bucket/product.png']}).encode()
+    batch = client.post('/batch-jobs', data={'job_type': 'recontext'}, files={'manifest': ('items.jsonl', manifest)})
+    responses += [batch, client.get('/batch-jobs')]
+    if _ok(batch):
+        job_id = batch.json()['job_id']
+        responses += [
+            client.get(f'/batch-jobs/{job_id}', route='GET /batch-jobs/<id>'),
+            client.post(f'/batch-jobs/{job_id}/resume', route='POST /batch-jobs/<id>/resume'),
+            client.get(f'/batch-jobs/{job_id}/results', route='GET /batch-jobs/<id>/results'),
+        ]
+
+    profiled = client.post('/segment-image', route='POST /segment-image (profiled)', headers={Config.PROFILE_HEADER: '1'},
+                           data={'mode': 'foreground'}, files={'image': ('photo.png', payloads.image, 'image/png')})
+    responses += [profiled, client.get('/profiles')]
+    if _ok(profiled) and profiled.headers.get('X-Profile-Id'):
+        responses.append(client.get(f"/profiles/{profiled.headers['X-Profile-Id']}", route='GET /profiles/<id>', params={'format': 'text'}))
+
+    operation_ids = []
+    for path, data, files in (
+        ('/veo-edit', {'prompt': 'remove the car', 'mask_mode': 'remove'}, {
+            'video_file': ('clip.mp4', payloads.video, 'video/mp4'), 'mask_file': ('mask.png', payloads.mask, 'image/png'),
+        }),
+        ('/veo-advanced-edit', {'prompt': 'slow pan left', 'camera_control': 'PAN_LEFT'}, {
+            'image_file': ('first.png', payloads.image, 'image/png'),
+        }),
+    ):
+        response = client.post(path, data=data, files=files)
+        responses.append(response)
+        if _ok(response):
+            operation_ids.append(response.json()['operation_id'])
+
+    prompt_batch = client.post('/generate-prompts', json={
+        'prompts': [f"a lighthouse at dusk {i}-{n}" for n in range(3)], 'system_instructions': 'Write a Veo prompt.',
+    })
+    responses.append(prompt_batch)
+
+    settings = client.get('/get-settings')
+    if _ok(settings):
+        current = settings.json()
+        responses.append(client.post('/save-settings', json={'project_id': current['project_id'], 'gcs_bucket': current['gcs_bucket']}))
+
+    finished = _wait_for_operations(client, operation_ids, options.poll_interval, options.video_timeout)
+    return finished and _ndjson_ok(prompt_batch) and all(_ok(response) for response in responses)
+
+
+SCENARIOS = {
+    'video_batch': video_batch,
+    'image_burst': image_burst,
+    'history_read': history_read,
+    'prompts': prompts,
+    'prompts_stream': prompts_stream,
+    'all_routes': all_routes,
+}
+
+
+def run_scenario(name, base_url, concurrency, iterations, options, payloads, pid=None):
+    """Runs `iterations` of a scenario across `concurrency` workers and summarizes them."""
+    scenario = SCENARIOS[name]
+    recorder = Recorder()
+    counter = iter(range(iterations))
+    counter_lock = threading.Lock()
+
+    def worker():
+        client = Client(base_url, recorder)
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                ok = scenario(client, i, payloads, options)
+            except Exception:
+                ok = False
+            recorder.add_iteration(time.perf_counter() - start, ok)
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    with ResourceSampler(pid) as sampler:
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        wall = time.perf_counter() - start
+
+    result = recorder.summary(wall)
+    result.update(concurrency=concurrency, peak_rss_bytes=sampler.peak_rss_bytes, peak_threads=sampler.peak_threads)
+    return result
+
+
+def seed_history(app, rows):
+    """Inserts `rows` completed generations so history reads run against a realistically sized table."""
+    from extensions import db
+    from ids import new_operation_id
+    from models import GenerationHistory
+
+    types = ('video', 'vto', 'product_recontext', 'segmentation', 'imagen_edit')
+    with app.app_context():
+        for n in range(rows):
+            operation_type = types[n % len(types)]
+            db.session.add(GenerationHistory(
+                operation_id=new_operation_id('seed'),
+                prompt=f"seeded {operation_type} generation {n}",
+                status='completed',
+                operation_type=operation_type,
+                video_path=f"/static/videos/seed_{n}.mp4" if operation_type == 'video' else None,
+                image_path=None if operation_type == 'video' else f"/static/uploads/seed_{n}.png",
+                input_payload=json.dumps({'prompt': f"seeded {n}", 'seed': n, 'sample_count': 1}),
+                output_payload=json.dumps({'images': [f"/static/uploads/seed_{n}_{k}.png" for k in range(4)]}),
+                stage_timings=json.dumps({'upload': 0.2, 'remote': 12.5, 'download': 0.4, 'db_write': 0.01}),
+            ))
+        db.session.commit()
+
+
+def start_local_stack(workdir, fake_config, rate_limits=None, log_level='WARNING'):
+    """
+    Starts the fake backend and the app on a threaded server inside this
+    process, with its database and media under `workdir`. Returns
+    (app, base_url, fake_server). The app module can only be imported once
+    per process, so this can only be called once.
+    """
+    fake_server, fake_url = fake_backend.start_in_thread(port=0, **fake_config)
+
+    # Everything the app reads at import time has to be patched first.
+    Config.VERTEX_API_ENDPOINT = Config.GCS_API_ENDPOINT = fake_url
+    Config.LRO_POLL_INTERVAL = min(Config.LRO_POLL_INTERVAL or 0.5, 0.5)
+    Config.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'history.db')}"
+    Config.BATCH_RESUME_ON_STARTUP = False
+    Config.LOG_LEVEL = log_level
+    Config.PROFILE_DIR = os.path.join(workdir, 'profiles')
+    Config.RETRY_BASE_DELAY = 0.1
+    if rate_limits is not None:
+        Config.RATE_LIMITS = rate_limits
+
+    # Uploads and videos are written relative to the working directory.
+    os.chdir(workdir)
+    os.makedirs(Config.VIDEO_DIR, exist_ok=True)
+    os.makedirs(os.path.join('static', 'uploads'), exist_ok=True)
+
+    from werkzeug.serving import make_server
+    from app import app
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return app, f"http://127.0.0.1:{server.server_port}", fake_server
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare_results(base, new, threshold=0.10):
+    """
+    Lists per-scenario changes between two result files. A metric is a
+    regression when it is worse than the baseline by more than `threshold`
+    (latency and resource usage up, throughput down).
+    """
+    lower_is_better = [('latency', 'p50'), ('latency', 'p95'), ('latency', 'p99'),
+                       ('iteration_latency', 'p95'), ('peak_rss_bytes',), ('peak_threads',), ('errors',)]
+    higher_is_better = [('throughput_rps',)]
+    rows = []
+    for scenario in sorted(set(base['scenarios']) & set(new['scenarios'])):
+        for path in lower_is_better + higher_is_better:
+            old_value, new_value = base['scenarios'][scenario], new['scenarios'][scenario]
+            for key in path:
+                old_value = (old_value or {}).get(key)
+                new_value = (new_value or {}).get(key)
+            if old_value is None or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value if old_value else (0.0 if new_value == old_value else float('inf'))
+            worse = change > threshold if path in lower_is_better else change < -threshold
+            rows.append({
+                'scenario': scenario, 'metric': '.'.join(path), 'base': old_value, 'new': new_value,
+                'change': round(change, 4), 'regression': worse,
+            })
+    return rows
+
+
+def print_comparison(rows):
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else ''
+        print(f"{row['scenario']:<14} {row['metric']:<22} {row['base']:>14} -> {row['new']:>14} ({row['change']:+.1%}){flag}")
+
+
+def print_summary(results):
+    for name, result in results['scenarios'].items():
+        latency = result['latency']
+        rss = result['peak_rss_bytes']
+        print(
+            f"{name:<14} {result['requests']:>6} req  {result['errors']:>4} err  "
+            f"{result['throughput_rps'] or 0:>8.1f} req/s  p50 {latency.get('p50')}s  p95 {latency.get('p95')}s  "
+            f"p99 {latency.get('p99')}s  rss {rss / (1 << 20) if rss else 0:.0f}MiB  threads {result['peak_threads']}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test and benchmark the app's routes.")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="Repeatable; default is every scenario.")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=40, help="Iterations per scenario; one iteration may issue several requests.")
+    parser.add_argument('--url', help="Benchmark an already running server instead of starting one in-process.")
+    parser.add_argument('--pid', type=int, help="With --url, the server process to sample RSS and threads from.")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="Compare two result files and exit.")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Relative change counted as a regression by --compare.")
+    parser.add_argument('--video-batch-size', type=int, default=4)
+    parser.add_argument('--poll-interval', type=float, default=0.2)
+    parser.add_argument('--video-timeout', type=float, default=300)
+    parser.add_argument('--image-size', type=int, default=512, help="Width/height of uploaded test images.")
+    parser.add_argument('--seed-history', type=int, default=500, help="In-process only: history rows inserted before the run.")
+    parser.add_argument('--production-rate-limits', action='store_true',
+                        help="In-process only: keep Config.RATE_LIMITS instead of lifting them to measure the app itself.")
+    parser.add_argument('--fake-latency', type=float, default=0.2)
+    parser.add_argument('--fake-lro-seconds', type=float, default=2.0)
+    parser.add_argument('--fake-failure-rate', type=float, default=0.0)
+    options = parser.parse_args(argv)
+
+    if options.compare:
+        with open(options.compare[0]) as f:
+            base = json.load(f)
+        with open(options.compare[1]) as f:
+            new = json.load(f)
+        rows = compare_results(base, new, options.threshold)
+        print_comparison(rows)
+        return 1 if any(row['regression'] for row in rows) else 0
+
+    output_dir = os.path.abspath(options.output_dir)
+    if options.url:
+        base_url, pid = options.url, options.pid
+    else:
+        workdir = tempfile.mkdtemp(prefix='genmedia-loadtest-')
+        rate_limits = None if options.production_rate_limits else {}
+        app, base_url, _ = start_local_stack(workdir, {
+            'latency': options.fake_latency, 'lro_seconds': options.fake_lro_seconds,
+            'failure_rate': options.fake_failure_rate,
+        }, rate_limits=rate_limits)
+        seed_history(app, options.seed_history)
+        pid = os.getpid()
+
+    payloads = Payloads(options.image_size)
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'started_at': datetime.datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'target': options.url or 'in-process',
+            'options': {k: v for k, v in vars(options).items() if k not in ('compare', 'output_dir')},
+        },
+        'scenarios': {},
+    }
+    for name in options.scenario or list(SCENARIOS):
+        results['scenarios'][name] = run_scenario(name, base_url, options.concurrency, options.requests, options, payloads, pid)
+
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    path = os.path.join(output_dir, f"{stamp}-{results['meta']['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print_summary(results)
+    print(f"Results written to {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import atexit
+import contextlib
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+# Operation ID of the generation the current thread is working on. Background
+# threads do not inherit context variables, so workers bind it themselves.
+operation_id_var = contextvars.ContextVar('operation_id', default=None)
+
+_listener = None
+
+
+def set_operation_id(operation_id):
+    """Tags the rest of the current request or worker thread's log records with `operation_id`."""
+    operation_id_var.set(operation_id)
+
+
+def clear_operation_id():
+    # Server threads are reused across requests; reset before each one.
+    operation_id_var.set(None)
+
+
+@contextlib.contextmanager
+def bind_operation_id(operation_id):
+    """Tags every log record emitted inside the block with `operation_id`."""
+    token = operation_id_var.set(operation_id)
+    try:
+        yield
+    finally:
+        operation_id_var.reset(token)
+
+
+class OperationIdFilter(logging.Filter):
+    def filter(self, record):
+        if not getattr(record, 'operation_id', None):
+            record.operation_id = operation_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line. `severity` and `message` are the keys Cloud
+    Logging picks up from stdout, so levels survive on Cloud Run.
+    """
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'severity': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'operation_id', None):
+            entry['operation_id'] = record.operation_id
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [%(operation_id)s] %(message)s'
+
+
+def truncate(value, limit=500):
+    """Returns str(value) cut to `limit` characters, noting how much was dropped."""
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+class PayloadSampler:
+    """Decides whether a debug payload dump is logged, and truncates the ones that are."""
+
+    def __init__(self, sample_rate=1.0, max_chars=500):
+        self.sample_rate = sample_rate
+        self.max_chars = max_chars
+
+    def debug(self, logger, message, payload):
+        if not logger.isEnabledFor(logging.DEBUG) or random.random() >= self.sample_rate:
+            return
+        logger.debug("%s: %s", message, truncate(payload, self.max_chars))
+
+
+payload_sampler = PayloadSampler()
+
+
+def configure_logging(level='INFO', fmt='json', payload_sample_rate=1.0, payload_max_chars=500):
+    """
+    Routes all logging through a QueueHandler so request threads only enqueue
+    records; a single QueueListener thread formats and writes them to stdout.
+    Safe to call more than once (e.g. once per app created in tests).
+    """
+    global _listener
+    payload_sampler.sample_rate = payload_sample_rate
+    payload_sampler.max_chars = payload_max_chars
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    # The filter runs on the queue handler, in the emitting thread, where the
+    # operation_id context variable is still set.
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(OperationIdFilter())
+
+    if _listener:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    return _listener
+
+
+@atexit.register
+def _flush():
+    if _listener:
+        _listener.stop()
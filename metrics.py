@@ -0,0 +1,369 @@
+import bisect
+import contextlib
+import functools
+import json
+import threading
+import time
+
+# Generations range from sub-second Gemini calls to multi-minute Veo renders.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+QUEUE_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+DB_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+BYTES_BUCKETS = (1 << 10, 16 << 10, 128 << 10, 1 << 20, 4 << 20, 16 << 20, 64 << 20, 256 << 20)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+    suffix = ''
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for key, child in children:
+            lines.extend(child.samples(self.name + self.suffix, self.labelnames, key))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    def samples(self, name, labelnames, key):
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    # Prometheus counters are exposed with a _total suffix.
+    suffix = '_total'
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name, labelnames, key):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(labelnames, key, [('le', _format_value(float(bound)))])
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, key)
+        lines.append(f"{name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        return '\n'.join(line for metric in metrics for line in metric.collect()) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+model_call_seconds = Histogram(
+    'genmedia_model_call_seconds',
+    'End-to-end latency of a Vertex AI call per model, including retries and rate limit waits.',
+    ['model'],
+)
+operation_seconds = Histogram(
+    'genmedia_operation_seconds',
+    'End-to-end latency of a generation per operation type, from start of work to result saved.',
+    ['operation'],
+)
+operation_completion_seconds = Histogram(
+    'genmedia_operation_completion_seconds',
+    'Time from submitting a long-running operation to the first poll that reports it done.',
+    ['model'],
+)
+queue_wait_seconds = Histogram(
+    'genmedia_queue_wait_seconds',
+    'Time spent waiting before work starts: on the rate limiter or for a background worker.',
+    ['model', 'stage'],
+    buckets=QUEUE_BUCKETS,
+)
+gcs_seconds = Histogram(
+    'genmedia_gcs_seconds',
+    'GCS transfer duration.',
+    ['direction'],
+)
+gcs_bytes = Histogram(
+    'genmedia_gcs_bytes',
+    'GCS transfer size in bytes.',
+    ['direction'],
+    buckets=BYTES_BUCKETS,
+)
+db_write_seconds = Histogram(
+    'genmedia_db_write_seconds',
+    'Duration of the commit that records a generation\'s final state on its history row.',
+    buckets=DB_BUCKETS,
+)
+in_flight = Gauge(
+    'genmedia_in_flight',
+    'Generations currently being processed, per operation type.',
+    ['operation'],
+)
+queue_depth = Gauge(
+    'genmedia_queue_depth',
+    'Work waiting to start: queued generations and pending batch items.',
+    ['queue'],
+)
+rate_limit_waiting = Gauge(
+    'genmedia_rate_limit_waiting',
+    'Callers currently waiting on a model rate limit.',
+    ['model'],
+)
+local_storage_bytes = Gauge(
+    'genmedia_local_storage_bytes',
+    'Bytes of generated and uploaded files kept on local disk.',
+)
+storage_events = Counter(
+    'genmedia_storage_events',
+    'Local storage files evicted to stay in budget, and evicted files restored from GCS on access.',
+    ['event'],
+)
+prompt_cache = Counter(
+    'genmedia_prompt_cache',
+    'Prompt generation and refinement requests answered from the cache (hit) or by Gemini (miss).',
+    ['result'],
+)
+errors = Counter(
+    'genmedia_errors',
+    'Errors by source (model or operation type) and error class.',
+    ['source', 'error_class'],
+)
+
+
+def record_error(source, error_class):
+    errors.labels(source=source, error_class=error_class).inc()
+
+
+class Timer:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.seconds = 0.0
+
+    def stop(self):
+        self.seconds = time.monotonic() - self.start
+        return self.seconds
+
+
+@contextlib.contextmanager
+def track_model_call(model):
+    """Times a Vertex AI call for `model` and counts the exception class if it fails."""
+    timer = Timer()
+    try:
+        yield timer
+    except Exception as e:
+        record_error(model, type(e).__name__)
+        raise
+    finally:
+        model_call_seconds.labels(model=model).observe(timer.stop())
+
+
+@contextlib.contextmanager
+def track_gcs(direction, size=None):
+    """Times a GCS transfer; `size` may be set later through the yielded timer's `bytes`."""
+    timer = Timer()
+    timer.bytes = size
+    try:
+        yield timer
+    except Exception as e:
+        record_error('gcs', type(e).__name__)
+        raise
+    finally:
+        gcs_seconds.labels(direction=direction).observe(timer.stop())
+        if timer.bytes is not None:
+            gcs_bytes.labels(direction=direction).observe(timer.bytes)
+
+
+@contextlib.contextmanager
+def track_operation(operation):
+    """Counts a generation as in flight and times it end to end."""
+    gauge = in_flight.labels(operation=operation)
+    gauge.inc()
+    timer = Timer()
+    try:
+        yield timer
+    except Exception as e:
+        record_error(operation, type(e).__name__)
+        raise
+    finally:
+        gauge.dec()
+        operation_seconds.labels(operation=operation).observe(timer.stop())
+
+
+def tracked_operation(operation):
+    """Decorator form of track_operation."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with track_operation(operation):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Stages of a generation persisted on GenerationHistory.stage_timings.
+STAGES = ('upload', 'submit', 'queue_wait', 'remote', 'download', 'db_write')
+
+
+class StageTimings:
+    """Per-stage durations (in seconds) of one generation, stored as JSON on its history row."""
+
+    def __init__(self, stages=None):
+        self.stages = dict(stages or {})
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(json.loads(text) if text else None)
+
+    def add(self, stage, seconds):
+        self.stages[stage] = round(self.stages.get(stage, 0.0) + seconds, 3)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        timer = Timer()
+        try:
+            yield timer
+        finally:
+            self.add(name, timer.stop())
+
+    def to_json(self):
+        return json.dumps(self.stages)
+
+    def write(self, session):
+        """Commits an earlier status change of the row (running, a retry count) and counts it as db_write."""
+        with self.stage('db_write'):
+            session.commit()
+
+    def insert(self, history_item, session):
+        """
+        Adds a new row (e.g. one queued for a worker) with its timings so far.
+        The INSERT is flushed first so that its duration is stored on the row as db_write.
+        """
+        session.add(history_item)
+        with self.stage('db_write'):
+            session.flush()
+        history_item.stage_timings = self.to_json()
+        session.commit()
+
+    def commit(self, history_item, session):
+        """
+        Commits the row's final state with its timings, including the db_write
+        total of its earlier commits. The final commit's own duration goes to
+        genmedia_db_write_seconds rather than a second write.
+        """
+        history_item.stage_timings = self.to_json()
+        timer = Timer()
+        session.commit()
+        db_write_seconds.labels().observe(timer.stop())
+
+
+def summarize_stage_timings(rows):
+    """Aggregates stage_timings JSON strings into count, avg, p95 and max per stage."""
+    samples = {}
+    for text in rows:
+        for stage, seconds in (json.loads(text) if text else {}).items():
+            samples.setdefault(stage, []).append(seconds)
+    summary = {}
+    for stage in sorted(samples, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+        values = sorted(samples[stage])
+        summary[stage] = {
+            'count': len(values),
+            'avg': round(sum(values) / len(values), 3),
+            'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+            'max': values[-1],
+        }
+    return summary
@@ -0,0 +1,282 @@
+"""
+Microbenchmarks for the CPU-bound media code that runs on every request.
+
+    python microbench.py                                  # every benchmark at 512px, 1024px, 2048px and 4K
+    python microbench.py --bench get_bytes_from_pil --size 4k --repeat 20
+    python microbench.py --compare loadtest-results/micro-BASE.json loadtest-results/micro-NEW.json
+
+Each benchmark reports wall time per operation (mean, p50, min, max) and
+allocations: the Python heap peak seen by tracemalloc, and the number of
+image buffers and memory blocks Pillow allocated. Pillow allocates pixel
+data outside the Python heap, so tracemalloc alone would miss it.
+"""
+import argparse
+import base64
+import datetime
+import importlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from PIL import Image
+
+import loadtest
+from config import Config
+
+# Width x height of the test images; "4k" is UHD.
+SIZES = {
+    '512': (512, 512),
+    '1024': (1024, 1024),
+    '2048': (2048, 2048),
+    '4k': (3840, 2160),
+}
+
+_image_cache = {}
+
+
+def photo_like(size):
+    """
+    A deterministic RGB image that compresses roughly like a photo: smooth
+    gradients plus grain. A flat color would flatter PNG encoding and pure
+    noise would punish it.
+    """
+    if size not in _image_cache:
+        width, height = size
+        gradient = Image.linear_gradient('L').resize(size)
+        radial = Image.radial_gradient('L').resize(size)
+        grain = Image.frombytes('L', size, bytes((i * 2654435761 >> 13) & 0x3f for i in range(width * height)))
+        _image_cache[size] = Image.merge('RGB', (gradient, radial, Image.blend(gradient, grain, 0.5)))
+    return _image_cache[size]
+
+
+def import_media_module(name):
+    """
+    Imports prism or vto. prism builds its prediction client at import time;
+    nothing here calls a backend, so a placeholder endpoint stands in for ADC.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    endpoint = Config.VERTEX_API_ENDPOINT
+    Config.VERTEX_API_ENDPOINT = endpoint or 'http://127.0.0.1:9'
+    try:
+        return importlib.import_module(name)
+    finally:
+        Config.VERTEX_API_ENDPOINT = endpoint
+
+
+def png_bytes(image):
+    buf = io.BytesIO()
+    image.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+# Each benchmark takes a (width, height) and returns `prepare`, called
+# untimed before every run, whose result is passed to the timed `run`.
+
+def bench_get_bytes_from_pil(size):
+    import imagenedit
+    image = photo_like(size)
+    return lambda: (image,), imagenedit.get_bytes_from_pil
+
+
+def bench_pad_to_target_size(size):
+    import imagenedit
+    # Outpainting pads a smaller image onto the target canvas.
+    source = photo_like(size).resize((size[0] * 3 // 4, size[1] * 3 // 4))
+    return lambda: (source,), lambda image: imagenedit.pad_to_target_size(image, target_size=size, fill_val=0)
+
+
+def bench_pad_image_and_mask(size):
+    import imagenedit
+    image = photo_like(size).resize((size[0] * 3 // 4, size[1] * 3 // 4))
+    mask = Image.new('L', image.size, 0)
+    # thumbnail() resizes in place, so every run gets fresh copies.
+    return lambda: (image.copy(), mask.copy()), lambda i, m: imagenedit.pad_image_and_mask(i, m, size, 0, 0)
+
+
+def _decode_prediction(prediction_to_pil_image):
+    def run(prediction):
+        image = prediction_to_pil_image(prediction)
+        # Image.open is lazy; callers always go on to read the pixels.
+        image.load()
+        return image
+    return run
+
+
+def bench_vto_prediction_to_pil_image(size):
+    vto = import_media_module('vto')
+    prediction = {'bytesBase64Encoded': base64.b64encode(png_bytes(photo_like(size))).decode('utf-8')}
+    return lambda: (prediction,), _decode_prediction(vto.prediction_to_pil_image)
+
+
+def bench_prism_prediction_to_pil_image(size):
+    prism = import_media_module('prism')
+    prediction = {'bytesBase64Encoded': base64.b64encode(png_bytes(photo_like(size))).decode('utf-8')}
+    return lambda: (prediction,), _decode_prediction(prism.prediction_to_pil_image)
+
+
+def bench_recontext_upload_base64(size):
+    # services.AppService.product_recontext: base64 of each uploaded file.
+    upload = png_bytes(photo_like(size))
+    return lambda: (io.BytesIO(upload),), lambda file: base64.b64encode(file.read()).decode('utf-8')
+
+
+def bench_recontext_prediction_reencode(size):
+    # services.AppService.product_recontext: each prediction is decoded, re-encoded as PNG and base64'd again.
+    prism = import_media_module('prism')
+    prediction = {'bytesBase64Encoded': base64.b64encode(png_bytes(photo_like(size))).decode('utf-8')}
+
+    def run(prediction):
+        buf = io.BytesIO()
+        prism.prediction_to_pil_image(prediction).save(buf, format='PNG')
+        return base64.b64encode(buf.getvalue()).decode('utf-8')
+    return lambda: (prediction,), run
+
+
+def bench_history_to_dict(size):
+    # Not image bound: one history page (100 rows) with payloads sized like real rows.
+    from models import GenerationHistory
+    rows = [
+        GenerationHistory(
+            id=n, operation_id=f"vto_op_{n:026d}", prompt='bulky woman wearing dressy top ' * 4, status='completed',
+            image_path=f"/static/uploads/vto_op_{n}.png", operation_type='vto', retry_count=0,
+            timestamp=datetime.datetime(2025, 8, 6, 3, 14, 8),
+            input_payload=json.dumps({'prompt': 'p' * 200, 'sample_count': 4, 'base_steps': 32, 'seed': n}),
+            output_payload=json.dumps({'images': [f"/static/uploads/vto_op_{n}_{k}.png" for k in range(4)]}),
+            stage_timings=json.dumps({'upload': 0.21, 'remote': 12.5, 'download': 0.4, 'db_write': 0.012}),
+        )
+        for n in range(100)
+    ]
+    return lambda: (rows,), lambda rows: [row.to_dict() for row in rows]
+
+
+BENCHMARKS = {
+    'get_bytes_from_pil': bench_get_bytes_from_pil,
+    'pad_to_target_size': bench_pad_to_target_size,
+    'pad_image_and_mask': bench_pad_image_and_mask,
+    'vto_prediction_to_pil_image': bench_vto_prediction_to_pil_image,
+    'prism_prediction_to_pil_image': bench_prism_prediction_to_pil_image,
+    'recontext_upload_base64': bench_recontext_upload_base64,
+    'recontext_prediction_reencode': bench_recontext_prediction_reencode,
+    'history_to_dict': bench_history_to_dict,
+}
+
+# Benchmarks whose cost does not depend on the image size run once, not per size.
+SIZE_INDEPENDENT = {'history_to_dict'}
+
+
+def _pillow_stats():
+    stats = Image.core.get_stats()
+    return stats['new_count'], stats['allocated_blocks']
+
+
+def measure(prepare, run, repeat=10, warmup=1):
+    """Times `repeat` runs (after `warmup` untimed ones), then measures allocations of one more run."""
+    for _ in range(warmup):
+        run(*prepare())
+
+    timings = []
+    for _ in range(repeat):
+        args = prepare()
+        start = time.perf_counter()
+        run(*args)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    args = prepare()
+    images_before, blocks_before = _pillow_stats()
+    tracemalloc.start()
+    try:
+        result = run(*args)
+        _, py_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    images_after, blocks_after = _pillow_stats()
+    del result
+
+    return {
+        'repeat': repeat,
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'p50_ms': round(loadtest.percentile(timings, 50) * 1000, 3),
+        'min_ms': round(timings[0] * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+        'py_peak_bytes': py_peak,
+        'pil_images_allocated': images_after - images_before,
+        'pil_blocks_allocated': blocks_after - blocks_before,
+    }
+
+
+def run_benchmarks(names, size_labels, repeat, sizes=SIZES):
+    results = []
+    for name in names:
+        labels = size_labels[:1] if name in SIZE_INDEPENDENT else size_labels
+        for label in labels:
+            prepare, run = BENCHMARKS[name](sizes[label])
+            result = {'bench': name, 'size': None if name in SIZE_INDEPENDENT else label}
+            result.update(measure(prepare, run, repeat))
+            results.append(result)
+            print(f"{name:<32} {result['size'] or '-':>5}  {result['p50_ms']:>10.3f} ms  "
+                  f"py peak {result['py_peak_bytes'] / (1 << 20):>7.2f} MiB  pil images {result['pil_images_allocated']}")
+    return results
+
+
+def compare_results(base, new, threshold=0.10):
+    """Per (bench, size): change in p50 time and Python peak memory; worse than `threshold` is a regression."""
+    old_by_key = {(r['bench'], r['size']): r for r in base['results']}
+    rows = []
+    for result in new['results']:
+        old = old_by_key.get((result['bench'], result['size']))
+        if not old:
+            continue
+        for metric in ('p50_ms', 'py_peak_bytes'):
+            change = (result[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            rows.append({
+                'scenario': f"{result['bench']}@{result['size'] or '-'}", 'metric': metric,
+                'base': old[metric], 'new': result[metric], 'change': round(change, 4), 'regression': change > threshold,
+            })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for media encode/decode hot paths.")
+    parser.add_argument('--bench', action='append', choices=sorted(BENCHMARKS), help="Repeatable; default is every benchmark.")
+    parser.add_argument('--size', action='append', choices=list(SIZES), help="Repeatable; default is every size.")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output-dir', default=loadtest.DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=0.10)
+    options = parser.parse_args(argv)
+
+    if options.compare:
+        with open(options.compare[0]) as f:
+            base = json.load(f)
+        with open(options.compare[1]) as f:
+            new = json.load(f)
+        rows = compare_results(base, new, options.threshold)
+        loadtest.print_comparison(rows)
+        return 1 if any(row['regression'] for row in rows) else 0
+
+    results = {
+        'meta': {
+            'commit': loadtest.git_commit(),
+            'started_at': datetime.datetime.utcnow().isoformat() + 'Z',
+            'pillow': Image.__version__,
+            'python': sys.version.split()[0],
+            'repeat': options.repeat,
+        },
+        'results': run_benchmarks(options.bench or list(BENCHMARKS), options.size or list(SIZES), options.repeat),
+    }
+    os.makedirs(options.output_dir, exist_ok=True)
+    stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    path = os.path.join(options.output_dir, f"micro-{stamp}-{results['meta']['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import datetime
+import json
 from extensions import db
 
 class GenerationHistory(db.Model):
@@ -9,13 +10,24 @@ class GenerationHistory(db.Model):
     video_path = db.Column(db.String(500), nullable=True)
     image_path = db.Column(db.String(500), nullable=True)
     error_message = db.Column(db.String(500), nullable=True)
-    timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
     input_payload = db.Column(db.Text, nullable=True)
     output_payload = db.Column(db.Text, nullable=True)
     operation_type = db.Column(db.String(50), nullable=True)
+    retry_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    request_fingerprint = db.Column(db.String(64), nullable=True, index=True)
+    # JSON object of seconds per stage: upload, submit, queue_wait, remote, download, db_write.
+    stage_timings = db.Column(db.Text, nullable=True)
+
+    @classmethod
+    def get_by_operation_id(cls, operation_id):
+        """Looks a row up through the unique operation_id index."""
+        return cls.query.filter_by(operation_id=operation_id).one_or_none()
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        data['stage_timings'] = json.loads(self.stage_timings) if self.stage_timings else {}
+        return data
 
 class SystemInstruction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -24,3 +36,81 @@ class SystemInstruction(db.Model):
 
     def to_dict(self):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+class BatchJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(80), unique=True, nullable=False)
+    job_type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    manifest_name = db.Column(db.String(255), nullable=True)
+    total_items = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # The process running the job renews this lease; only one process runs a job at a time (see batch.py).
+    lease_owner = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+class BatchItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(80), db.ForeignKey('batch_job.job_id'), nullable=False, index=True)
+    item_index = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)
+    input_payload = db.Column(db.Text, nullable=False)
+    output_payload = db.Column(db.Text, nullable=True)
+    error_message = db.Column(db.String(500), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    def to_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+class IdempotencyKey(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), unique=True, nullable=False)
+    endpoint = db.Column(db.String(100), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    response = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+class GenerationJob(db.Model):
+    """A background generation and the lease of the process running (and polling) it."""
+    id = db.Column(db.Integer, primary_key=True)
+    operation_id = db.Column(db.String(80), unique=True, nullable=False)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    # Name of the Vertex AI long-running operation once submitted; whoever takes the job over polls it.
+    remote_operation = db.Column(db.String(500), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    lease_owner = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True, index=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    error_message = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+class StoredFile(db.Model):
+    """A generated or uploaded file under static/, tracked for the local disk budget (see storage.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(500), unique=True, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    is_local = db.Column(db.Boolean, nullable=False, default=True, index=True)
+    gcs_uri = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    last_access = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+    evicted_at = db.Column(db.DateTime, nullable=True)
+    # Derivatives for the history view (see derivatives.py): a WebP thumbnail, or poster
+    # frame for videos, and a short low-bitrate preview clip of videos.
+    thumbnail_path = db.Column(db.String(500), nullable=True)
+    preview_path = db.Column(db.String(500), nullable=True)
+
+    def to_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
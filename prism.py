@@ -1,13 +1,16 @@
 import base64
 import io
+import logging
 import re
-import timeit
 from typing import Any, Dict
 
 from PIL import Image
 from google.cloud import aiplatform
 from google.cloud.aiplatform.gapic import PredictResponse
-from google.cloud import storage
+import backends
+import metrics
+from ratelimit import rate_limiter
+from retry import default_policy
 
 PROJECT_ID = "cloud-lvm-training-nonprod"
 LOCATION = "us-central1"
@@ -15,11 +18,12 @@ LOCATION = "us-central1"
 aiplatform.init(project=PROJECT_ID, location=LOCATION)
 
 api_regional_endpoint = f"{LOCATION}-aiplatform.googleapis.com"
-client_options = {"api_endpoint": api_regional_endpoint}
-client = aiplatform.gapic.PredictionServiceClient(client_options=client_options)
+client = backends.prediction_client(api_regional_endpoint)
 
-model_endpoint = f"projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/imagen-product-recontext-preview-06-30"
-print(f"Prediction client initiated on project {PROJECT_ID} in {LOCATION}.")
+MODEL_NAME = "imagen-product-recontext-preview-06-30"
+model_endpoint = f"projects/{PROJECT_ID}/locations/{LOCATION}/publishers/google/models/{MODEL_NAME}"
+logger = logging.getLogger(__name__)
+logger.info("Prediction client initiated on project %s in %s.", PROJECT_ID, LOCATION)
 
 
 def prediction_to_pil_image(
@@ -40,10 +44,13 @@ def download_gcs_image_bytes(uri: str) -> bytes:
     else:
         raise ValueError(f"Invalid GCS URI format: {uri}")
 
-    storage_client = storage.Client()
+    storage_client = backends.storage_client()
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(object_name)
-    return blob.download_as_bytes()
+    with metrics.track_gcs('download') as transfer:
+        data = default_policy.call(blob.download_as_bytes)
+        transfer.bytes = len(data)
+    return data
 
 
 def call_product_recontext(
@@ -112,12 +119,14 @@ def call_product_recontext(
 
     instances.append(instance)
 
-    start = timeit.default_timer()
+    def predict():
+        rate_limiter.acquire(MODEL_NAME)
+        return client.predict(
+            endpoint=model_endpoint, instances=instances, parameters=parameters
+        )
 
-    response = client.predict(
-        endpoint=model_endpoint, instances=instances, parameters=parameters
-    )
-    end = timeit.default_timer()
-    print(f"Product Recontextualization took {end - start:.2f}s.")
+    with metrics.track_model_call(MODEL_NAME) as timer:
+        response = default_policy.call(predict)
+    logger.info("Product Recontextualization took %.2fs.", timer.seconds)
 
     return response
@@ -0,0 +1,109 @@
+import cProfile
+import datetime
+import functools
+import io
+import logging
+import os
+import pstats
+
+from flask import current_app, request
+
+from ids import new_operation_id
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SUFFIX = '.prof'
+
+
+def profiling_requested():
+    """Profiling is on for every request via PROFILING_ENABLED, or per request via the header."""
+    if current_app.config['PROFILING_ENABLED']:
+        return True
+    value = request.headers.get(current_app.config['PROFILE_HEADER'], '')
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def profiled(name):
+    """
+    Route decorator that records a cProfile of the handler when profiling is
+    requested and saves it under PROFILE_DIR. The profile ID is returned in
+    the X-Profile-Id response header.
+
+    Only the handler itself is profiled; for streamed responses the work done
+    while the body is generated is not included.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not profiling_requested():
+                return fn(*args, **kwargs)
+
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:
+                # Another profiler is already active in this interpreter.
+                logger.warning("Skipping profile of %s: %s", name, e)
+                return fn(*args, **kwargs)
+            try:
+                response = fn(*args, **kwargs)
+            finally:
+                profiler.disable()
+
+            profile_id = save_profile(profiler, name)
+            response = current_app.make_response(response)
+            response.headers['X-Profile-Id'] = profile_id
+            return response
+        return wrapper
+    return decorator
+
+
+def save_profile(profiler, name):
+    profile_dir = current_app.config['PROFILE_DIR']
+    os.makedirs(profile_dir, exist_ok=True)
+    profile_id = new_operation_id(name.replace('-', '_'))
+    profiler.dump_stats(os.path.join(profile_dir, profile_id + PROFILE_SUFFIX))
+    prune_profiles(profile_dir, current_app.config['PROFILE_MAX_FILES'])
+    logger.info("Saved profile %s", profile_id)
+    return profile_id
+
+
+def prune_profiles(profile_dir, max_files):
+    # IDs are ULID-based, so lexical order is creation order.
+    names = sorted(n for n in os.listdir(profile_dir) if n.endswith(PROFILE_SUFFIX))
+    for stale in names[:max(len(names) - max_files, 0)]:
+        os.remove(os.path.join(profile_dir, stale))
+
+
+def list_profiles(profile_dir):
+    if not os.path.isdir(profile_dir):
+        return []
+    profiles = []
+    for file_name in sorted(os.listdir(profile_dir), reverse=True):
+        if not file_name.endswith(PROFILE_SUFFIX):
+            continue
+        path = os.path.join(profile_dir, file_name)
+        stat = os.stat(path)
+        profile_id = file_name[:-len(PROFILE_SUFFIX)]
+        profiles.append({
+            'profile_id': profile_id,
+            'endpoint': profile_id.rsplit('_', 1)[0],
+            'created_at': datetime.datetime.utcfromtimestamp(stat.st_mtime).isoformat(),
+            'size_bytes': stat.st_size,
+        })
+    return profiles
+
+
+def profile_path(profile_dir, profile_id):
+    """Returns the path of a saved profile, or None for unknown or malformed IDs."""
+    file_name = os.path.basename(profile_id) + PROFILE_SUFFIX
+    path = os.path.join(profile_dir, file_name)
+    return path if os.path.isfile(path) else None
+
+
+def profile_summary(path, sort='cumulative', limit=50):
+    """Renders the top `limit` functions of a saved profile as pstats text."""
+    out = io.StringIO()
+    stats = pstats.Stats(path, stream=out)
+    stats.sort_stats(sort).print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,65 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+import metrics
+
+
+def _normalize(text):
+    # Whitespace-only edits (trailing newlines, re-indented templates) should not miss the cache.
+    return ' '.join((text or '').split())
+
+
+def prompt_key(model, system_instructions, user_prompt, image_bytes=None):
+    """Hash of everything that determines a generated prompt."""
+    digest = hashlib.sha256()
+    for part in (model, _normalize(system_instructions), _normalize(user_prompt)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    digest.update(hashlib.sha256(image_bytes).digest() if image_bytes else b'')
+    return digest.hexdigest()
+
+
+class TTLCache:
+    """
+    A thread-safe LRU cache whose entries also expire `ttl_seconds` after
+    they were stored. Lookups count hits and misses in genmedia_prompt_cache.
+    """
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.prompt_cache.labels(result='hit' if entry else 'miss').inc()
+        return entry[1] if entry else None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+prompt_cache = TTLCache(Config.PROMPT_CACHE_MAX_ENTRIES, Config.PROMPT_CACHE_TTL_SECONDS)
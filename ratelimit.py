@@ -0,0 +1,119 @@
+import math
+import threading
+import time
+
+from config import Config
+import metrics
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a caller gives up waiting for a rate limit token."""
+
+
+class TokenBucket:
+    """
+    A token bucket that queues callers instead of rejecting them.
+
+    Tokens are reserved under the lock (the balance may go negative), and each
+    caller sleeps outside the lock until its reservation matures. Waiters are
+    therefore served in arrival order and the bucket never busy-waits.
+    """
+
+    def __init__(self, per_minute, burst=1):
+        self.rate = per_minute / 60.0
+        self.capacity = max(float(burst), 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout=None):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if timeout is not None and wait > timeout:
+                raise RateLimitTimeout(f"Rate limit wait of {wait:.1f}s exceeds timeout of {timeout}s.")
+            self.tokens -= 1
+            self.waiting += 1
+        try:
+            if wait > 0:
+                time.sleep(wait)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        return wait
+
+
+def _positive_number(value, prefix, field):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value <= 0:
+        raise ValueError(f"Rate limit '{field}' for '{prefix}' must be a positive number, got {value!r}.")
+    return float(value)
+
+
+class RateLimiter:
+    """
+    Per-model token buckets shared by every Vertex AI call site.
+
+    Limits are keyed by model name prefix (e.g. 'veo-3.0-fast', 'gemini') and
+    the longest matching prefix wins. Models without a configured limit are
+    not throttled.
+    """
+
+    def __init__(self, limits=None):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.configure(limits or {})
+
+    def configure(self, limits):
+        """
+        Replaces the configured limits; {'prefix': {'per_minute': n, 'burst': m}}.
+        Raises ValueError, and keeps the current limits, unless every rate and
+        burst is a positive number.
+        """
+        if not isinstance(limits, dict):
+            raise ValueError("Rate limits must be an object keyed by model name prefix.")
+        buckets = {}
+        for prefix, limit in limits.items():
+            if not isinstance(limit, dict):
+                raise ValueError(f"Rate limit for '{prefix}' must be an object with 'per_minute' and optional 'burst'.")
+            per_minute = _positive_number(limit.get('per_minute'), prefix, 'per_minute')
+            burst = _positive_number(limit.get('burst', 1), prefix, 'burst')
+            buckets[prefix] = TokenBucket(per_minute, burst)
+        with self._lock:
+            self._buckets = buckets
+
+    def limits(self):
+        with self._lock:
+            return {
+                prefix: {'per_minute': bucket.rate * 60, 'burst': bucket.capacity}
+                for prefix, bucket in self._buckets.items()
+            }
+
+    def bucket_for(self, model_name):
+        with self._lock:
+            matches = [prefix for prefix in self._buckets if model_name and model_name.startswith(prefix)]
+            return self._buckets[max(matches, key=len)] if matches else None
+
+    def acquire(self, model_name, timeout=None):
+        """Blocks until a request to `model_name` fits within its quota; returns seconds waited."""
+        bucket = self.bucket_for(model_name)
+        if bucket is None:
+            return 0.0
+        waited = bucket.acquire(timeout)
+        metrics.queue_wait_seconds.labels(model=model_name, stage='rate_limit').observe(waited)
+        return waited
+
+    def stats(self):
+        with self._lock:
+            return {
+                prefix: {'available_tokens': round(bucket.tokens, 2), 'waiting': bucket.waiting}
+                for prefix, bucket in self._buckets.items()
+            }
+
+
+rate_limiter = RateLimiter(Config.RATE_LIMITS)
@@ -0,0 +1,440 @@
+"""
+Replays recorded traffic against the app, backed by fake_backend.py, at the
+original pace or sped up.
+
+A trace comes from a history database (each GenerationHistory row is turned
+back into the request that created it, using its input_payload) or from a
+JSONL request log with one request per line:
+
+    {"timestamp": "2025-08-06T03:14:08Z", "method": "POST", "path": "/generate-videos",
+     "json": {"prompts": ["..."]}, "form": {...}, "files": {"image": "image"}}
+
+`files` maps form fields to a synthetic payload: "image", "mask" or "video".
+
+    python replay.py --history instance/history.db --speed 1 --speed 10 --speed 100 --max-gap 30
+    python replay.py --log traffic.jsonl --speed 10 --repeat 5
+    python replay.py --history instance/history.db --export trace.jsonl
+
+Each speed is replayed open-loop: requests are sent at their scheduled time
+whether or not earlier ones have finished. The report covers latency and
+completion time per route, dispatch lag, the app's queue depth and queue
+waits, SQLite statement latency and lock errors, and peak RSS and threads.
+"""
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import loadtest
+
+ASYNC_PATHS = ('/generate-videos', '/generate-image-video', '/veo-edit', '/veo-advanced-edit')
+
+
+def parse_timestamp(value):
+    """Accepts epoch seconds or ISO-8601 (with or without a trailing Z / offset); returns epoch seconds."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    parsed = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00').replace(' ', 'T'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def request_from_history(row):
+    """
+    Rebuilds the request that created a GenerationHistory row (a dict of
+    its columns), or returns None for rows that cannot be replayed (e.g.
+    batch items, which are driven by their job).
+    """
+    payload = json.loads(row.get('input_payload') or '{}')
+    operation_id = row['operation_id']
+    operation_type = row.get('operation_type')
+    prompt = row.get('prompt') or ''
+
+    if operation_type == 'vto':
+        form = {key: payload.get(key) for key in ('prompt', 'person_description', 'product_description', 'model_endpoint_name', 'sample_count', 'base_steps', 'seed')}
+        files = {}
+        for field, uri_key in (('person_image', 'person_image_uri'), ('product_image', 'product_image_uri')):
+            if payload.get(uri_key):
+                form[uri_key] = payload[uri_key]
+            else:
+                files[field] = 'image'
+        return {'method': 'POST', 'path': '/vto', 'form': form, 'files': files}
+    if operation_type in ('recontext', 'product_recontext'):
+        form = {key: payload.get(key) for key in (
+            'prompt', 'product_description', 'sample_count', 'base_steps', 'safety_setting',
+            'person_generation', 'aspect_ratio', 'resolution', 'seed',
+        )}
+        form['disable_prompt_enhancement'] = str(bool(payload.get('disable_prompt_enhancement'))).lower()
+        if payload.get('image_uris'):
+            form['image_uris'] = payload['image_uris']
+            return {'method': 'POST', 'path': '/product-recontext', 'form': form, 'files': {}}
+        return {'method': 'POST', 'path': '/product-recontext', 'form': form, 'files': {'images': 'image'}}
+    if operation_type == 'segmentation':
+        return {'method': 'POST', 'path': '/segment-image', 'form': {'mode': payload.get('mode', 'foreground'), 'prompt': payload.get('prompt')}, 'files': {'image': 'image'}}
+    if operation_type == 'imagen_edit':
+        return {'method': 'POST', 'path': '/imagen-edit', 'form': {'prompt': prompt}, 'files': {'original_image': 'image', 'mask_image': 'mask'}}
+    if operation_type == 'veo_edit':
+        parameters = payload.get('parameters') or {}
+        form = {key: payload.get(key) for key in ('prompt', 'video_gcs', 'mask_gcs', 'mask_mime_type', 'mask_mode')}
+        form.update(aspect_ratio=parameters.get('aspectRatio'), enhance_prompt=str(bool(parameters.get('enhancePrompt'))).lower(),
+                    sample_count=parameters.get('sampleCount'), duration=parameters.get('durationSeconds'))
+        return {'method': 'POST', 'path': '/veo-edit', 'form': form, 'files': {}}
+    if operation_type == 'veo_advanced_edit':
+        parameters = payload.get('parameters') or {}
+        form = {key: payload.get(key) for key in ('prompt', 'video_gcs', 'image_gcs', 'last_frame_gcs', 'camera_control')}
+        form.update(aspect_ratio=parameters.get('aspectRatio'), enhance_prompt=str(bool(parameters.get('enhancePrompt'))).lower(),
+                    duration=parameters.get('durationSeconds'))
+        return {'method': 'POST', 'path': '/veo-advanced-edit', 'form': form, 'files': {}}
+    if operation_type and operation_type.startswith('batch'):
+        return None
+
+    if operation_id.startswith('img_op'):
+        # Image-to-video and editor images share the prefix; only the former ever has a video.
+        if row.get('video_path') or row.get('status') in ('queued', 'running'):
+            return {'method': 'POST', 'path': '/generate-image-video', 'form': {'prompt': prompt}, 'files': {'image': 'image'}}
+        return {'method': 'POST', 'path': '/generate-editor-image', 'json': {'prompt': prompt, 'aspect_ratio': '1:1'}}
+    if operation_id.startswith('op_'):
+        return {'method': 'POST', 'path': '/generate-videos', 'json': {'prompts': [prompt]}}
+    return None
+
+
+def load_history_trace(path):
+    """Reads replayable requests, in arrival order, from a history SQLite database."""
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = [dict(row) for row in connection.execute('SELECT * FROM generation_history ORDER BY timestamp')]
+    finally:
+        connection.close()
+    trace = []
+    for row in rows:
+        request = request_from_history(row)
+        if request and row.get('timestamp'):
+            request['timestamp'] = parse_timestamp(row['timestamp'])
+            trace.append(request)
+    return trace
+
+
+def load_log_trace(path):
+    """Reads a JSONL request log; lines without a path or timestamp are skipped."""
+    trace = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if not entry.get('path') or entry.get('timestamp') is None:
+                continue
+            entry['timestamp'] = parse_timestamp(entry['timestamp'])
+            entry.setdefault('method', 'POST' if entry.get('json') or entry.get('form') else 'GET')
+            trace.append(entry)
+    trace.sort(key=lambda entry: entry['timestamp'])
+    return trace
+
+
+def schedule(trace, speed=1.0, max_gap=None, repeat=1):
+    """
+    Returns (offset_seconds, request) pairs: arrival times relative to the
+    first request, divided by `speed`, with idle gaps longer than `max_gap`
+    (in trace time) shortened to `max_gap`. `repeat` plays the trace back to
+    back that many times.
+    """
+    offsets = []
+    elapsed = 0.0
+    for i, request in enumerate(trace):
+        if i:
+            gap = request['timestamp'] - trace[i - 1]['timestamp']
+            elapsed += min(gap, max_gap) if max_gap is not None else gap
+        offsets.append(elapsed)
+    # Repeats are separated by the trace's average gap.
+    span = elapsed + (elapsed / (len(trace) - 1) if len(trace) > 1 else 0.0)
+
+    timeline = []
+    for n in range(repeat):
+        for offset, request in zip(offsets, trace):
+            timeline.append(((n * span + offset) / speed, request))
+    return timeline
+
+
+def parse_metrics(text):
+    """Minimal Prometheus text parser: {'name{labels}': value}."""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        key, _, value = line.rpartition(' ')
+        try:
+            samples[key] = float(value)
+        except ValueError:
+            continue
+    return samples
+
+
+def _sum_matching(samples, prefix):
+    return sum(value for key, value in samples.items() if key.startswith(prefix))
+
+
+class AppMonitor:
+    """Polls /metrics during a pass and keeps the peaks of the queue and concurrency gauges."""
+
+    def __init__(self, base_url, interval=0.5):
+        self.base_url = base_url
+        self.interval = interval
+        self.peak_queue_depth = 0.0
+        self.peak_in_flight = 0.0
+        self.peak_rate_limit_waiting = 0.0
+        self.first = self.last = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._session = requests.Session()
+
+    def scrape(self):
+        try:
+            samples = parse_metrics(self._session.get(self.base_url + '/metrics', timeout=30).text)
+        except requests.RequestException:
+            return
+        self.first = self.first or samples
+        self.last = samples
+        self.peak_queue_depth = max(self.peak_queue_depth, _sum_matching(samples, 'genmedia_queue_depth{'))
+        self.peak_in_flight = max(self.peak_in_flight, _sum_matching(samples, 'genmedia_in_flight{'))
+        self.peak_rate_limit_waiting = max(self.peak_rate_limit_waiting, _sum_matching(samples, 'genmedia_rate_limit_waiting{'))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.scrape()
+
+    def __enter__(self):
+        self.scrape()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.scrape()
+
+    def queue_waits(self):
+        """Mean and total seconds waited per queue stage during the pass, from the histogram deltas."""
+        waits = {}
+        if not (self.first and self.last):
+            return waits
+        for stage in ('rate_limit', 'worker'):
+            suffix = f'stage="{stage}"}}'
+            count = sum(v for k, v in self.last.items() if k.startswith('genmedia_queue_wait_seconds_count') and k.endswith(suffix)) - \
+                sum(v for k, v in self.first.items() if k.startswith('genmedia_queue_wait_seconds_count') and k.endswith(suffix))
+            total = sum(v for k, v in self.last.items() if k.startswith('genmedia_queue_wait_seconds_sum') and k.endswith(suffix)) - \
+                sum(v for k, v in self.first.items() if k.startswith('genmedia_queue_wait_seconds_sum') and k.endswith(suffix))
+            waits[stage] = {'count': int(count), 'total': round(total, 3), 'mean': round(total / count, 4) if count else None}
+        return waits
+
+
+class DbStats:
+    """SQLAlchemy engine hooks that time every statement and count 'database is locked' errors."""
+
+    def __init__(self):
+        self.latencies = []
+        self.lock_errors = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def attach(self, engine):
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+        event.listen(engine, 'handle_error', self._error)
+
+    def _before(self, *args):
+        self._local.start = time.perf_counter()
+
+    def _after(self, *args):
+        seconds = time.perf_counter() - getattr(self._local, 'start', time.perf_counter())
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def _error(self, context):
+        with self._lock:
+            self.errors += 1
+            if 'locked' in str(context.original_exception).lower():
+                self.lock_errors += 1
+
+    def reset(self):
+        with self._lock:
+            self.latencies, self.lock_errors, self.errors = [], 0, 0
+
+    def summary(self):
+        with self._lock:
+            return dict(loadtest.summarize_latencies(self.latencies), lock_errors=self.lock_errors, errors=self.errors)
+
+
+def send(client, request, payloads, options):
+    """Sends one trace request and, for asynchronous routes, waits for the operation to finish."""
+    kwargs = {}
+    if request.get('json') is not None:
+        kwargs['json'] = request['json']
+    if request.get('form'):
+        kwargs['data'] = {key: value for key, value in request['form'].items() if value is not None}
+    if request.get('files'):
+        kwargs['files'] = {
+            field: (f"{field}.{'mp4' if kind == 'video' else 'png'}", getattr(payloads, kind), 'video/mp4' if kind == 'video' else 'image/png')
+            for field, kind in request['files'].items()
+        }
+    response = client.request(request.get('method', 'POST'), request['path'], **kwargs)
+    if not loadtest._ok(response) or request['path'] not in ASYNC_PATHS:
+        return loadtest._ok(response)
+
+    body = response.json()
+    operation_ids = body.get('operation_ids') or [body['operation_id']]
+    start = time.perf_counter()
+    done = loadtest._wait_for_operations(client, operation_ids, options.poll_interval, options.completion_timeout)
+    client.recorder.add(f"completion {request['path']}", time.perf_counter() - start, 200 if done else 'incomplete')
+    return done
+
+
+def replay(timeline, base_url, payloads, options, pid=None, db_stats=None):
+    """Plays one timeline open-loop and returns its report."""
+    recorder = loadtest.Recorder()
+    lags = []
+    lock = threading.Lock()
+    local = threading.local()
+
+    def run(request, scheduled):
+        with lock:
+            lags.append(time.perf_counter() - scheduled)
+        if not hasattr(local, 'client'):
+            local.client = loadtest.Client(base_url, recorder)
+        started = time.perf_counter()
+        try:
+            ok = send(local.client, request, payloads, options)
+        except Exception:
+            ok = False
+        recorder.add_iteration(time.perf_counter() - started, ok)
+
+    if db_stats:
+        db_stats.reset()
+    with loadtest.ResourceSampler(pid) as sampler, AppMonitor(base_url) as monitor:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options.max_inflight) as pool:
+            for offset, request in timeline:
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(run, request, start + offset)
+        wall = time.perf_counter() - start
+
+    report = recorder.summary(wall)
+    report.update(
+        scheduled_seconds=round(timeline[-1][0], 3) if timeline else 0.0,
+        dispatch_lag=loadtest.summarize_latencies(lags),
+        queue={
+            'peak_queue_depth': monitor.peak_queue_depth,
+            'peak_in_flight': monitor.peak_in_flight,
+            'peak_rate_limit_waiting': monitor.peak_rate_limit_waiting,
+            'waits': monitor.queue_waits(),
+        },
+        db=db_stats.summary() if db_stats else None,
+        peak_rss_bytes=sampler.peak_rss_bytes,
+        peak_threads=sampler.peak_threads,
+    )
+    return report
+
+
+def print_report(speed, report):
+    latency, db = report['latency'], report['db'] or {}
+    rss = report['peak_rss_bytes']
+    print(f"{speed:>6g}x  {report['requests']:>5} req  {report['errors']:>4} err  wall {report['wall_seconds']}s "
+          f"(scheduled {report['scheduled_seconds']}s)  p95 {latency.get('p95')}s  lag p95 {report['dispatch_lag'].get('p95')}s")
+    print(f"        queue depth peak {report['queue']['peak_queue_depth']:g}  in flight peak {report['queue']['peak_in_flight']:g}  "
+          f"waits {report['queue']['waits']}")
+    print(f"        db p95 {db.get('p95')}s  max {db.get('max')}s  lock errors {db.get('lock_errors')}  "
+          f"rss {rss / (1 << 20) if rss else 0:.0f}MiB  threads {report['peak_threads']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded traffic against the app and a fake backend.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--history', help="History SQLite database, e.g. instance/history.db.")
+    source.add_argument('--log', help="JSONL request log.")
+    parser.add_argument('--export', help="Write the trace as a JSONL request log and exit.")
+    parser.add_argument('--speed', type=float, action='append', help="Repeatable; default 1, 10 and 100.")
+    parser.add_argument('--max-gap', type=float, help="Shorten idle gaps in the trace to at most this many seconds.")
+    parser.add_argument('--repeat', type=int, default=1, help="Play the trace back to back this many times.")
+    parser.add_argument('--max-inflight', type=int, default=512, help="Client threads; arrivals beyond this show up as dispatch lag.")
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--completion-timeout', type=float, default=900)
+    parser.add_argument('--url', help="Replay against an already running server instead of starting one in-process.")
+    parser.add_argument('--pid', type=int, help="With --url, the server process to sample RSS and threads from.")
+    parser.add_argument('--no-rate-limits', action='store_true', help="In-process only: lift Config.RATE_LIMITS.")
+    parser.add_argument('--fake-latency', type=float, default=2.0)
+    parser.add_argument('--fake-lro-seconds', type=float, default=60.0)
+    parser.add_argument('--output-dir', default=loadtest.DEFAULT_OUTPUT_DIR)
+    options = parser.parse_args(argv)
+
+    trace = load_history_trace(options.history) if options.history else load_log_trace(options.log)
+    if options.export:
+        with open(options.export, 'w') as f:
+            for request in trace:
+                entry = dict(request, timestamp=datetime.datetime.fromtimestamp(request['timestamp'], datetime.timezone.utc).isoformat())
+                f.write(json.dumps(entry) + '\n')
+        print(f"Wrote {len(trace)} requests to {options.export}")
+        return 0
+    if not trace:
+        print("No replayable requests in the trace.")
+        return 1
+
+    output_dir = os.path.abspath(options.output_dir)
+    db_stats = None
+    if options.url:
+        base_url, pid = options.url, options.pid
+    else:
+        app, base_url, _ = loadtest.start_local_stack(
+            tempfile.mkdtemp(prefix='genmedia-replay-'),
+            {'latency': options.fake_latency, 'lro_seconds': options.fake_lro_seconds},
+            rate_limits={} if options.no_rate_limits else None,
+        )
+        pid = os.getpid()
+        from extensions import db
+        db_stats = DbStats()
+        with app.app_context():
+            db_stats.attach(db.engine)
+
+    payloads = loadtest.Payloads()
+    results = {
+        'meta': {
+            'commit': loadtest.git_commit(),
+            'started_at': datetime.datetime.utcnow().isoformat() + 'Z',
+            'source': options.history or options.log,
+            'trace_requests': len(trace),
+            'target': options.url or 'in-process',
+            'options': {k: v for k, v in vars(options).items() if k not in ('export', 'output_dir')},
+        },
+        'speeds': {},
+    }
+    for speed in options.speed or [1.0, 10.0, 100.0]:
+        timeline = schedule(trace, speed, options.max_gap, options.repeat)
+        report = replay(timeline, base_url, payloads, options, pid, db_stats)
+        results['speeds'][f"{speed:g}x"] = report
+        print_report(speed, report)
+
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    path = os.path.join(output_dir, f"replay-{stamp}-{results['meta']['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
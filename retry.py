@@ -0,0 +1,148 @@
+import logging
+import random
+import time
+
+import requests
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: timeouts, quota (429) and transient server errors.
+RETRYABLE_HTTP_CODES = {408, 429, 500, 502, 503, 504}
+# gRPC codes reported in long-running operation errors: DEADLINE_EXCEEDED,
+# RESOURCE_EXHAUSTED, ABORTED, INTERNAL, UNAVAILABLE.
+RETRYABLE_GRPC_CODES = {4, 8, 10, 13, 14}
+
+
+class RetryableOperationError(Exception):
+    """A long-running operation finished with a transient error and can be resubmitted."""
+
+
+def _http_status(exc):
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        # google.api_core.exceptions.GoogleAPICallError and google.genai.errors.APIError
+        # both expose the HTTP status as an int `code`.
+        status = getattr(exc, 'code', None)
+    return status if isinstance(status, int) else None
+
+
+def _causes(exc):
+    """The exception and those it wraps, e.g. requests -> urllib3 -> the socket error."""
+    seen = set()
+    while isinstance(exc, BaseException) and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        wrapped = exc.args[0] if exc.args and isinstance(exc.args[0], BaseException) else getattr(exc, 'reason', None)
+        exc = exc.__cause__ or exc.__context__ or wrapped
+
+
+def is_retryable(exc):
+    """Classifies an exception from requests, google-api-core or google-genai as transient or not."""
+    if isinstance(exc, RetryableOperationError):
+        return True
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError, ConnectionError, TimeoutError)):
+        return True
+    return _http_status(exc) in RETRYABLE_HTTP_CODES
+
+
+def is_safe_to_resubmit(exc):
+    """
+    Whether a failed submit of a billed generation certainly never reached
+    the model: a 429 quota rejection, or a refused connection. A 5xx or a
+    timeout can happen after Vertex AI has started the operation, and sending
+    the request again would then start (and bill) a second one.
+    """
+    if _http_status(exc) == 429:
+        return True
+    return any(isinstance(cause, ConnectionRefusedError) for cause in _causes(exc))
+
+
+def is_retryable_operation_error(error):
+    """Classifies the `error` of a finished long-running operation (a dict or an object with `code`)."""
+    code = error.get('code') if isinstance(error, dict) else getattr(error, 'code', None)
+    return code in RETRYABLE_GRPC_CODES or code in RETRYABLE_HTTP_CODES
+
+
+class RetryPolicy:
+    """
+    Capped exponential backoff with full jitter.
+
+    Attempt n (starting at 0) sleeps a uniform random time in
+    [0, min(max_delay, base_delay * 2**n)] before the next try, which spreads
+    out clients that failed together instead of retrying in lockstep.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0, classify=is_retryable):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.classify = classify
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, fn, *args, on_retry=None, **kwargs):
+        """
+        Calls fn(*args, **kwargs), retrying retryable failures.
+
+        `on_retry(attempt, exc, delay)` is invoked before each sleep, e.g. to
+        record the retry on a history row. The last exception is re-raised
+        once attempts are exhausted or the error is not retryable.
+        """
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.max_attempts or not self.classify(e):
+                    raise
+                delay = self.backoff(attempt - 1)
+                if on_retry:
+                    on_retry(attempt, e, delay)
+                logger.warning("Retrying after transient error (attempt %d/%d, sleeping %.1fs): %s",
+                               attempt, self.max_attempts - 1, delay, e)
+                time.sleep(delay)
+
+
+default_policy = RetryPolicy(
+    max_attempts=Config.RETRY_MAX_ATTEMPTS,
+    base_delay=Config.RETRY_BASE_DELAY,
+    max_delay=Config.RETRY_MAX_DELAY,
+)
+
+# Submits of long-running generations (Veo), which are billed once accepted.
+# Only errors that prove the request was never accepted are retried; see
+# is_safe_to_resubmit. Polls and downloads are idempotent and use default_policy.
+submit_policy = RetryPolicy(
+    max_attempts=Config.RETRY_MAX_ATTEMPTS,
+    base_delay=Config.RETRY_BASE_DELAY,
+    max_delay=Config.RETRY_MAX_DELAY,
+    classify=is_safe_to_resubmit,
+)
+
+# Resubmits a whole generation whose operation failed transiently (e.g. code 8,
+# RESOURCE_EXHAUSTED). The failed operation produced nothing, so the new one
+# is not a duplicate. Only RetryableOperationError counts, so exhausted
+# transport retries from submit_policy and default_policy are not multiplied again.
+resubmit_policy = RetryPolicy(
+    max_attempts=Config.RETRY_MAX_RESUBMITS,
+    base_delay=Config.RETRY_BASE_DELAY * 5,
+    max_delay=Config.RETRY_MAX_DELAY,
+    classify=lambda e: isinstance(e, RetryableOperationError),
+)
+
+
+def history_retry_recorder(history_item, session, timings):
+    """
+    Returns an on_retry callback that counts retries on a GenerationHistory row.
+    Those commits count as db_write in the row's metrics.StageTimings.
+    """
+    def on_retry(attempt, exc, delay):
+        history_item.retry_count = (history_item.retry_count or 0) + 1
+        timings.write(session)
+    return on_retry
@@ -1,8 +1,25 @@
-from flask import Blueprint, render_template, request, jsonify
+import os
+from flask import Blueprint, render_template, request, jsonify, Response, stream_with_context, send_file, abort
 from services import AppService
+from fanout import parse_seeds
+import metrics
+import profiling
+import storage
+from profiling import profiled
 
 main = Blueprint('main', __name__)
 
+def wants_event_stream(data):
+    """Prompt endpoints stream server-sent events for "stream": true or Accept: text/event-stream."""
+    return bool(data.get('stream')) or request.accept_mimetypes.best == 'text/event-stream'
+
+def prompt_event_stream(result):
+    if isinstance(result, tuple):
+        return jsonify(result[0]), result[1]
+    # X-Accel-Buffering stops nginx-style proxies from holding chunks back until the end.
+    return Response(stream_with_context(result), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 def initialize_routes(app, service):
     @main.route('/')
     def index():
@@ -14,7 +31,10 @@ def initialize_routes(app, service):
         user_prompt = data.get('user_prompt', '')
         system_instructions = data.get('system_instructions', '')
         image_data = data.get('image_data')
-        result = service.generate_prompt(user_prompt, system_instructions, image_data)
+        fresh = bool(data.get('fresh'))
+        if wants_event_stream(data):
+            return prompt_event_stream(service.generate_prompt_stream(user_prompt, system_instructions, image_data, fresh=fresh))
+        result = service.generate_prompt(user_prompt, system_instructions, image_data, fresh=fresh)
         return jsonify(result)
 
     @main.route('/refine-prompt', methods=['POST'])
@@ -22,9 +42,20 @@ def initialize_routes(app, service):
         data = request.json
         current_prompt = data.get('current_prompt', '')
         refine_instruction = data.get('refine_instruction', '')
-        result = service.refine_prompt(current_prompt, refine_instruction)
+        fresh = bool(data.get('fresh'))
+        if wants_event_stream(data):
+            return prompt_event_stream(service.refine_prompt_stream(current_prompt, refine_instruction, fresh=fresh))
+        result = service.refine_prompt(current_prompt, refine_instruction, fresh=fresh)
         return jsonify(result)
 
+    @main.route('/generate-prompts', methods=['POST'])
+    def generate_prompts():
+        data = request.json
+        result = service.generate_prompts(data.get('prompts'), data.get('system_instructions', ''), fresh=bool(data.get('fresh')))
+        if isinstance(result, tuple):
+            return jsonify(result[0]), result[1]
+        return Response(stream_with_context(result), mimetype='application/x-ndjson')
+
     @main.route('/generate-videos', methods=['POST'])
     def generate_videos():
         data = request.json
@@ -33,7 +64,11 @@ def initialize_routes(app, service):
         seed = data.get('seed', 42)
         aspect_ratio = data.get('aspect_ratio', '16:9')
         negative_prompt = data.get('negative_prompt', '')
-        result = service.generate_videos(prompts, model_name, seed, aspect_ratio, negative_prompt)
+        idempotency_key = request.headers.get('Idempotency-Key')
+        coalesce = data.get('coalesce')
+        result = service.generate_videos(prompts, model_name, seed, aspect_ratio, negative_prompt, idempotency_key, coalesce)
+        if isinstance(result, tuple):
+            return jsonify(result[0]), result[1]
         return jsonify(result)
 
     @main.route('/generate-image-video', methods=['POST'])
@@ -46,7 +81,13 @@ def initialize_routes(app, service):
         seed = int(request.form.get('seed', 42))
         aspect_ratio = request.form.get('aspect_ratio', '16:9')
         negative_prompt = request.form.get('negative_prompt', '')
-        result = service.generate_image_video(file, prompt, model_name, seed, aspect_ratio, negative_prompt)
+        idempotency_key = request.headers.get('Idempotency-Key')
+        coalesce = request.form.get('coalesce')
+        if coalesce is not None:
+            coalesce = coalesce.lower() == 'true'
+        result = service.generate_image_video(file, prompt, model_name, seed, aspect_ratio, negative_prompt, idempotency_key, coalesce)
+        if isinstance(result, tuple):
+            return jsonify(result[0]), result[1]
         return jsonify(result)
 
     @main.route('/video-status/<operation_id>', methods=['GET'])
@@ -87,6 +128,35 @@ def initialize_routes(app, service):
         result = service.generate_editor_image(prompt, negative_prompt, seed, aspect_ratio)
         return jsonify(result)
 
+    # Take precedence over the default static view for generated and uploaded media.
+    @main.route('/static/uploads/<path:filename>', methods=['GET'])
+    def uploaded_media(filename):
+        return storage.send_media(storage.UPLOAD_DIR, filename)
+
+    @main.route(f"/{app.config['VIDEO_DIR']}/<path:filename>", methods=['GET'])
+    def video_media(filename):
+        return storage.send_media(app.config['VIDEO_DIR'], filename)
+
+    @main.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(service.render_metrics(), content_type=metrics.CONTENT_TYPE)
+
+    @main.route('/profiles', methods=['GET'])
+    def list_profiles():
+        return jsonify({'profiles': profiling.list_profiles(app.config['PROFILE_DIR'])})
+
+    @main.route('/profiles/<profile_id>', methods=['GET'])
+    def get_profile(profile_id):
+        path = profiling.profile_path(app.config['PROFILE_DIR'], profile_id)
+        if not path:
+            abort(404)
+        if request.args.get('format') == 'text':
+            sort = request.args.get('sort', 'cumulative')
+            if sort not in ('cumulative', 'tottime', 'calls'):
+                return jsonify({'error': "sort must be one of: cumulative, tottime, calls."}), 400
+            return Response(profiling.profile_summary(path, sort), mimetype='text/plain')
+        return send_file(os.path.abspath(path), as_attachment=True, download_name=f"{profile_id}.prof")
+
     @main.route('/get-settings', methods=['GET'])
     def get_settings():
         result = service.get_settings()
@@ -97,10 +167,14 @@ def initialize_routes(app, service):
         data = request.json
         project_id = data.get('project_id')
         gcs_bucket = data.get('gcs_bucket')
-        result = service.save_settings(project_id, gcs_bucket)
+        rate_limits = data.get('rate_limits')
+        result = service.save_settings(project_id, gcs_bucket, rate_limits)
+        if isinstance(result, tuple):
+            return jsonify(result[0]), result[1]
         return jsonify(result)
 
     @main.route('/segment-image', methods=['POST'])
+    @profiled('segment-image')
     def segment_image_route():
         if 'image' not in request.files:
             return jsonify({'error': 'No image file provided.'}), 400
@@ -111,6 +185,7 @@ def initialize_routes(app, service):
         return jsonify(result)
 
     @main.route('/vto', methods=['POST'])
+    @profiled('vto')
     def vto_route():
         person_image_file = request.files.get('person_image')
         product_image_file = request.files.get('product_image')
@@ -124,6 +199,20 @@ def initialize_routes(app, service):
         sample_count = request.form.get('sample_count', type=int)
         base_steps = request.form.get('base_steps', type=int)
         seed = request.form.get('seed', type=int)
+        if request.form.get('fan_out', 'false').lower() == 'true':
+            try:
+                seeds = parse_seeds(request.form.get('seeds'))
+            except ValueError:
+                return jsonify({'error': 'seeds must be a comma-separated list of integers.'}), 400
+            seeds = seeds or ([seed] if seed is not None else None)
+            result = service.vto_fan_out(
+                person_image_file, product_image_file, mask_image_file,
+                person_image_uri, product_image_uri, prompt, person_description,
+                product_description, model_endpoint_name, sample_count, base_steps, seeds
+            )
+            if isinstance(result, tuple):
+                return jsonify(result[0]), result[1]
+            return Response(stream_with_context(result), mimetype='application/x-ndjson')
         result = service.vto(
             person_image_file, product_image_file, mask_image_file,
             person_image_uri, product_image_uri, prompt, person_description,
@@ -132,6 +221,7 @@ def initialize_routes(app, service):
         return jsonify(result)
 
     @main.route('/product-recontext', methods=['POST'])
+    @profiled('product-recontext')
     def product_recontext():
         image_files = request.files.getlist('images')
         image_uris = request.form.getlist('image_uris')
@@ -145,6 +235,20 @@ def initialize_routes(app, service):
         aspect_ratio = request.form.get('aspect_ratio')
         resolution = request.form.get('resolution')
         seed = request.form.get('seed', type=int)
+        if request.form.get('fan_out', 'false').lower() == 'true':
+            try:
+                seeds = parse_seeds(request.form.get('seeds'))
+            except ValueError:
+                return jsonify({'error': 'seeds must be a comma-separated list of integers.'}), 400
+            seeds = seeds or ([seed] if seed is not None else None)
+            result = service.product_recontext_fan_out(
+                image_files, image_uris, prompt, product_description,
+                disable_prompt_enhancement, sample_count, base_steps, safety_setting,
+                person_generation, aspect_ratio, resolution, seeds
+            )
+            if isinstance(result, tuple):
+                return jsonify(result[0]), result[1]
+            return Response(stream_with_context(result), mimetype='application/x-ndjson')
         result = service.product_recontext(
             image_files, image_uris, prompt, product_description,
             disable_prompt_enhancement, sample_count, base_steps, safety_setting,
@@ -152,6 +256,40 @@ def initialize_routes(app, service):
         )
         return jsonify(result)
 
+    @main.route('/batch-jobs', methods=['POST'])
+    def submit_batch_job():
+        manifest_file = request.files.get('manifest')
+        job_type = request.form.get('job_type', 'vto')
+        result = service.submit_batch_job(manifest_file, job_type)
+        if isinstance(result, tuple):
+            return jsonify(result[0]), result[1]
+        return jsonify(result), 202
+
+    @main.route('/batch-jobs', methods=['GET'])
+    def list_batch_jobs():
+        result = service.list_batch_jobs()
+        return jsonify(result)
+
+    @main.route('/batch-jobs/<job_id>', methods=['GET'])
+    def get_batch_job(job_id):
+        result = service.get_batch_job(job_id)
+        return jsonify(result)
+
+    @main.route('/batch-jobs/<job_id>/resume', methods=['POST'])
+    def resume_batch_job(job_id):
+        retry_failed = request.form.get('retry_failed', 'false').lower() == 'true'
+        result = service.resume_batch_job(job_id, retry_failed)
+        return jsonify(result)
+
+    @main.route('/batch-jobs/<job_id>/results', methods=['GET'])
+    def get_batch_results(job_id):
+        result = service.get_batch_results(job_id)
+        return Response(
+            stream_with_context(result),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': f'attachment; filename={job_id}_results.jsonl'}
+        )
+
     @main.route('/get-usage-report', methods=['GET'])
     def get_usage_report():
         range_param = request.args.get('range', '7d')
@@ -197,6 +335,7 @@ def initialize_routes(app, service):
         return jsonify(result)
 
     @main.route('/imagen-edit', methods=['POST'])
+    @profiled('imagen-edit')
     def imagen_edit_route():
         edit_prompt = request.form.get('prompt')
         edit_mode = request.form.get('edit_mode')
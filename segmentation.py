@@ -1,17 +1,24 @@
 import os
 import base64
+import logging
 import vertexai
 from vertexai.preview.vision_models import Image, ImageSegmentationModel
+import metrics
+from ratelimit import rate_limiter
+from retry import default_policy
+
+MODEL_NAME = "image-segmentation-001"
+
+logger = logging.getLogger(__name__)
 
 def initialize_segmentation_model():
     """Initializes the Vertex AI Image Segmentation Model."""
     try:
         # The model name is fixed according to the documentation
-        model_name = "image-segmentation-001"
-        segmentation_model = ImageSegmentationModel.from_pretrained(model_name)
+        segmentation_model = ImageSegmentationModel.from_pretrained(MODEL_NAME)
         return segmentation_model
     except Exception as e:
-        print(f"Error initializing segmentation model: {e}")
+        logger.error("Error initializing segmentation model: %s", e)
         return None
 
 def segment_image(
@@ -43,20 +50,25 @@ def segment_image(
             if not prompt:
                 return {"error": f"Prompt is required for '{segmentation_mode}' mode."}
             
-            response = model.segment_image(
-                image,
+            kwargs = dict(
                 mode=segmentation_mode,
                 prompt=prompt,
                 confidence_threshold=confidence_threshold,
                 mask_dilation=mask_dilation,
             )
         else: # foreground/background
-            response = model.segment_image(
-                image,
+            kwargs = dict(
                 mode=segmentation_mode,
                 mask_dilation=mask_dilation,
             )
 
+        def segment():
+            rate_limiter.acquire(MODEL_NAME)
+            return model.segment_image(image, **kwargs)
+
+        with metrics.track_model_call(MODEL_NAME):
+            response = default_policy.call(segment)
+
         base64_masks = []
         if hasattr(response, '_prediction_response') and hasattr(response._prediction_response, 'predictions'):
             for prediction in response._prediction_response.predictions:
@@ -1,29 +1,53 @@
 import base64
 import io
 import json
+import logging
 import os
-import time
-import threading
+import re
 import datetime
+import functools
+import hashlib
 from PIL import Image
 import requests
-from google.cloud import storage
+from flask import abort
 from vertexai.preview.vision_models import ImageGenerationModel
 from segmentation import segment_image as segment_image_internal
 from vto import call_virtual_try_on, prediction_to_pil_image
 from prism import call_product_recontext, prediction_to_pil_image as prism_prediction_to_pil_image
-from veo_editing import generate_video as generate_veo_video, upload_to_gcs as upload_veo_to_gcs
+from veo_editing import VEO_EDIT_MODEL, generate_video as generate_veo_video, upload_to_gcs as upload_veo_to_gcs
 import imagenedit
+from fanout import plan_fan_out, fan_out, run_each
+from batch import BatchRunner, parse_manifest, job_progress, results_manifest
+from ratelimit import rate_limiter
+import idempotency
+import jobs
+import backends
+from ids import new_operation_id
+import logs
+import metrics
+import storage
+import derivatives
+from retry import default_policy, resubmit_policy, history_retry_recorder, is_retryable_operation_error, RetryableOperationError
 from extensions import db
-from models import GenerationHistory, SystemInstruction
+from models import GenerationHistory, SystemInstruction, BatchJob, BatchItem
 from utils import (
     generate_veo_prompt_internal,
-    generate_video_internal,
-    generate_image_video_internal,
+    stream_veo_prompt_internal,
+    record_worker_wait,
     upload_to_gcs,
     download_from_gcs,
 )
 
+logger = logging.getLogger(__name__)
+
+MEDIA_URL = re.compile(r'/static/[^\s"\']+\.(?:png|jpe?g|webp|mp4)')
+
+def refine_system_instruction(refine_instruction):
+    return f"Refine the following video prompt based on the instruction. Output only the new prompt.\n\nInstruction: {refine_instruction}"
+
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 class AppService:
     def __init__(self, app):
         self.app = app
@@ -31,94 +55,223 @@ class AppService:
         self.segmentation_model = None
         self.vto_client = None
         self.imagen_client = None
+        self.batch_runner = BatchRunner(app, self)
+        self.job_runner = jobs.Worker.from_config(app, self)
 
     def init_clients(self, project_id, location):
         try:
-            import vertexai
-            from google import genai
             from segmentation import initialize_segmentation_model
             from vto import get_vto_client
             import imagenedit
 
-            vertexai.init(project=project_id, location=location)
-            self.client = genai.Client(vertexai=True, project=project_id, location=location)
+            backends.init_vertexai(project_id, location)
+            self.client = backends.genai_client(project_id, location)
             self.segmentation_model = initialize_segmentation_model()
             if not self.segmentation_model:
-                print("Warning: Segmentation model failed to initialize.")
+                logger.warning("Segmentation model failed to initialize.")
             self.vto_client = get_vto_client()
             self.imagen_client = imagenedit.initialize_imagen_client(project_id, location)
             return True
         except Exception as e:
-            print(f"Error during Google GenAI client initialization: {e}")
+            logger.error("Error during Google GenAI client initialization: %s", e)
             self.client = None
             self.segmentation_model = None
             self.vto_client = None
             self.imagen_client = None
             return False
 
-    def generate_prompt(self, user_prompt, system_instructions, image_data):
+    @metrics.tracked_operation('prompt')
+    def generate_prompt(self, user_prompt, system_instructions, image_data, fresh=False):
         if not user_prompt or not system_instructions:
             return {'error': 'User prompt and system instructions are required.'}, 400
-        final_prompt = generate_veo_prompt_internal(self.client, user_prompt, system_instructions, image_data)
+        final_prompt = generate_veo_prompt_internal(self.client, user_prompt, system_instructions, image_data, use_cache=not fresh)
         return {'final_prompt': final_prompt}
 
-    def refine_prompt(self, current_prompt, refine_instruction):
+    @metrics.tracked_operation('prompt')
+    def refine_prompt(self, current_prompt, refine_instruction, fresh=False):
         if not current_prompt or not refine_instruction:
             return {'error': 'Current prompt and refinement instruction are required.'}, 400
-        system_instruction = f"Refine the following video prompt based on the instruction. Output only the new prompt.\n\nInstruction: {refine_instruction}"
-        refined_prompt = generate_veo_prompt_internal(self.client, current_prompt, system_instruction)
+        refined_prompt = generate_veo_prompt_internal(self.client, current_prompt, refine_system_instruction(refine_instruction), use_cache=not fresh)
         return {'refined_prompt': refined_prompt}
 
-    def generate_videos(self, prompts, model_name, seed, aspect_ratio, negative_prompt):
+    def generate_prompt_stream(self, user_prompt, system_instructions, image_data, fresh=False):
+        if not user_prompt or not system_instructions:
+            return {'error': 'User prompt and system instructions are required.'}, 400
+        return self._stream_prompt('final_prompt', user_prompt, system_instructions, image_data, fresh)
+
+    def refine_prompt_stream(self, current_prompt, refine_instruction, fresh=False):
+        if not current_prompt or not refine_instruction:
+            return {'error': 'Current prompt and refinement instruction are required.'}, 400
+        return self._stream_prompt('refined_prompt', current_prompt, refine_system_instruction(refine_instruction), None, fresh)
+
+    def generate_prompts(self, prompts, system_instructions, fresh=False):
+        """
+        Generates a prompt for each of `prompts` (strings, or dicts with
+        'user_prompt' and optional 'image_data') against one system instruction.
+        Returns a generator of NDJSON lines, one per prompt as it finishes.
+        """
+        if not system_instructions or not isinstance(prompts, list) or not prompts:
+            return {'error': 'System instructions and a list of prompts are required.'}, 400
+        max_items = self.app.config['PROMPT_BATCH_MAX_ITEMS']
+        if len(prompts) > max_items:
+            return {'error': f"At most {max_items} prompts can be generated per request."}, 400
+        items = [item if isinstance(item, dict) else {'user_prompt': item} for item in prompts]
+        if not all(isinstance(item.get('user_prompt'), str) and item['user_prompt'].strip() for item in items):
+            return {'error': 'Every prompt needs a non-empty user_prompt.'}, 400
+        return self._stream_prompt_batch(items, system_instructions, fresh)
+
+    def _stream_prompt_batch(self, items, system_instructions, fresh):
+        """Yields one NDJSON line per prompt as it finishes, then a summary line."""
+        def generate(item):
+            # The streaming call raises on failure (generate_veo_prompt_internal returns the
+            # error as text), so each item reports its own error. Rate limiting is per call.
+            return ''.join(stream_veo_prompt_internal(
+                self.client, item['user_prompt'], system_instructions, item.get('image_data'), use_cache=not fresh))
+
+        with metrics.track_operation('prompt_batch'):
+            failed = 0
+            for index, final_prompt, error in run_each(generate, items, self.app.config['PROMPT_BATCH_MAX_WORKERS']):
+                result = {'index': index, 'user_prompt': items[index]['user_prompt']}
+                if error:
+                    failed += 1
+                    logger.warning("Prompt %d of batch failed: %s", index, error)
+                    result['error'] = f"Error generating prompt: {error}"
+                else:
+                    result['final_prompt'] = final_prompt
+                yield json.dumps(result) + '\n'
+            yield json.dumps({'done': True, 'completed': len(items) - failed, 'failed': failed}) + '\n'
+
+    def _stream_prompt(self, result_key, user_prompt, system_instructions, image_data, fresh):
+        """
+        Yields server-sent events: a 'chunk' event per piece of text as Gemini
+        produces it, then 'done' with the whole answer under `result_key`, or 'error'.
+        """
+        with metrics.track_operation('prompt'):
+            parts = []
+            try:
+                for text in stream_veo_prompt_internal(self.client, user_prompt, system_instructions, image_data, use_cache=not fresh):
+                    parts.append(text)
+                    yield server_sent_event('chunk', {'text': text})
+            except Exception as e:
+                logger.exception("Error during streamed VEO prompt generation: %s", e)
+                yield server_sent_event('error', {'error': f"Error generating prompt: {e}"})
+                return
+            yield server_sent_event('done', {result_key: ''.join(parts)})
+
+    def _with_idempotency_key(self, key, endpoint, request_hash, submit):
+        """Runs submit() once per Idempotency-Key; repeats get the original response."""
+        if not key:
+            return submit()
+        replay = idempotency.begin(key, endpoint, request_hash, self.app.config['IDEMPOTENCY_KEY_TTL_HOURS'])
+        if replay is not None:
+            return replay
+        try:
+            result = submit()
+        except Exception:
+            db.session.rollback()
+            idempotency.release(key)
+            raise
+        if isinstance(result, tuple):
+            idempotency.release(key)
+        else:
+            idempotency.complete(key, result)
+        return result
+
+    def _dispatch(self, kind, operation_id, payload):
+        """Starts a background generation job: on a thread of this process, or queued for a genmedia_worker."""
+        if self.app.config['JOB_EXECUTION'] == 'worker':
+            jobs.enqueue(kind, operation_id, payload)
+        else:
+            self.job_runner.submit(kind, operation_id, payload)
+
+    def generate_videos(self, prompts, model_name, seed, aspect_ratio, negative_prompt, idempotency_key=None, coalesce=None):
         if not prompts:
             return {'error': 'No prompts provided.'}, 400
-        operation_ids = []
-        for i, prompt in enumerate(prompts):
-            operation_id = f"op_{int(time.time() * 1000)}_{i}"
-            new_history = GenerationHistory(operation_id=operation_id, prompt=prompt, status='queued')
-            db.session.add(new_history)
-            db.session.commit()
-            operation_ids.append(operation_id)
-            thread = threading.Thread(
-                target=generate_video_internal,
-                args=(self.app.app_context(), self.client, prompt, operation_id, model_name, seed, aspect_ratio, negative_prompt),
-            )
-            thread.start()
-        return {'operation_ids': operation_ids}
+        if coalesce is None:
+            coalesce = self.app.config['COALESCE_INFLIGHT_REQUESTS']
+        request_hash = idempotency.request_fingerprint(
+            'generate-videos', prompts=prompts, model=model_name, seed=seed,
+            aspect_ratio=aspect_ratio, negative_prompt=negative_prompt,
+        )
 
-    def generate_image_video(self, file, prompt, model_name, seed, aspect_ratio, negative_prompt):
+        def submit():
+            operation_ids = []
+            coalesced = []
+            for i, prompt in enumerate(prompts):
+                fingerprint = idempotency.request_fingerprint(
+                    'generate-video', prompt=prompt, model=model_name, seed=seed,
+                    aspect_ratio=aspect_ratio, negative_prompt=negative_prompt,
+                )
+                with idempotency.coalesce_lock:
+                    existing = idempotency.find_inflight(fingerprint) if coalesce else None
+                    if existing:
+                        operation_ids.append(existing.operation_id)
+                        coalesced.append(existing.operation_id)
+                        continue
+                    operation_id = new_operation_id("op")
+                    new_history = GenerationHistory(operation_id=operation_id, prompt=prompt, status='queued', request_fingerprint=fingerprint)
+                    metrics.StageTimings().insert(new_history, db.session)
+                operation_ids.append(operation_id)
+                self._dispatch('video', operation_id, {
+                    'prompt': prompt, 'model_name': model_name, 'seed': seed,
+                    'aspect_ratio': aspect_ratio, 'negative_prompt': negative_prompt,
+                })
+            return {'operation_ids': operation_ids, 'coalesced': coalesced}
+
+        return self._with_idempotency_key(idempotency_key, 'generate-videos', request_hash, submit)
+
+    def generate_image_video(self, file, prompt, model_name, seed, aspect_ratio, negative_prompt, idempotency_key=None, coalesce=None):
         if file.filename == '' or not prompt:
             return {'error': 'Image and prompt are required.'}, 400
-        
-        image_bytes = file.read()
-        operation_id = f"img_op_{int(time.time() * 1000)}"
-        
-        _, f_ext = os.path.splitext(file.filename)
-        image_filename = f"{operation_id}{f_ext}"
-        image_save_path = os.path.join('static', 'uploads', image_filename)
-        with open(image_save_path, 'wb') as f:
-            f.write(image_bytes)
-        
-        relative_image_path = f"/{image_save_path}"
+        if coalesce is None:
+            coalesce = self.app.config['COALESCE_INFLIGHT_REQUESTS']
 
-        new_history = GenerationHistory(operation_id=operation_id, prompt=prompt, status='queued', image_path=relative_image_path)
-        db.session.add(new_history)
-        db.session.commit()
-        
-        thread = threading.Thread(
-            target=generate_image_video_internal,
-            args=(self.app.app_context(), prompt, operation_id, image_bytes, model_name, seed, aspect_ratio, negative_prompt),
+        image_bytes = file.read()
+        fingerprint = idempotency.request_fingerprint(
+            'generate-image-video', prompt=prompt, model=model_name, seed=seed,
+            aspect_ratio=aspect_ratio, negative_prompt=negative_prompt,
+            image_sha256=hashlib.sha256(image_bytes).hexdigest(),
         )
-        thread.start()
-        return {'operation_id': operation_id}
+
+        def submit():
+            with idempotency.coalesce_lock:
+                existing = idempotency.find_inflight(fingerprint) if coalesce else None
+                if existing:
+                    return {'operation_id': existing.operation_id, 'coalesced': True}
+
+                operation_id = new_operation_id("img_op")
+                logs.set_operation_id(operation_id)
+
+                _, f_ext = os.path.splitext(file.filename)
+                relative_image_path = storage.save(storage.UPLOAD_DIR, image_bytes, f_ext.lower())
+
+                new_history = GenerationHistory(operation_id=operation_id, prompt=prompt, status='queued', image_path=relative_image_path, request_fingerprint=fingerprint)
+                metrics.StageTimings().insert(new_history, db.session)
+
+            self._dispatch('image_video', operation_id, {
+                'prompt': prompt, 'image_path': relative_image_path, 'model_name': model_name, 'seed': seed,
+                'aspect_ratio': aspect_ratio, 'negative_prompt': negative_prompt,
+            })
+            return {'operation_id': operation_id, 'coalesced': False}
+
+        return self._with_idempotency_key(idempotency_key, 'generate-image-video', fingerprint, submit)
 
     def get_video_status(self, operation_id):
-        history_item = GenerationHistory.query.filter_by(operation_id=operation_id).first_or_404()
+        history_item = GenerationHistory.get_by_operation_id(operation_id) or abort(404)
         return history_item.to_dict()
 
     def get_generation_history(self):
         history = GenerationHistory.query.order_by(GenerationHistory.timestamp.desc()).all()
-        return {'history': [item.to_dict() for item in history]}
+        items = [item.to_dict() for item in history]
+        # Media each row shows: its image and video, plus any stored in output_payload (masks, fan-out images, ...).
+        media = [
+            [item['image_path'], item['video_path']] + MEDIA_URL.findall(item['output_payload'] or '')
+            for item in items
+        ]
+        found = derivatives.for_paths(url for urls in media for url in urls)
+        for item, urls in zip(items, media):
+            item['derivatives'] = {url: found[url] for url in urls if url in found}
+        return {'history': items}
 
     def get_system_instructions(self):
         instructions = SystemInstruction.query.all()
@@ -147,14 +300,18 @@ class AppService:
             return {'success': True}
         return {'error': 'Instruction not found.'}, 404
 
+    @metrics.tracked_operation('image')
     def generate_editor_image(self, prompt, negative_prompt, seed, aspect_ratio):
-        operation_id = f"img_op_{int(time.time() * 1000)}"
+        operation_id = new_operation_id("img_op")
+        logs.set_operation_id(operation_id)
+        timings = metrics.StageTimings()
         new_history = GenerationHistory(operation_id=operation_id, prompt=prompt, status='running')
         db.session.add(new_history)
-        db.session.commit()
+        timings.write(db.session)
 
         try:
-            generation_model = ImageGenerationModel.from_pretrained("imagen-4.0-generate-preview-06-06")
+            model_name = "imagen-4.0-generate-preview-06-06"
+            generation_model = ImageGenerationModel.from_pretrained(model_name)
             generation_params = {
                 "prompt": prompt,
                 "number_of_images": 1,
@@ -165,44 +322,64 @@ class AppService:
                 "add_watermark": False,
                 "seed": seed
             }
-            images = generation_model.generate_images(**generation_params)
+            def generate():
+                rate_limiter.acquire(model_name)
+                return generation_model.generate_images(**generation_params)
+
+            with metrics.track_model_call(model_name), timings.stage('remote'):
+                images = default_policy.call(generate, on_retry=history_retry_recorder(new_history, db.session, timings))
             image_bytes = images[0]._image_bytes
             
-            image_filename = f"{operation_id}.png"
-            image_save_path = os.path.join('static', 'uploads', image_filename)
-            with open(image_save_path, 'wb') as f:
-                f.write(image_bytes)
-            
-            relative_image_path = f"/{image_save_path}"
+            relative_image_path = storage.save(storage.UPLOAD_DIR, image_bytes, '.png')
             
             new_history.status = 'completed'
             new_history.image_path = relative_image_path
-            db.session.commit()
+            timings.commit(new_history, db.session)
 
             return {'image_data': base64.b64encode(image_bytes).decode('utf-8')}
 
         except Exception as e:
             new_history.status = 'failed'
             new_history.error_message = str(e)
-            db.session.commit()
+            timings.commit(new_history, db.session)
             return {'error': str(e)}, 500
 
     def get_settings(self):
-        return {'project_id': self.app.config['PROJECT_ID'], 'gcs_bucket': self.app.config['GCS_BUCKET_NAME']}
-
-    def save_settings(self, project_id, gcs_bucket):
+        return {
+            'project_id': self.app.config['PROJECT_ID'],
+            'gcs_bucket': self.app.config['GCS_BUCKET_NAME'],
+            'rate_limits': rate_limiter.limits(),
+            'rate_limit_stats': rate_limiter.stats(),
+        }
+
+    def render_metrics(self):
+        """Refreshes the queue depth gauges and renders all metrics for /metrics."""
+        metrics.queue_depth.labels(queue='generation').set(GenerationHistory.query.filter_by(status='queued').count())
+        metrics.queue_depth.labels(queue='batch_items').set(BatchItem.query.filter_by(status='pending').count())
+        for prefix, stats in rate_limiter.stats().items():
+            metrics.rate_limit_waiting.labels(model=prefix).set(stats['waiting'])
+        return metrics.REGISTRY.render()
+
+    def save_settings(self, project_id, gcs_bucket, rate_limits=None):
+        if rate_limits is not None:
+            try:
+                rate_limiter.configure(rate_limits)
+            except ValueError as e:
+                return {'success': False, 'message': str(e)}, 400
+            self.app.config['RATE_LIMITS'] = rate_limits
         self.app.config['PROJECT_ID'] = project_id
         self.app.config['GCS_BUCKET_NAME'] = gcs_bucket
 
         if self.init_clients(project_id, self.app.config['LOCATION']):
             try:
-                storage.Client(project=project_id).get_bucket(gcs_bucket)
+                backends.storage_client(project_id).get_bucket(gcs_bucket)
                 return {'success': True, 'message': 'Settings saved and validated successfully.'}
             except Exception as e:
                 return {'success': False, 'message': f'GCS Bucket validation failed: {e}'}
         else:
             return {'success': False, 'message': 'Vertex AI client initialization failed.'}
 
+    @metrics.tracked_operation('segmentation')
     def segment_image(self, file, mode, prompt):
         if not self.segmentation_model:
             return {'error': 'Segmentation model not initialized.'}, 500
@@ -210,15 +387,19 @@ class AppService:
         if file.filename == '':
             return {'error': 'No selected file.'}, 400
 
-        temp_path = os.path.join('static', 'uploads', file.filename)
+        operation_id = new_operation_id("seg_op")
+        logs.set_operation_id(operation_id)
+        timings = metrics.StageTimings()
+        temp_path = os.path.join('static', 'uploads', f"{operation_id}_{os.path.basename(file.filename)}")
         file.save(temp_path)
 
-        result = segment_image_internal(
-            model=self.segmentation_model,
-            input_file=temp_path,
-            segmentation_mode=mode,
-            prompt=prompt
-        )
+        with timings.stage('remote'):
+            result = segment_image_internal(
+                model=self.segmentation_model,
+                input_file=temp_path,
+                segmentation_mode=mode,
+                prompt=prompt
+            )
 
         os.remove(temp_path)
 
@@ -227,14 +408,8 @@ class AppService:
         
         mask_urls = []
         for i, mask_data in enumerate(result.get('masks', [])):
-            mask_bytes = base64.b64decode(mask_data)
-            mask_filename = f"mask_{int(time.time() * 1000)}_{i}.png"
-            mask_save_path = os.path.join('static', 'uploads', mask_filename)
-            with open(mask_save_path, 'wb') as f:
-                f.write(mask_bytes)
-            mask_urls.append(f"/{mask_save_path}")
-
-        operation_id = f"seg_op_{int(time.time() * 1000)}"
+            mask_urls.append(storage.save(storage.UPLOAD_DIR, base64.b64decode(mask_data), '.png'))
+
         input_payload = {'mode': mode, 'prompt': prompt, 'image': file.filename}
         output_payload = {'masks': mask_urls}
         new_history = GenerationHistory(
@@ -246,12 +421,15 @@ class AppService:
             operation_type='segmentation'
         )
         db.session.add(new_history)
-        db.session.commit()
+        timings.commit(new_history, db.session)
 
         return {'masks': mask_urls}
 
+    @metrics.tracked_operation('vto')
     def vto(self, person_image_file, product_image_file, mask_image_file, person_image_uri, product_image_uri, prompt, person_description, product_description, model_endpoint_name, sample_count, base_steps, seed):
-        operation_id = f"vto_op_{int(time.time() * 1000)}"
+        operation_id = new_operation_id("vto_op")
+        logs.set_operation_id(operation_id)
+        timings = metrics.StageTimings()
         if not (person_image_file or person_image_uri) or not (product_image_file or product_image_uri):
             return {'error': 'Person and product images (either file or URI) are required.'}, 400
 
@@ -260,35 +438,30 @@ class AppService:
         mask_image_bytes = mask_image_file.read() if mask_image_file else None
 
         try:
-            vto_project_id = "cloud-lvm-training-nonprod"
-            response = call_virtual_try_on(
-                client=self.vto_client,
-                project_id=vto_project_id,
-                location=self.app.config['LOCATION'],
-                model_endpoint_name=model_endpoint_name,
-                person_image_bytes=person_image_bytes,
-                product_image_bytes=product_image_bytes,
-                mask_image_bytes=mask_image_bytes,
-                person_image_uri=person_image_uri,
-                product_image_uri=product_image_uri,
-                prompt=prompt,
-                person_description=person_description,
-                product_description=product_description,
-                sample_count=sample_count,
-                base_steps=base_steps,
-                seed=seed,
-            )
+            with timings.stage('remote'):
+                response = call_virtual_try_on(
+                    client=self.vto_client,
+                    project_id=self.app.config['VTO_PROJECT_ID'],
+                    location=self.app.config['LOCATION'],
+                    model_endpoint_name=model_endpoint_name,
+                    person_image_bytes=person_image_bytes,
+                    product_image_bytes=product_image_bytes,
+                    mask_image_bytes=mask_image_bytes,
+                    person_image_uri=person_image_uri,
+                    product_image_uri=product_image_uri,
+                    prompt=prompt,
+                    person_description=person_description,
+                    product_description=product_description,
+                    sample_count=sample_count,
+                    base_steps=base_steps,
+                    seed=seed,
+                )
 
             generated_image_pil = prediction_to_pil_image(response.predictions[0])
             
-            image_filename = f"{operation_id}.png"
-            image_save_path = os.path.join('static', 'uploads', image_filename)
-            generated_image_pil.save(image_save_path)
-            
-            relative_image_path = f"/{image_save_path}"
-
             buf = io.BytesIO()
             generated_image_pil.save(buf, format='PNG')
+            relative_image_path = storage.save(storage.UPLOAD_DIR, buf.getvalue(), '.png')
             img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
 
             input_payload = {
@@ -312,7 +485,7 @@ class AppService:
                 image_path=relative_image_path
             )
             db.session.add(new_history)
-            db.session.commit()
+            timings.commit(new_history, db.session)
 
             return {'generated_image': img_str}
 
@@ -325,42 +498,42 @@ class AppService:
                 operation_type='vto'
             )
             db.session.add(new_history)
-            db.session.commit()
+            timings.commit(new_history, db.session)
             return {'error': str(e)}, 500
 
+    @metrics.tracked_operation('recontext')
     def product_recontext(self, image_files, image_uris, prompt, product_description, disable_prompt_enhancement, sample_count, base_steps, safety_setting, person_generation, aspect_ratio, resolution, seed):
-        operation_id = f"recontext_op_{int(time.time() * 1000)}"
+        operation_id = new_operation_id("recontext_op")
+        logs.set_operation_id(operation_id)
+        timings = metrics.StageTimings()
         image_bytes_list = [base64.b64encode(file.read()).decode('utf-8') for file in image_files]
 
         try:
-            response = call_product_recontext(
-                image_bytes_list=image_bytes_list,
-                image_uris_list=image_uris,
-                prompt=prompt,
-                product_description=product_description,
-                disable_prompt_enhancement=disable_prompt_enhancement,
-                sample_count=sample_count,
-                base_steps=base_steps,
-                safety_setting=safety_setting,
-                person_generation=person_generation,
-                aspect_ratio=aspect_ratio,
-                resolution=resolution,
-                seed=seed,
-            )
+            with timings.stage('remote'):
+                response = call_product_recontext(
+                    image_bytes_list=image_bytes_list,
+                    image_uris_list=image_uris,
+                    prompt=prompt,
+                    product_description=product_description,
+                    disable_prompt_enhancement=disable_prompt_enhancement,
+                    sample_count=sample_count,
+                    base_steps=base_steps,
+                    safety_setting=safety_setting,
+                    person_generation=person_generation,
+                    aspect_ratio=aspect_ratio,
+                    resolution=resolution,
+                    seed=seed,
+                )
 
             predictions = []
             saved_image_path = None
             for i, prediction in enumerate(response.predictions):
                 pil_image = prism_prediction_to_pil_image(prediction)
                 
-                if i == 0:
-                    image_filename = f"{operation_id}.png"
-                    image_save_path = os.path.join('static', 'uploads', image_filename)
-                    pil_image.save(image_save_path)
-                    saved_image_path = f"/{image_save_path}"
-
                 buf = io.BytesIO()
                 pil_image.save(buf, format='PNG')
+                if i == 0:
+                    saved_image_path = storage.save(storage.UPLOAD_DIR, buf.getvalue(), '.png')
                 img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
                 predictions.append(img_str)
 
@@ -387,7 +560,7 @@ class AppService:
                 image_path=saved_image_path
             )
             db.session.add(new_history)
-            db.session.commit()
+            timings.commit(new_history, db.session)
 
             return {'predictions': predictions}
 
@@ -400,9 +573,183 @@ class AppService:
                 operation_type='recontext'
             )
             db.session.add(new_history)
-            db.session.commit()
+            timings.commit(new_history, db.session)
             return {'error': str(e)}, 500
 
+    def vto_fan_out(self, person_image_file, product_image_file, mask_image_file, person_image_uri, product_image_uri, prompt, person_description, product_description, model_endpoint_name, sample_count, base_steps, seeds):
+        operation_id = new_operation_id("vto_op")
+        logs.set_operation_id(operation_id)
+        if not (person_image_file or person_image_uri) or not (product_image_file or product_image_uri):
+            return {'error': 'Person and product images (either file or URI) are required.'}, 400
+
+        call = functools.partial(
+            call_virtual_try_on,
+            client=self.vto_client,
+            project_id=self.app.config['VTO_PROJECT_ID'],
+            location=self.app.config['LOCATION'],
+            model_endpoint_name=model_endpoint_name,
+            person_image_bytes=person_image_file.read() if person_image_file else None,
+            product_image_bytes=product_image_file.read() if product_image_file else None,
+            mask_image_bytes=mask_image_file.read() if mask_image_file else None,
+            person_image_uri=person_image_uri,
+            product_image_uri=product_image_uri,
+            prompt=prompt,
+            person_description=person_description,
+            product_description=product_description,
+            base_steps=base_steps,
+        )
+        chunks = plan_fan_out(sample_count, seeds, self.app.config['VTO_MAX_SAMPLES_PER_CALL'])
+        input_payload = {
+            'prompt': prompt,
+            'person_description': person_description,
+            'product_description': product_description,
+            'model_endpoint_name': model_endpoint_name,
+            'sample_count': sample_count,
+            'base_steps': base_steps,
+            'seeds': seeds,
+            'person_image_uri': person_image_uri,
+            'product_image_uri': product_image_uri,
+            'fan_out': True,
+        }
+        return self._stream_fan_out(operation_id, 'vto', prompt or "VTO Generation", call, chunks, input_payload)
+
+    def product_recontext_fan_out(self, image_files, image_uris, prompt, product_description, disable_prompt_enhancement, sample_count, base_steps, safety_setting, person_generation, aspect_ratio, resolution, seeds):
+        operation_id = new_operation_id("recontext_op")
+        logs.set_operation_id(operation_id)
+        if not image_files and not image_uris:
+            return {'error': 'At least one product image (either file or URI) is required.'}, 400
+
+        call = functools.partial(
+            call_product_recontext,
+            image_bytes_list=[base64.b64encode(file.read()).decode('utf-8') for file in image_files],
+            image_uris_list=image_uris,
+            prompt=prompt,
+            product_description=product_description,
+            disable_prompt_enhancement=disable_prompt_enhancement,
+            base_steps=base_steps,
+            safety_setting=safety_setting,
+            person_generation=person_generation,
+            aspect_ratio=aspect_ratio,
+            resolution=resolution,
+        )
+        chunks = plan_fan_out(sample_count, seeds, self.app.config['RECONTEXT_MAX_SAMPLES_PER_CALL'])
+        input_payload = {
+            'prompt': prompt,
+            'product_description': product_description,
+            'disable_prompt_enhancement': disable_prompt_enhancement,
+            'sample_count': sample_count,
+            'base_steps': base_steps,
+            'seeds': seeds,
+            'safety_setting': safety_setting,
+            'person_generation': person_generation,
+            'aspect_ratio': aspect_ratio,
+            'resolution': resolution,
+            'image_uris': image_uris,
+            'fan_out': True,
+        }
+        return self._stream_fan_out(operation_id, 'recontext', prompt or "Product Recontext", call, chunks, input_payload)
+
+    def _stream_fan_out(self, operation_id, operation_type, prompt, call, chunks, input_payload):
+        """Yields one NDJSON line per sample as it finishes, then a summary line."""
+        with metrics.track_operation(f"{operation_type}_fan_out"):
+            timings = metrics.StageTimings()
+            remote = metrics.Timer()
+            image_paths = []
+            errors = []
+            try:
+                for result in fan_out(call, chunks, self.app.config['FANOUT_MAX_WORKERS']):
+                    if 'prediction' in result:
+                        self._save_fan_out_sample(result)
+                    if 'error' in result:
+                        errors.append(result)
+                    else:
+                        image_paths.append(result['image_path'])
+                    yield json.dumps(result) + '\n'
+            finally:
+                # Recorded even if the client disconnects mid-stream, so the samples saved so far are kept.
+                timings.add('remote', remote.stop())
+                new_history = GenerationHistory(
+                    operation_id=operation_id,
+                    prompt=prompt,
+                    status='completed' if image_paths else 'failed',
+                    input_payload=json.dumps(input_payload),
+                    output_payload=json.dumps({'images': image_paths, 'errors': errors}),
+                    error_message=errors[0]['error'][:500] if errors else None,
+                    operation_type=operation_type,
+                    image_path=image_paths[0] if image_paths else None
+                )
+                db.session.add(new_history)
+                timings.commit(new_history, db.session)
+
+            yield json.dumps({
+                'done': True,
+                'operation_id': operation_id,
+                'completed': len(image_paths),
+                'failed': len(errors),
+            }) + '\n'
+
+    @staticmethod
+    def _save_fan_out_sample(result):
+        """Saves one fan-out prediction in place, turning a filtered sample or a failed save into an error entry."""
+        prediction = result.pop('prediction')
+        # The prediction is already a base64 PNG; save and relay it without a PIL round trip.
+        img_str = prediction.get('bytesBase64Encoded')
+        if not img_str:
+            reason = prediction.get('raiFilteredReason')
+            result['error'] = f"Sample was filtered: {reason}" if reason else "Model returned no image for this sample."
+            return
+        try:
+            result['image_path'] = storage.save(storage.UPLOAD_DIR, base64.b64decode(img_str), '.png')
+        except Exception as e:
+            logger.exception("Could not save fan-out sample %s: %s", result['sample'], e)
+            result['error'] = f"Could not save image: {e}"
+            return
+        result['image'] = img_str
+
+    def submit_batch_job(self, manifest_file, job_type):
+        if not manifest_file or manifest_file.filename == '':
+            return {'error': 'A JSONL or CSV manifest file is required.'}, 400
+
+        items, errors = parse_manifest(manifest_file.filename, manifest_file.read(), job_type)
+        if errors:
+            return {'error': 'Invalid manifest.', 'details': errors[:20]}, 400
+        if not items:
+            return {'error': 'Manifest contains no items.'}, 400
+
+        job_id = new_operation_id("batch")
+        job = BatchJob(job_id=job_id, job_type=job_type, manifest_name=manifest_file.filename, total_items=len(items))
+        db.session.add(job)
+        db.session.add_all([
+            BatchItem(job_id=job_id, item_index=i, input_payload=json.dumps(item))
+            for i, item in enumerate(items)
+        ])
+        db.session.commit()
+
+        self.batch_runner.start(job_id)
+        return {'job_id': job_id, 'total_items': len(items)}
+
+    def list_batch_jobs(self):
+        jobs = BatchJob.query.order_by(BatchJob.created_at.desc()).all()
+        return {'jobs': [job.to_dict() for job in jobs]}
+
+    def get_batch_job(self, job_id):
+        job = BatchJob.query.filter_by(job_id=job_id).first_or_404()
+        progress = job_progress(job)
+        progress['active'] = self.batch_runner.is_active(job_id)
+        return progress
+
+    def resume_batch_job(self, job_id, retry_failed):
+        job = BatchJob.query.filter_by(job_id=job_id).first_or_404()
+        if retry_failed:
+            BatchItem.query.filter_by(job_id=job_id, status='failed').update({'status': 'pending'})
+            db.session.commit()
+        started = self.batch_runner.start(job.job_id)
+        return {'job_id': job_id, 'resumed': started}
+
+    def get_batch_results(self, job_id):
+        BatchJob.query.filter_by(job_id=job_id).first_or_404()
+        return results_manifest(job_id)
+
     def get_usage_report(self, range_param):
         try:
             if range_param == '7d':
@@ -503,6 +850,17 @@ class AppService:
                     success_rate = (completed_items / total_items) * 100
                     report_text += f"  • Success rate: {success_rate:.2f}%\n"
             
+            if range_param in ('7d', '4w'):
+                timing_rows = [item.stage_timings for item in history_items]
+            else:
+                timing_rows = [row.stage_timings for row in GenerationHistory.query.with_entities(GenerationHistory.stage_timings)
+                               .filter(GenerationHistory.stage_timings.isnot(None))]
+            stage_summary = metrics.summarize_stage_timings(timing_rows)
+            if stage_summary:
+                report_text += "\n⏱️ Stage Timings (seconds):\n"
+                for stage, stats in stage_summary.items():
+                    report_text += f"  • {stage}: avg {stats['avg']:.2f}, p95 {stats['p95']:.2f}, max {stats['max']:.2f} ({stats['count']} requests)\n"
+
             report_text += "\n💡 Note:\n"
             report_text += "  • This report is based on local database records\n"
             report_text += "  • For real-time Cloud Monitoring metrics, install: pip install google-cloud-monitoring\n"
@@ -513,7 +871,8 @@ class AppService:
                     'source': 'local_database',
                     'total_requests': total_requests if 'total_requests' in locals() else 0,
                     'completed_requests': completed_requests if 'completed_requests' in locals() else 0,
-                    'failed_requests': failed_requests if 'failed_requests' in locals() else 0
+                    'failed_requests': failed_requests if 'failed_requests' in locals() else 0,
+                    'stage_timings': stage_summary,
                 }
             }
             
@@ -521,7 +880,9 @@ class AppService:
             return {'error': f'Failed to generate usage report: {str(e)}'}
 
     def veo_edit(self, prompt, video_gcs, mask_gcs, mask_mime_type, mask_mode, aspect_ratio, enhance_prompt, sample_count, duration, video_file, mask_file):
-        operation_id = f"veo_edit_op_{int(time.time() * 1000)}"
+        operation_id = new_operation_id("veo_edit_op")
+        logs.set_operation_id(operation_id)
+        timings = metrics.StageTimings()
         
         if not (video_gcs or video_file):
             return {'error': 'Video GCS URI or file is required.'}, 400
@@ -532,7 +893,8 @@ class AppService:
             if video_file:
                 temp_video_path = os.path.join('static', 'uploads', f"{operation_id}_{video_file.filename}")
                 video_file.save(temp_video_path)
-                video_gcs = upload_veo_to_gcs(self.app.config['PROJECT_ID'], self.app.config['GCS_BUCKET_NAME'], temp_video_path, f"veo-edit-inputs/{operation_id}_{video_file.filename}")
+                with timings.stage('upload'):
+                    video_gcs = upload_veo_to_gcs(self.app.config['PROJECT_ID'], self.app.config['GCS_BUCKET_NAME'], temp_video_path, f"veo-edit-inputs/{operation_id}_{video_file.filename}")
                 os.remove(temp_video_path)
                 if not video_gcs:
                     return {'error': 'Failed to upload video to GCS.'}, 500
@@ -540,7 +902,8 @@ class AppService:
             if mask_file:
                 temp_mask_path = os.path.join('static', 'uploads', f"{operation_id}_{mask_file.filename}")
                 mask_file.save(temp_mask_path)
-                mask_gcs = upload_veo_to_gcs(self.app.config['PROJECT_ID'], self.app.config['GCS_BUCKET_NAME'], temp_mask_path, f"veo-edit-inputs/{operation_id}_{mask_file.filename}")
+                with timings.stage('upload'):
+                    mask_gcs = upload_veo_to_gcs(self.app.config['PROJECT_ID'], self.app.config['GCS_BUCKET_NAME'], temp_mask_path, f"veo-edit-inputs/{operation_id}_{mask_file.filename}")
                 os.remove(temp_mask_path)
                 if not mask_gcs:
                     return {'error': 'Failed to upload mask to GCS.'}, 500
@@ -565,13 +928,12 @@ class AppService:
                 input_payload=json.dumps(input_payload),
                 operation_type='veo_edit'
             )
-            db.session.add(new_history)
-            db.session.commit()
+            timings.insert(new_history, db.session)
 
-            thread = threading.Thread(target=self.veo_edit_internal, args=(
-                self.app.app_context(), operation_id, prompt, parameters, mask_gcs, mask_mime_type, mask_mode, video_gcs, None, None, None
-            ))
-            thread.start()
+            self._dispatch('veo_edit', operation_id, {
+                'prompt': prompt, 'parameters': parameters, 'mask_gcs': mask_gcs, 'mask_mime_type': mask_mime_type,
+                'mask_mode': mask_mode, 'video_gcs': video_gcs, 'image_uri': None, 'last_frame_uri': None, 'camera_control': None,
+            })
 
             return {'operation_id': operation_id}
 
@@ -579,13 +941,16 @@ class AppService:
             return {'error': str(e)}, 500
 
     def veo_advanced_edit(self, prompt, aspect_ratio, enhance_prompt, duration, camera_control, image_gcs, video_gcs, last_frame_gcs, image_file, video_file, last_frame_file):
-        operation_id = f"veo_advanced_op_{int(time.time() * 1000)}"
+        operation_id = new_operation_id("veo_advanced_op")
+        logs.set_operation_id(operation_id)
+        timings = metrics.StageTimings()
         
         try:
             if image_file:
                 temp_image_path = os.path.join('static', 'uploads', f"{operation_id}_{image_file.filename}")
                 image_file.save(temp_image_path)
-                image_gcs = upload_veo_to_gcs(self.app.config['PROJECT_ID'], self.app.config['GCS_BUCKET_NAME'], temp_image_path, f"veo-advanced-inputs/{operation_id}_{image_file.filename}")
+                with timings.stage('upload'):
+                    image_gcs = upload_veo_to_gcs(self.app.config['PROJECT_ID'], self.app.config['GCS_BUCKET_NAME'], temp_image_path, f"veo-advanced-inputs/{operation_id}_{image_file.filename}")
                 os.remove(temp_image_path)
                 if not image_gcs:
                     return {'error': 'Failed to upload image to GCS.'}, 500
@@ -593,7 +958,8 @@ class AppService:
             if video_file:
                 temp_video_path = os.path.join('static', 'uploads', f"{operation_id}_{video_file.filename}")
                 video_file.save(temp_video_path)
-                video_gcs = upload_veo_to_gcs(self.app.config['PROJECT_ID'], self.app.config['GCS_BUCKET_NAME'], temp_video_path, f"veo-advanced-inputs/{operation_id}_{video_file.filename}")
+                with timings.stage('upload'):
+                    video_gcs = upload_veo_to_gcs(self.app.config['PROJECT_ID'], self.app.config['GCS_BUCKET_NAME'], temp_video_path, f"veo-advanced-inputs/{operation_id}_{video_file.filename}")
                 os.remove(temp_video_path)
                 if not video_gcs:
                     return {'error': 'Failed to upload video to GCS.'}, 500
@@ -601,7 +967,8 @@ class AppService:
             if last_frame_file:
                 temp_last_frame_path = os.path.join('static', 'uploads', f"{operation_id}_{last_frame_file.filename}")
                 last_frame_file.save(temp_last_frame_path)
-                last_frame_gcs = upload_veo_to_gcs(self.app.config['PROJECT_ID'], self.app.config['GCS_BUCKET_NAME'], temp_last_frame_path, f"veo-advanced-inputs/{operation_id}_{last_frame_file.filename}")
+                with timings.stage('upload'):
+                    last_frame_gcs = upload_veo_to_gcs(self.app.config['PROJECT_ID'], self.app.config['GCS_BUCKET_NAME'], temp_last_frame_path, f"veo-advanced-inputs/{operation_id}_{last_frame_file.filename}")
                 os.remove(temp_last_frame_path)
                 if not last_frame_gcs:
                     return {'error': 'Failed to upload last frame to GCS.'}, 500
@@ -625,24 +992,26 @@ class AppService:
                 input_payload=json.dumps(input_payload),
                 operation_type='veo_advanced_edit'
             )
-            db.session.add(new_history)
-            db.session.commit()
+            timings.insert(new_history, db.session)
 
-            thread = threading.Thread(target=self.veo_edit_internal, args=(
-                self.app.app_context(), operation_id, prompt, parameters, None, None, None, video_gcs, image_gcs, last_frame_gcs, camera_control
-            ))
-            thread.start()
+            self._dispatch('veo_edit', operation_id, {
+                'prompt': prompt, 'parameters': parameters, 'mask_gcs': None, 'mask_mime_type': None,
+                'mask_mode': None, 'video_gcs': video_gcs, 'image_uri': image_gcs, 'last_frame_uri': last_frame_gcs, 'camera_control': camera_control,
+            })
 
             return {'operation_id': operation_id}
 
         except Exception as e:
             return {'error': str(e)}, 500
 
+    @metrics.tracked_operation('imagen_edit')
     def imagen_edit(self, edit_prompt, edit_mode, mask_mode, original_image_file, mask_image_file):
         if not self.imagen_client:
             return {'error': 'Imagen client not initialized.'}, 500
 
-        operation_id = f"imagen_edit_op_{int(time.time() * 1000)}"
+        operation_id = new_operation_id("imagen_edit_op")
+        logs.set_operation_id(operation_id)
+        timings = metrics.StageTimings()
         
         if not original_image_file:
             return {'error': 'Original image is required.'}, 400
@@ -651,70 +1020,81 @@ class AppService:
         mask_image_bytes = mask_image_file.read() if mask_image_file else None
 
         try:
-            if edit_mode == "EDIT_MODE_DEFAULT": # Mask-free
-                result = imagenedit.edit_image_mask_free(self.imagen_client, edit_prompt, original_image_bytes)
-            else:
-                result = imagenedit.edit_image_with_mask(
-                    client=self.imagen_client,
-                    edit_prompt=edit_prompt,
-                    original_image_bytes=original_image_bytes,
-                    mask_image_bytes=mask_image_bytes,
-                    mask_mode=mask_mode,
-                    edit_mode=edit_mode
-                )
-
-            edited_image_bytes = imagenedit.get_bytes_from_pil(result.generated_images[0].image._pil_image)
-            
-            original_image_filename = f"{operation_id}_original.png"
-            original_image_save_path = os.path.join('static', 'uploads', original_image_filename)
-            with open(original_image_save_path, 'wb') as f:
-                f.write(original_image_bytes)
-            
-            edited_image_filename = f"{operation_id}_edited.png"
-            edited_image_save_path = os.path.join('static', 'uploads', edited_image_filename)
-            with open(edited_image_save_path, 'wb') as f:
-                f.write(edited_image_bytes)
+            with timings.stage('remote'):
+                if edit_mode == "EDIT_MODE_DEFAULT": # Mask-free
+                    result = imagenedit.edit_image_mask_free(self.imagen_client, edit_prompt, original_image_bytes)
+                else:
+                    result = imagenedit.edit_image_with_mask(
+                        client=self.imagen_client,
+                        edit_prompt=edit_prompt,
+                        original_image_bytes=original_image_bytes,
+                        mask_image_bytes=mask_image_bytes,
+                        mask_mode=mask_mode,
+                        edit_mode=edit_mode
+                    )
+
+            # The original is only stored once the edit succeeded, so a failed edit leaves no upload behind.
+            with timings.stage('upload'):
+                original_image_path = storage.save(storage.UPLOAD_DIR, original_image_bytes, '.png')
+            with timings.stage('download'):
+                edited_image_bytes = imagenedit.get_bytes_from_pil(result.generated_images[0].image._pil_image)
+                edited_image_path = storage.save(storage.UPLOAD_DIR, edited_image_bytes, '.png')
 
             new_history = GenerationHistory(
                 operation_id=operation_id,
                 prompt=edit_prompt,
                 status='completed',
-                image_path=f"/{original_image_save_path}",
-                output_payload=json.dumps({'edited_image_path': f"/{edited_image_save_path}"}),
+                image_path=original_image_path,
+                output_payload=json.dumps({'edited_image_path': edited_image_path}),
                 operation_type='imagen_edit'
             )
             db.session.add(new_history)
-            db.session.commit()
+            timings.commit(new_history, db.session)
 
             return {
-                'original_image_url': f"/{original_image_save_path}",
-                'edited_image_url': f"/{edited_image_save_path}"
+                'original_image_url': original_image_path,
+                'edited_image_url': edited_image_path
             }
 
         except Exception as e:
-            print(f"Error during Imagen edit: {e}")
+            logger.exception("Error during Imagen edit: %s", e)
             return {'error': str(e)}, 500
 
+    @metrics.tracked_operation('veo_edit')
     def veo_edit_internal(self, app_context, operation_id, prompt, parameters, mask_gcs, mask_mime_type, mask_mode, video_gcs, image_uri, last_frame_uri, camera_control):
+        logs.set_operation_id(operation_id)
         with app_context:
-            history_item = GenerationHistory.query.filter_by(operation_id=operation_id).first()
+            history_item = GenerationHistory.get_by_operation_id(operation_id)
+            timings = metrics.StageTimings.from_json(history_item.stage_timings)
+            record_worker_wait(history_item, VEO_EDIT_MODEL, timings)
             try:
                 history_item.status = 'running'
-                db.session.commit()
-
-                op = generate_veo_video(
-                    project_id=self.app.config['PROJECT_ID'],
-                    location=self.app.config['LOCATION'],
-                    prompt=prompt,
-                    parameters=parameters,
-                    mask_gcs=mask_gcs,
-                    mask_mime_type=mask_mime_type,
-                    mask_mode=mask_mode,
-                    video_uri=video_gcs,
-                    image_uri=image_uri,
-                    last_frame_uri=last_frame_uri,
-                    camera_control=camera_control,
-                )
+                timings.write(db.session)
+                on_retry = history_retry_recorder(history_item, db.session, timings)
+                lease = jobs.OperationLease(operation_id)
+
+                def submit_and_wait():
+                    op = generate_veo_video(
+                        project_id=self.app.config['PROJECT_ID'],
+                        location=self.app.config['LOCATION'],
+                        prompt=prompt,
+                        parameters=parameters,
+                        mask_gcs=mask_gcs,
+                        mask_mime_type=mask_mime_type,
+                        mask_mode=mask_mode,
+                        video_uri=video_gcs,
+                        image_uri=image_uri,
+                        last_frame_uri=last_frame_uri,
+                        camera_control=camera_control,
+                        on_retry=on_retry,
+                        timings=timings,
+                        lease=lease,
+                    )
+                    if "error" in op and is_retryable_operation_error(op["error"]):
+                        raise RetryableOperationError(op["error"].get("message"))
+                    return op
+
+                op = resubmit_policy.call(submit_and_wait, on_retry=on_retry)
 
                 if "error" in op:
                     history_item.status = 'failed'
@@ -725,16 +1105,22 @@ class AppService:
                     
                     gcs_bucket = gcs_uri.split('/')[2]
                     gcs_blob = '/'.join(gcs_uri.split('/')[3:])
-                    local_path = os.path.join(self.app.config['VIDEO_DIR'], f"{operation_id}.mp4")
-                    download_from_gcs(gcs_bucket, gcs_blob, local_path)
+                    # Downloaded next to the store so it can be renamed into place once complete.
+                    download_path = os.path.join(self.app.config['VIDEO_DIR'], f"{operation_id}.mp4.part")
+                    with timings.stage('download'):
+                        download_from_gcs(gcs_bucket, gcs_blob, download_path)
+                        history_item.video_path = storage.save_file(self.app.config['VIDEO_DIR'], download_path, '.mp4')
 
                     history_item.status = 'completed'
-                    history_item.video_path = f"/{local_path}"
                     history_item.output_payload = json.dumps(op['response'])
                 else:
                     history_item.status = 'failed'
                     history_item.error_message = "Operation finished with no error but no video was generated."
+            except jobs.LeaseLost as e:
+                logger.warning("%s", e)
+                return
             except Exception as e:
+                metrics.record_error('veo_edit', type(e).__name__)
                 history_item.status = 'failed'
                 history_item.error_message = str(e)
-            db.session.commit()
+            timings.commit(history_item, db.session)
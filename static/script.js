@@ -26,6 +26,7 @@ document.addEventListener('DOMContentLoaded', function () {
     const refineControls = document.getElementById('refine-controls');
     const refineInstruction = document.getElementById('refine-instruction');
     const refinePromptBtn = document.getElementById('refine-prompt-btn');
+    const freshSampleCheckbox = document.getElementById('fresh-sample');
     const themeToggle = document.getElementById('checkbox');
     const systemInstructionSelect = document.getElementById('system-instruction-select');
     const saveInstructionBtn = document.getElementById('save-instruction-btn');
@@ -105,6 +106,8 @@ document.addEventListener('DOMContentLoaded', function () {
     const recontextAspectRatio = document.getElementById('recontext-aspect-ratio');
     const recontextResolution = document.getElementById('recontext-resolution');
     const recontextSeed = document.getElementById('recontext-seed');
+    const recontextFanOut = document.getElementById('recontext-fan-out');
+    const recontextSeeds = document.getElementById('recontext-seeds');
     const runVeoEditBtn = document.getElementById('run-veo-edit-btn');
     const veoEditPrompt = document.getElementById('veo-edit-prompt');
     const veoEditVideoGcs = document.getElementById('veo-edit-video-gcs');
@@ -168,6 +171,7 @@ document.addEventListener('DOMContentLoaded', function () {
         let requestBody = {
             user_prompt: userPrompt,
             system_instructions: systemInstructions,
+            fresh: freshSampleCheckbox.checked,
         };
 
         if (imageFile) {
@@ -182,16 +186,55 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     });
 
+    // Posts to a prompt endpoint in streaming mode and calls onText with the text received so far
+    // as each server-sent event arrives. Resolves with the 'done' event's data.
+    async function streamPrompt(url, body, onText) {
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+            body: JSON.stringify({ ...body, stream: true }),
+        });
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let text = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let end;
+            while ((end = buffer.indexOf('\n\n')) !== -1) {
+                const message = buffer.slice(0, end);
+                buffer = buffer.slice(end + 2);
+                const event = (message.match(/^event: (.*)$/m) || [])[1];
+                const data = JSON.parse((message.match(/^data: (.*)$/m) || [])[1] || '{}');
+                if (event === 'chunk') {
+                    text += data.text;
+                    onText(text);
+                } else if (event === 'error') {
+                    throw new Error(data.error);
+                } else if (event === 'done') {
+                    return data;
+                }
+            }
+        }
+        throw new Error('Prompt stream ended early.');
+    }
+
     async function sendPromptRequest(body) {
         showLoading();
         try {
-            const response = await fetch('/generate-prompt', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(body),
+            let firstChunk = true;
+            const data = await streamPrompt('/generate-prompt', body, text => {
+                // The first text replaces the spinner; the rest is appended as it arrives.
+                if (firstChunk) {
+                    hideLoading();
+                    refineControls.style.display = 'block';
+                    firstChunk = false;
+                }
+                finalPromptTextarea.value = text;
             });
-            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-            const data = await response.json();
             finalPromptTextarea.value = data.final_prompt;
             refineControls.style.display = 'block';
         } catch (error) {
@@ -213,13 +256,11 @@ document.addEventListener('DOMContentLoaded', function () {
         }
         showLoading();
         try {
-            const response = await fetch('/refine-prompt', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ current_prompt: currentPrompt, refine_instruction: instruction }),
+            const body = { current_prompt: currentPrompt, refine_instruction: instruction, fresh: freshSampleCheckbox.checked };
+            const data = await streamPrompt('/refine-prompt', body, text => {
+                hideLoading();
+                finalPromptTextarea.value = text;
             });
-            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-            const data = await response.json();
             finalPromptTextarea.value = data.refined_prompt;
             refineInstruction.value = '';
         } catch (error) {
@@ -342,6 +383,22 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     // Fetch and display generation history
+    // History rows show small derivatives (WebP thumbnails, video posters and previews) when the
+    // server has made them, and load them only when shown. The full file stays one click away.
+    function historyImage(url, derivatives, alt, style) {
+        const thumbnail = (derivatives[url] || {}).thumbnail || url;
+        return `<a href="${url}" target="_blank"><img src="${thumbnail}" alt="${alt}" loading="lazy" decoding="async" style="${style}" onerror="this.onerror=null; this.src='${url}';"></a>`;
+    }
+
+    function historyVideo(url, derivatives) {
+        const { thumbnail, preview } = derivatives[url] || {};
+        const poster = thumbnail ? ` poster="${thumbnail}"` : '';
+        if (preview) {
+            return `<video muted loop playsinline preload="none" width="100%"${poster} onmouseenter="this.play()" onmouseleave="this.pause()"><source src="${preview}" type="video/mp4"></video><a href="${url}" class="btn btn-primary mt-2 me-2" target="_blank">Play Full Video</a>`;
+        }
+        return `<video controls preload="none" width="100%"${poster}><source src="${url}" type="video/mp4"></video>`;
+    }
+
     async function fetchGenerationHistory() {
         try {
             const response = await fetch('/get-generation-history');
@@ -352,25 +409,26 @@ document.addEventListener('DOMContentLoaded', function () {
                 historyItem.className = 'accordion-item';
                 const headerId = `header-${item.id}`;
                 const collapseId = `collapse-${item.id}`;
+                const derivatives = item.derivatives || {};
                 let bodyContent = `<p><strong>Status:</strong> ${item.status}</p>`;
                 let mediaHtml = '<div class="history-media">';
                 let hasMedia = false;
 
                 // Handle initial image for video generations
                 if (item.image_path && (item.operation_type !== 'vto' && item.operation_type !== 'recontext' && item.operation_type !== 'segmentation')) {
-                    mediaHtml += `<div class="history-item"><h6>Initial Image</h6><img src="${item.image_path}" alt="Initial image" style="max-width: 100%; border-radius: 5px;"></div>`;
+                    mediaHtml += `<div class="history-item"><h6>Initial Image</h6>${historyImage(item.image_path, derivatives, 'Initial image', 'max-width: 100%; border-radius: 5px;')}</div>`;
                     hasMedia = true;
                 }
 
                 // Handle generated video
                 if (item.status === 'completed' && item.video_path) {
-                    mediaHtml += `<div class="history-item"><h6>Generated Video</h6><video controls width="100%"><source src="${item.video_path}" type="video/mp4"></video><a href="${item.video_path}" class="btn btn-success mt-2" download>Download Video</a></div>`;
+                    mediaHtml += `<div class="history-item"><h6>Generated Video</h6>${historyVideo(item.video_path, derivatives)}<a href="${item.video_path}" class="btn btn-success mt-2" download>Download Video</a></div>`;
                     hasMedia = true;
                 }
 
                 // Handle generated image for VTO, recontext, etc.
                 if (item.status === 'completed' && item.image_path && (item.operation_type === 'vto' || item.operation_type === 'recontext' || item.operation_type === 'segmentation')) {
-                    mediaHtml += `<div class="history-item"><h6>Generated Image</h6><img src="${item.image_path}" alt="Generated image" style="max-width: 100%; border-radius: 5px;"><a href="${item.image_path}" class="btn btn-success mt-2" download>Download Image</a></div>`;
+                    mediaHtml += `<div class="history-item"><h6>Generated Image</h6>${historyImage(item.image_path, derivatives, 'Generated image', 'max-width: 100%; border-radius: 5px;')}<a href="${item.image_path}" class="btn btn-success mt-2" download>Download Image</a></div>`;
                     hasMedia = true;
                 }
                 
@@ -381,7 +439,7 @@ document.addEventListener('DOMContentLoaded', function () {
                         if (output.masks && output.masks.length > 0) {
                             mediaHtml += `<div class="history-item"><h6>Segmentation Masks</h6>`;
                             output.masks.forEach(maskUrl => {
-                                mediaHtml += `<img src="${maskUrl}" alt="Segmentation Mask" style="max-width: 30%; border-radius: 5px; margin: 5px;">`;
+                                mediaHtml += historyImage(maskUrl, derivatives, 'Segmentation Mask', 'max-width: 30%; border-radius: 5px; margin: 5px;');
                             });
                             mediaHtml += `</div>`;
                             hasMedia = true;
@@ -1180,6 +1238,13 @@ document.addEventListener('DOMContentLoaded', function () {
         formData.append('safety_setting', recontextSafetySetting.value);
         formData.append('person_generation', recontextPersonGeneration.value);
 
+        if (recontextFanOut.checked) {
+            formData.append('fan_out', 'true');
+            formData.append('seeds', recontextSeeds.value);
+            await runRecontextFanOut(formData);
+            return;
+        }
+
         showLoading();
         try {
             const response = await fetch('/product-recontext', {
@@ -1196,20 +1261,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 alert(`Error: ${data.error}`);
             } else {
                 recontextGeneratedImages.innerHTML = '';
-                data.predictions.forEach(imgStr => {
-                    const divElement = document.createElement('div');
-                    divElement.className = 'col-md-12';
-                    const imgElement = document.createElement('img');
-                    imgElement.src = `data:image/png;base64,${imgStr}`;
-                    imgElement.className = 'img-fluid';
-                    const buttonElement = document.createElement('button');
-                    buttonElement.className = 'btn btn-primary btn-sm mt-2';
-                    buttonElement.textContent = 'Use this Image for Video';
-                    buttonElement.onclick = () => sendImageToVideoTab(imgStr);
-                    divElement.appendChild(imgElement);
-                    divElement.appendChild(buttonElement);
-                    recontextGeneratedImages.appendChild(divElement);
-                });
+                data.predictions.forEach(imgStr => appendRecontextImage(imgStr));
             }
         } catch (error) {
             console.error('Error during Product Recontextualization:', error);
@@ -1219,6 +1271,68 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     });
 
+    function appendRecontextImage(imgStr) {
+        const divElement = document.createElement('div');
+        divElement.className = 'col-md-12';
+        const imgElement = document.createElement('img');
+        imgElement.src = `data:image/png;base64,${imgStr}`;
+        imgElement.className = 'img-fluid';
+        const buttonElement = document.createElement('button');
+        buttonElement.className = 'btn btn-primary btn-sm mt-2';
+        buttonElement.textContent = 'Use this Image for Video';
+        buttonElement.onclick = () => sendImageToVideoTab(imgStr);
+        divElement.appendChild(imgElement);
+        divElement.appendChild(buttonElement);
+        recontextGeneratedImages.appendChild(divElement);
+    }
+
+    // Reads newline-delimited JSON results from a fan-out request as they arrive
+    async function readNdjsonStream(response, onResult) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.filter(line => line.trim()).forEach(line => onResult(JSON.parse(line)));
+        }
+        if (buffer.trim()) onResult(JSON.parse(buffer));
+    }
+
+    async function runRecontextFanOut(formData) {
+        recontextGeneratedImages.innerHTML = '';
+        showLoading();
+        try {
+            const response = await fetch('/product-recontext', {
+                method: 'POST',
+                body: formData,
+            });
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            await readNdjsonStream(response, result => {
+                // Hide the overlay as soon as the first sample lands
+                hideLoading();
+                if (result.image) {
+                    appendRecontextImage(result.image);
+                } else if (result.error) {
+                    const errorElement = document.createElement('div');
+                    errorElement.className = 'col-md-12 text-danger';
+                    errorElement.textContent = `Sample ${result.sample} (seed ${result.seed}): ${result.error}`;
+                    recontextGeneratedImages.appendChild(errorElement);
+                }
+            });
+        } catch (error) {
+            console.error('Error during Product Recontextualization fan-out:', error);
+            alert('Failed to run Product Recontextualization. See console for details.');
+        } finally {
+            hideLoading();
+        }
+    }
+
     function sendImageToVideoTab(base64Image) {
         const byteCharacters = atob(base64Image);
         const byteNumbers = new Array(byteCharacters.length);
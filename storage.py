@@ -0,0 +1,358 @@
+import datetime
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+from flask import abort, current_app, send_file
+from werkzeug.security import safe_join
+
+import backends
+import metrics
+from extensions import db
+from ids import new_ulid
+from models import BatchItem, GenerationHistory, StoredFile
+from retry import default_policy
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.path.join('static', 'uploads')
+
+# Eviction frees space down to this fraction of STORAGE_MAX_BYTES, so it does
+# not run again on the very next save.
+LOW_WATERMARK = 0.9
+# Last-access times are kept in memory and written to the index at most this often.
+ACCESS_FLUSH_SECONDS = 30.0
+
+# Cache lifetime of content-addressed media: they are never rewritten.
+MEDIA_MAX_AGE = 365 * 24 * 3600
+_CONTENT_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+_accessed = {}
+_accessed_lock = threading.Lock()
+_last_flush = time.monotonic()
+_evict_lock = threading.Lock()
+
+
+def tracked_dirs():
+    return [UPLOAD_DIR, current_app.config['VIDEO_DIR']]
+
+
+def _key(path_or_url):
+    """Index key of a file: its path relative to the app root, e.g. 'static/uploads/x.png'."""
+    return path_or_url.replace(os.sep, '/').lstrip('/')
+
+
+def artifact_path(directory, digest, extension):
+    """
+    Content-addressed location of an artifact: <directory>/ab/cd/abcd...<extension>.
+    Two levels of hash-prefix shards keep each directory to a few thousand entries.
+    """
+    return os.path.join(directory, digest[:2], digest[2:4], f"{digest}{extension}")
+
+
+def _temp_path(path):
+    return f"{path}.{new_ulid()}.tmp"
+
+
+def save(directory, data, extension, derive=True):
+    """
+    Stores `data` under `directory` by its SHA-256 and returns its URL path
+    ('/static/...'). Identical outputs share one file. The file is written to
+    a temporary name and renamed into place, so a partial write is never served.
+    """
+    path = artifact_path(directory, hashlib.sha256(data).hexdigest(), extension)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = _temp_path(path)
+        try:
+            with open(partial, 'wb') as f:
+                f.write(data)
+            os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+    return register(path, derive)
+
+
+def save_file(directory, source, extension, derive=True):
+    """
+    Like save(), for a file already written to `source` (e.g. a download).
+    `source` must be on the same filesystem; it is moved into place or, if the
+    content is already stored, deleted.
+    """
+    digest = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    path = artifact_path(directory, digest.hexdigest(), extension)
+    if os.path.exists(path):
+        os.remove(source)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source, path)
+    return register(path, derive)
+
+
+def register(path, derive=True):
+    """
+    Indexes a file already written under a tracked directory and returns its
+    URL path. With `derive`, its thumbnail and preview are made in the background.
+    """
+    import derivatives  # derivatives saves through this module
+
+    key = _key(path)
+    now = datetime.datetime.utcnow()
+    record = StoredFile.query.filter_by(path=key).one_or_none()
+    if record is None:
+        record = StoredFile(path=key, created_at=now)
+        db.session.add(record)
+    record.size = os.path.getsize(path)
+    record.is_local = True
+    record.last_access = now
+    record.evicted_at = None
+    db.session.commit()
+    maybe_evict()
+    if derive:
+        derivatives.schedule(key)
+    return f"/{key}"
+
+
+def touch(path):
+    """Records an access for LRU ordering; cheap enough to call on every request."""
+    with _accessed_lock:
+        _accessed[_key(path)] = datetime.datetime.utcnow()
+        due = time.monotonic() - _last_flush >= ACCESS_FLUSH_SECONDS
+    if due:
+        flush_access_times()
+
+
+def flush_access_times():
+    global _last_flush
+    with _accessed_lock:
+        pending = dict(_accessed)
+        _accessed.clear()
+        _last_flush = time.monotonic()
+    for key, accessed_at in pending.items():
+        StoredFile.query.filter(StoredFile.path == key, StoredFile.last_access < accessed_at) \
+            .update({'last_access': accessed_at}, synchronize_session=False)
+    if pending:
+        db.session.commit()
+
+
+def ensure_local(path_or_url):
+    """
+    Returns the local path of an indexed file, downloading it back from GCS
+    first if it was evicted. Returns None if there is no copy anywhere.
+    """
+    key = _key(path_or_url)
+    if os.path.exists(key):
+        touch(key)
+        return key
+    record = StoredFile.query.filter_by(path=key).one_or_none()
+    if record is None or not record.gcs_uri:
+        return None
+    bucket_name, _, blob_name = record.gcs_uri[len('gs://'):].partition('/')
+    partial = f"{key}.part"
+    try:
+        os.makedirs(os.path.dirname(key), exist_ok=True)
+        blob = backends.storage_client(current_app.config['PROJECT_ID']).bucket(bucket_name).blob(blob_name)
+        with metrics.track_gcs('download') as transfer:
+            default_policy.call(blob.download_to_filename, partial)
+            transfer.bytes = os.path.getsize(partial)
+        os.replace(partial, key)
+    except Exception as e:
+        logger.error("Could not restore %s from %s: %s", key, record.gcs_uri, e)
+        if os.path.exists(partial):
+            os.remove(partial)
+        return None
+    record.is_local = True
+    record.evicted_at = None
+    record.last_access = datetime.datetime.utcnow()
+    db.session.commit()
+    metrics.storage_events.labels(event='restored').inc()
+    maybe_evict()
+    return key
+
+
+def send_media(directory, filename):
+    """
+    Serves a stored file, restoring it from GCS first if it was evicted.
+
+    Responses are conditional: Range requests get 206 partial content, so
+    <video> elements can seek, and If-None-Match gets 304. The body is sent
+    with the server's wsgi.file_wrapper (sendfile under gunicorn), or by the
+    proxy with USE_X_SENDFILE. Content-addressed files never change, so their
+    hash is a strong ETag and they may be cached for a year without revalidation.
+    """
+    path = safe_join(directory, filename)
+    local_path = ensure_local(path) if path else None
+    if local_path is None:
+        abort(404)
+    digest = os.path.splitext(os.path.basename(local_path))[0]
+    if not _CONTENT_HASH.match(digest):
+        # Files written before the content-addressed store get the default ETag and max age.
+        return send_file(os.path.abspath(local_path), conditional=True)
+    response = send_file(os.path.abspath(local_path), conditional=True, etag=digest, max_age=MEDIA_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def local_bytes():
+    return db.session.query(db.func.coalesce(db.func.sum(StoredFile.size), 0)).filter(StoredFile.is_local.is_(True)).scalar()
+
+
+def maybe_evict():
+    """Starts a background eviction when local files exceed STORAGE_MAX_BYTES (0 means no limit)."""
+    budget = current_app.config['STORAGE_MAX_BYTES']
+    total = local_bytes()
+    metrics.local_storage_bytes.labels().set(total)
+    if budget and total > budget and _evict_lock.acquire(blocking=False):
+        app = current_app._get_current_object()
+        threading.Thread(target=_evict_in_background, args=(app,), daemon=True).start()
+
+
+def _evict_in_background(app):
+    try:
+        with app.app_context():
+            evict(int(app.config['STORAGE_MAX_BYTES'] * LOW_WATERMARK))
+    except Exception as e:
+        logger.exception("Storage eviction failed: %s", e)
+    finally:
+        _evict_lock.release()
+
+
+def _upload(key):
+    config = current_app.config
+    blob_name = f"{config['STORAGE_GCS_PREFIX']}{key}"
+    try:
+        blob = backends.storage_client(config['PROJECT_ID']).bucket(config['GCS_BUCKET_NAME']).blob(blob_name)
+        with metrics.track_gcs('upload', os.path.getsize(key)):
+            default_policy.call(blob.upload_from_filename, key)
+        return f"gs://{config['GCS_BUCKET_NAME']}/{blob_name}"
+    except Exception as e:
+        logger.error("Could not copy %s to GCS before evicting it: %s", key, e)
+        return None
+
+
+def evict(target_bytes):
+    """
+    Removes the least recently used local files until at most `target_bytes`
+    remain. With STORAGE_GCS_FALLBACK, each file is first copied to GCS (once)
+    and stays indexed so ensure_local() can fetch it back; a file that cannot
+    be copied is kept. Without it, evicted files are gone for good.
+    Returns the evicted paths.
+    """
+    flush_access_times()
+    fallback = current_app.config['STORAGE_GCS_FALLBACK']
+    total = local_bytes()
+    evicted = []
+    skipped = set()
+    while total > target_bytes:
+        batch = StoredFile.query.filter(StoredFile.is_local.is_(True), StoredFile.id.notin_(skipped)) \
+            .order_by(StoredFile.last_access, StoredFile.id).limit(100).all()
+        if not batch:
+            break
+        for record in batch:
+            if total <= target_bytes:
+                break
+            if fallback and not record.gcs_uri:
+                record.gcs_uri = _upload(record.path)
+                if not record.gcs_uri:
+                    skipped.add(record.id)
+                    continue
+            try:
+                os.remove(record.path)
+            except FileNotFoundError:
+                pass
+            total -= record.size
+            evicted.append(record.path)
+            if fallback:
+                record.is_local = False
+                record.evicted_at = datetime.datetime.utcnow()
+            else:
+                db.session.delete(record)
+            db.session.commit()
+            metrics.storage_events.labels(event='evicted').inc()
+    metrics.local_storage_bytes.labels().set(local_bytes())
+    if evicted:
+        logger.info("Evicted %d files from local storage; %d bytes remain.", len(evicted), total)
+    return evicted
+
+
+def _referenced_paths(dirs):
+    """Paths under the tracked directories mentioned by any history row or batch item."""
+    pattern = re.compile('(?:' + '|'.join(re.escape(_key(d)) + '/' for d in dirs) + r')[^\s"\'\\,;)]+')
+    referenced = set()
+    columns = [
+        (GenerationHistory.image_path, GenerationHistory.video_path, GenerationHistory.input_payload, GenerationHistory.output_payload),
+        (BatchItem.output_payload,),
+    ]
+    for cols in columns:
+        for row in db.session.query(*cols).yield_per(500):
+            for value in row:
+                if value:
+                    referenced.update(pattern.findall(value))
+    return referenced
+
+
+def reconcile(grace_seconds, delete_orphans=False):
+    """
+    Startup cleanup of the tracked directories.
+
+    Index rows whose file has disappeared are dropped, or marked evicted if
+    there is a GCS copy. Files missing from the index are adopted if a history
+    row or batch item refers to them (e.g. files written before the index
+    existed). Otherwise they are orphans, such as temp uploads left by a crash.
+    Orphans older than `grace_seconds` are logged, and deleted only with
+    `delete_orphans`, since a deployment may keep its own files there too. The
+    grace period keeps files that another process has just written and not
+    yet registered.
+    """
+    now = datetime.datetime.utcnow()
+    counts = {'adopted': 0, 'orphaned': 0, 'deleted': 0, 'dropped': 0}
+    orphans = []
+    for record in StoredFile.query.filter(StoredFile.is_local.is_(True)).all():
+        if not os.path.exists(record.path):
+            if record.gcs_uri:
+                record.is_local = False
+                record.evicted_at = now
+            else:
+                db.session.delete(record)
+            counts['dropped'] += 1
+    db.session.commit()
+
+    dirs = tracked_dirs()
+    indexed = {path for (path,) in db.session.query(StoredFile.path)}
+    referenced = _referenced_paths(dirs)
+    cutoff = time.time() - grace_seconds
+    for directory in dirs:
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                key = _key(path)
+                if key in indexed:
+                    continue
+                if key in referenced:
+                    db.session.add(StoredFile(path=key, size=os.path.getsize(path),
+                                              last_access=datetime.datetime.utcfromtimestamp(os.path.getmtime(path))))
+                    counts['adopted'] += 1
+                elif os.path.getmtime(path) < cutoff:
+                    counts['orphaned'] += 1
+                    if delete_orphans:
+                        os.remove(path)
+                        counts['deleted'] += 1
+                    else:
+                        orphans.append(key)
+    db.session.commit()
+    metrics.local_storage_bytes.labels().set(local_bytes())
+    logger.info("Storage reconciled: %(adopted)d files adopted, %(orphaned)d orphans found, %(deleted)d orphans deleted, "
+                "%(dropped)d missing files dropped.", counts)
+    if orphans:
+        logger.info("Kept %d unreferenced files (set STORAGE_DELETE_ORPHANS=true to delete them), e.g. %s",
+                    len(orphans), ', '.join(orphans[:10]))
+    return counts
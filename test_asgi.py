@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from flask import Flask, Response, jsonify, request
+
+import asgi
+
+
+def http_scope(method, path, query_string=b'', headers=()):
+    return {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+        'root_path': '', 'query_string': query_string, 'headers': list(headers),
+        'server': ('testserver', 8080), 'client': ('127.0.0.1', 50000),
+    }
+
+
+async def call(app, scope, body_chunks=(b'',)):
+    """Drives one ASGI request and returns (status, headers, list of body messages)."""
+    incoming = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(body_chunks) - 1}
+                for i, chunk in enumerate(body_chunks)]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    return start['status'], dict(start['headers']), [m for m in sent[1:] if m['type'] == 'http.response.body']
+
+
+class TestThreadOffloadASGI(unittest.TestCase):
+
+    def setUp(self):
+        flask_app = Flask(__name__)
+
+        @flask_app.route('/echo')
+        def echo():
+            return jsonify({'q': request.args.get('q'), 'host': request.host})
+
+        @flask_app.route('/upload', methods=['POST'])
+        def upload():
+            return jsonify({'name': request.form['name'], 'size': len(request.files['file'].read())})
+
+        @flask_app.route('/stream')
+        def stream():
+            return Response((f"chunk{i}\n" for i in range(3)), mimetype='text/plain')
+
+        @flask_app.route('/slow')
+        def slow():
+            time.sleep(0.3)
+            return jsonify({'thread': threading.current_thread().name})
+
+        @flask_app.route('/boom')
+        def boom():
+            raise RuntimeError('boom')
+
+        flask_app.config['PROPAGATE_EXCEPTIONS'] = True
+        self.app = asgi.ThreadOffloadASGI(flask_app, max_threads=8)
+        self.addCleanup(lambda: self.app._executor and self.app._executor.shutdown())
+
+    def test_get_with_query_string(self):
+        status, headers, body = asyncio.run(call(self.app, http_scope('GET', '/echo', b'q=a%20lion', [(b'host', b'example.com')])))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/json')
+        payload = b''.join(m['body'] for m in body)
+        self.assertIn(b'"q":"a lion"', payload)
+        self.assertIn(b'example.com', payload)
+
+    def test_multipart_upload_in_several_body_messages(self):
+        boundary = b'xyz'
+        payload = (b'--xyz\r\nContent-Disposition: form-data; name="name"\r\n\r\nshirt\r\n'
+                   b'--xyz\r\nContent-Disposition: form-data; name="file"; filename="a.png"\r\n'
+                   b'Content-Type: image/png\r\n\r\n' + b'\x89' * 3000 + b'\r\n--xyz--\r\n')
+        headers = [(b'content-type', b'multipart/form-data; boundary=' + boundary), (b'content-length', str(len(payload)).encode())]
+        chunks = [payload[i:i + 1000] for i in range(0, len(payload), 1000)]
+        status, _, body = asyncio.run(call(self.app, http_scope('POST', '/upload', headers=headers), chunks))
+        self.assertEqual(status, 200)
+        self.assertIn(b'"size":3000', b''.join(m['body'] for m in body))
+
+    def test_streamed_response_is_sent_chunk_by_chunk(self):
+        _, _, body = asyncio.run(call(self.app, http_scope('GET', '/stream')))
+        self.assertEqual([m['body'] for m in body], [b'chunk0\n', b'chunk1\n', b'chunk2\n', b''])
+        self.assertEqual([m['more_body'] for m in body], [True, True, True, False])
+
+    def test_blocking_handlers_run_concurrently_off_the_loop(self):
+        async def many():
+            return await asyncio.gather(*(call(self.app, http_scope('GET', '/slow')) for _ in range(6)))
+
+        start = time.perf_counter()
+        results = asyncio.run(many())
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertTrue(all(status == 200 for status, _, _ in results))
+
+    def test_requests_cancelled_while_queued_leave_the_queue(self):
+        self.app.max_threads = 1
+        waiting = self.app._waiting.value
+
+        async def cancel_queued():
+            busy = asyncio.ensure_future(call(self.app, http_scope('GET', '/slow')))
+            await asyncio.sleep(0.05)
+            queued = asyncio.ensure_future(call(self.app, http_scope('GET', '/echo')))
+            await asyncio.sleep(0.05)
+            self.assertEqual(self.app._waiting.value, waiting + 1)
+            queued.cancel()
+            await asyncio.gather(busy, queued, return_exceptions=True)
+
+        asyncio.run(cancel_queued())
+        self.assertEqual(self.app._waiting.value, waiting)
+
+    def test_unhandled_exception_becomes_500(self):
+        with self.assertLogs('asgi', level='ERROR'):
+            status, _, body = asyncio.run(call(self.app, http_scope('GET', '/boom')))
+        self.assertEqual(status, 500)
+        self.assertFalse(body[-1]['more_body'])
+
+    def test_lifespan_startup_and_shutdown(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(self.app({'type': 'lifespan'}, receive, send))
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+
+if __name__ == '__main__':
+    unittest.main()
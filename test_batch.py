@@ -0,0 +1,134 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+from batch import BatchRunner, claim_job, parse_manifest
+from config import Config
+from extensions import db
+from models import BatchItem, BatchJob
+
+
+class TestBatchManifest(unittest.TestCase):
+
+    def test_parse_jsonl_vto_manifest(self):
+        content = "\n".join([
+            json.dumps({'person_image_uri': 'gs://b/p.png', 'product_image_uri': 'gs://b/q.png', 'seed': '7'}),
+            "",
+            json.dumps({'person_image_uri': 'gs://b/p.png', 'product_image_uri': 'gs://b/r.png', 'prompt': 'studio'}),
+        ])
+        items, errors = parse_manifest('catalog.jsonl', content.encode(), 'vto')
+        self.assertEqual(errors, [])
+        self.assertEqual(len(items), 2)
+        self.assertEqual(items[0]['seed'], 7)
+        self.assertEqual(items[1]['prompt'], 'studio')
+
+    def test_parse_csv_recontext_manifest(self):
+        content = "image_uris,prompt,sample_count,disable_prompt_enhancement\ngs://b/1.png|gs://b/2.png,on a beach,2,true\n"
+        items, errors = parse_manifest('catalog.csv', content, 'recontext')
+        self.assertEqual(errors, [])
+        self.assertEqual(items[0]['image_uris'], ['gs://b/1.png', 'gs://b/2.png'])
+        self.assertEqual(items[0]['sample_count'], 2)
+        self.assertIs(items[0]['disable_prompt_enhancement'], True)
+
+    def test_invalid_rows_are_reported_by_line(self):
+        content = "\n".join([
+            json.dumps({'person_image_uri': 'gs://b/p.png'}),
+            "{not json",
+            json.dumps({'person_image_uri': 'gs://b/p.png', 'product_image_uri': 'gs://b/q.png', 'seed': 'x'}),
+        ])
+        items, errors = parse_manifest('catalog.jsonl', content, 'vto')
+        self.assertEqual(items, [])
+        self.assertEqual([e.split(':')[0] for e in errors], ['line 1', 'line 2', 'line 3'])
+
+    def test_unknown_job_type(self):
+        items, errors = parse_manifest('catalog.jsonl', '{}', 'segmentation')
+        self.assertEqual(items, [])
+        self.assertEqual(len(errors), 1)
+
+
+class TestBatchRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.from_object(Config)
+        path = os.path.join(tempfile.mkdtemp(), 'history.db')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def add_job(self, status, item_statuses, lease_owner=None, lease_minutes=0):
+        expires = datetime.datetime.utcnow() + datetime.timedelta(minutes=lease_minutes) if lease_owner else None
+        db.session.add(BatchJob(job_id='batch_1', job_type='vto', status=status, total_items=len(item_statuses),
+                                lease_owner=lease_owner, lease_expires_at=expires))
+        for index, item_status in enumerate(item_statuses):
+            db.session.add(BatchItem(job_id='batch_1', item_index=index, status=item_status, input_payload='{}',
+                                     lease_expires_at=expires if item_status == 'running' else None))
+        db.session.commit()
+
+    def statuses(self):
+        db.session.expire_all()
+        return [item.status for item in BatchItem.query.order_by(BatchItem.item_index)]
+
+    def test_only_one_process_claims_a_job(self):
+        self.add_job('queued', ['pending'])
+        self.assertTrue(claim_job('batch_1', 'a', lease_seconds=60))
+        self.assertFalse(claim_job('batch_1', 'b', lease_seconds=60))
+
+    def test_jobs_leased_by_a_live_process_are_not_resumed(self):
+        self.add_job('running', ['completed', 'running', 'pending'], lease_owner='other', lease_minutes=1)
+        runner = BatchRunner(self.app, service=None, worker_id='here')
+        with patch.object(runner, '_execute') as execute, patch.object(runner, 'start'):
+            self.assertEqual(runner.resume_interrupted(), [])
+            runner._run('batch_1')
+        execute.assert_not_called()
+        self.assertEqual(self.statuses(), ['completed', 'running', 'pending'])
+
+    def test_jobs_whose_lease_expired_are_resumed(self):
+        self.add_job('running', ['completed', 'running', 'pending'], lease_owner='dead', lease_minutes=-1)
+        runner = BatchRunner(self.app, service=None, worker_id='here')
+        with patch.object(runner, '_execute', return_value=['/static/uploads/a.png']) as execute, \
+                patch.object(runner, 'start'):
+            self.assertEqual(runner.resume_interrupted(), ['batch_1'])
+            runner._run('batch_1')
+        self.assertEqual(execute.call_count, 2)
+        self.assertEqual(self.statuses(), ['completed', 'completed', 'completed'])
+        job = BatchJob.query.one()
+        self.assertEqual((job.status, job.lease_owner), ('completed', None))
+
+    def test_final_status_tells_partial_and_total_failures_apart(self):
+        self.add_job('queued', ['pending', 'pending'])
+        runner = BatchRunner(self.app, service=None, worker_id='here')
+        outcomes = iter([['/static/uploads/a.png'], RuntimeError('filtered')])
+        with patch.object(runner, '_execute', side_effect=lambda *args: _next_outcome(outcomes)), \
+                self.assertLogs('batch', level='WARNING'):
+            runner._run('batch_1')
+        self.assertEqual(BatchJob.query.one().status, 'completed_with_errors')
+
+        BatchItem.query.update({'status': 'pending'})
+        db.session.commit()
+        with patch.object(runner, '_execute', side_effect=RuntimeError('quota')), self.assertLogs('batch', level='WARNING'):
+            runner._run('batch_1')
+        db.session.expire_all()
+        self.assertEqual(BatchJob.query.one().status, 'failed')
+
+
+def _next_outcome(outcomes):
+    outcome = next(outcomes)
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
+
+
+if __name__ == '__main__':
+    unittest.main()
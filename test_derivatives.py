@@ -0,0 +1,98 @@
+import io
+import os
+import tempfile
+import unittest
+
+from flask import Flask
+from PIL import Image
+
+import derivatives
+import storage
+from config import Config
+from extensions import db
+from models import StoredFile
+
+
+def png(width, height):
+    buf = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 40, 40)).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def mp4(path, seconds, width=640, height=360, rate=24):
+    with derivatives.av.open(path, 'w') as output:
+        stream = output.add_stream('libx264', rate=rate)
+        stream.width, stream.height, stream.pix_fmt = width, height, 'yuv420p'
+        for i in range(seconds * rate):
+            frame = derivatives.av.VideoFrame.from_image(Image.new('RGB', (width, height), (i % 255, 90, 30)))
+            output.mux(stream.encode(frame))
+        output.mux(stream.encode(None))
+
+
+class TestDerivatives(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        self.addCleanup(os.chdir, cwd)
+        os.makedirs(storage.UPLOAD_DIR)
+        os.makedirs(Config.VIDEO_DIR)
+
+        self.app = Flask(__name__)
+        self.app.config.from_object(Config)
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(self.root, 'history.db')}",
+            STORAGE_MAX_BYTES=0, DERIVATIVES_ENABLED=True, THUMBNAIL_MAX_PX=64,
+        )
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def record(self, url):
+        db.session.expire_all()
+        return StoredFile.query.filter_by(path=url.lstrip('/')).one()
+
+    def test_images_get_a_webp_thumbnail_in_the_background(self):
+        url = storage.save(storage.UPLOAD_DIR, png(800, 400), '.png', derive=False)
+        derivatives.schedule(url.lstrip('/')).result(10)
+
+        record = self.record(url)
+        self.assertTrue(record.thumbnail_path.endswith('.webp'))
+        self.assertIsNone(record.preview_path)
+        with Image.open(record.thumbnail_path.lstrip('/')) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('WEBP', (64, 32)))
+        # Derivatives are stored like any artifact, but get no derivatives of their own.
+        self.assertIsNone(self.record(record.thumbnail_path).thumbnail_path)
+        self.assertEqual(derivatives.for_paths([url, '/static/uploads/other.png', None]),
+                         {url: {'thumbnail': record.thumbnail_path, 'preview': None}})
+
+    def test_disabled_or_unsupported_files_are_skipped(self):
+        self.assertIsNone(derivatives.schedule('static/uploads/notes.txt'))
+        self.app.config['DERIVATIVES_ENABLED'] = False
+        self.assertIsNone(derivatives.schedule('static/uploads/a.png'))
+
+    @unittest.skipIf(derivatives.av is None, "PyAV is not installed")
+    def test_videos_get_a_poster_and_a_short_preview(self):
+        mp4('source.mp4', seconds=5)
+        with open('source.mp4', 'rb') as f:
+            url = storage.save(Config.VIDEO_DIR, f.read(), '.mp4', derive=False)
+        derivatives.create(url.lstrip('/'))
+
+        record = self.record(url)
+        with Image.open(record.thumbnail_path.lstrip('/')) as poster:
+            self.assertEqual(poster.size, (64, 36))
+        with derivatives.av.open(record.preview_path.lstrip('/')) as preview:
+            stream = preview.streams.video[0]
+            self.assertEqual((stream.width, stream.height), (128, 72))
+            self.assertLessEqual(preview.duration / 1e6, derivatives.PREVIEW_SECONDS)
+        self.assertLess(os.path.getsize(record.preview_path.lstrip('/')), os.path.getsize(url.lstrip('/')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import base64
+import json
+import unittest
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+
+from google.cloud import storage
+
+import backends
+import fake_backend
+from config import Config
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+class TestFakeBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.server, self.url = fake_backend.start_in_thread(
+            port=0, latency=0, latency_jitter=0, gcs_latency=0, lro_seconds=0, image_size=32, video_bytes=1024,
+        )
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.model_url = f"{self.url}/v1/projects/p/locations/us-central1/publishers/google/models"
+
+    def test_predict_returns_one_image_per_sample(self):
+        body = post(f"{self.model_url}/imagen-4.0-generate-001:predict", {'instances': [{'prompt': 'x'}], 'parameters': {'sampleCount': 3}})
+        self.assertEqual(len(body['predictions']), 3)
+        self.assertTrue(base64.b64decode(body['predictions'][0]['bytesBase64Encoded']).startswith(b'\x89PNG'))
+
+    def test_segmentation_returns_labelled_masks(self):
+        body = post(f"{self.model_url}/image-segmentation-001:predict", {'instances': [{}]})
+        self.assertEqual(body['predictions'][0]['labels'][0]['label'], 'foreground')
+
+    def test_long_running_operation_writes_videos_to_fake_gcs(self):
+        operation = post(f"{self.model_url}/veo-2.0-generate-001:predictLongRunning", {
+            'instances': [{'prompt': 'x'}], 'parameters': {'sampleCount': 2, 'storageUri': 'gs://bucket/out/'},
+        })
+        result = post(f"{self.model_url}/veo-2.0-generate-001:fetchPredictOperation", {'operationName': operation['name']})
+        self.assertTrue(result['done'])
+        uris = [video['gcsUri'] for video in result['response']['videos']]
+        self.assertEqual(len(uris), 2)
+
+        object_name = uris[0][len('gs://bucket/'):]
+        with urllib.request.urlopen(f"{self.url}/download/storage/v1/b/bucket/o/{urllib.request.quote(object_name, safe='')}?alt=media") as response:
+            self.assertEqual(len(response.read()), 1024)
+
+    def test_operation_stays_pending_until_lro_seconds_elapse(self):
+        post(f"{self.url}/_fake/config", {'lro_seconds': 60})
+        operation = post(f"{self.model_url}/veo-2.0-generate-001:predictLongRunning", {'instances': [{}]})
+        result = post(f"{self.model_url}/veo-2.0-generate-001:fetchPredictOperation", {'operationName': operation['name']})
+        self.assertFalse(result['done'])
+
+    def test_injected_failures_use_configured_status(self):
+        post(f"{self.url}/_fake/config", {'failure_rate': 1.0, 'failure_status': 429})
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            post(f"{self.model_url}/gemini-2.5-flash:generateContent", {'contents': []})
+        self.assertEqual(ctx.exception.code, 429)
+
+        with urllib.request.urlopen(f"{self.url}/_fake/stats") as response:
+            stats = json.load(response)
+        self.assertEqual(stats['requests']['injected_failure'], 1)
+
+    def test_unknown_config_key_is_rejected(self):
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            post(f"{self.url}/_fake/config", {'latncy': 1})
+        self.assertEqual(ctx.exception.code, 400)
+
+    def test_storage_client_round_trip(self):
+        with patch.object(Config, 'GCS_API_ENDPOINT', self.url):
+            bucket = backends.storage_client('p').bucket('bucket')
+            bucket.blob('small.txt').upload_from_string(b'hello', content_type='text/plain')
+            big = bucket.blob('big.bin', chunk_size=256 * 1024)
+            big.upload_from_string(b'x' * (600 * 1024))
+
+            self.assertEqual(bucket.blob('small.txt').download_as_bytes(), b'hello')
+            self.assertEqual(len(bucket.blob('big.bin').download_as_bytes()), 600 * 1024)
+            self.assertIsInstance(backends.storage_client('p'), storage.Client)
+
+    def test_genai_streams_gemini_answers_in_chunks(self):
+        post(f"{self.url}/_fake/config", {'text_chars': 120, 'stream_chunks': 3, 'stream_chunk_interval': 0})
+        with patch.object(Config, 'VERTEX_API_ENDPOINT', self.url):
+            client = backends.genai_client('p', 'us-central1')
+            chunks = [chunk.text for chunk in client.models.generate_content_stream(model='gemini-2.5-flash', contents='a cat')]
+            whole = client.models.generate_content(model='gemini-2.5-flash', contents='a cat').text
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunks), whole)
+
+    def test_raw_rest_calls_use_emulator_endpoint_and_token(self):
+        with patch.object(Config, 'VERTEX_API_ENDPOINT', self.url + '/'):
+            self.assertEqual(backends.vertex_base_url('us-central1'), self.url)
+            self.assertEqual(backends.access_token(), backends.EMULATOR_TOKEN)
+        with patch.object(Config, 'VERTEX_API_ENDPOINT', None):
+            self.assertEqual(backends.vertex_base_url('us-central1'), 'https://us-central1-aiplatform.googleapis.com')
+
+
+if __name__ == '__main__':
+    unittest.main()
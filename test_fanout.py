@@ -0,0 +1,80 @@
+import threading
+import unittest
+from types import SimpleNamespace
+
+from fanout import plan_fan_out, fan_out, parse_seeds, run_each
+
+
+class TestFanOut(unittest.TestCase):
+
+    def test_plan_splits_large_sample_counts(self):
+        chunks = plan_fan_out(10, max_samples_per_call=4)
+        self.assertEqual([c['sample_count'] for c in chunks], [4, 4, 2])
+        self.assertEqual([c['first_sample'] for c in chunks], [0, 4, 8])
+        self.assertTrue(all(c['seed'] is None for c in chunks))
+
+    def test_plan_offsets_seeds_for_follow_up_calls(self):
+        chunks = plan_fan_out(6, seeds=[42, 100], max_samples_per_call=4)
+        self.assertEqual([c['seed'] for c in chunks], [42, 43, 100, 101])
+        self.assertEqual(sum(c['sample_count'] for c in chunks), 12)
+
+    def test_fan_out_reports_partial_failures_per_sample(self):
+        def call(sample_count, seed):
+            if seed == 43:
+                raise RuntimeError("429 Quota exceeded")
+            return SimpleNamespace(predictions=[{'bytesBase64Encoded': f"{seed}-{i}"} for i in range(sample_count)])
+
+        results = list(fan_out(call, plan_fan_out(6, seeds=[42], max_samples_per_call=4)))
+        self.assertEqual(sorted(r['sample'] for r in results), list(range(6)))
+        failed = [r for r in results if 'error' in r]
+        self.assertEqual(len(failed), 2)
+        self.assertTrue(all(r['seed'] == 43 for r in failed))
+        self.assertEqual(len([r for r in results if 'prediction' in r]), 4)
+
+    def test_fan_out_runs_calls_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def call(sample_count, seed):
+            barrier.wait()
+            return SimpleNamespace(predictions=[{}] * sample_count)
+
+        results = list(fan_out(call, plan_fan_out(3, max_samples_per_call=1), max_workers=3))
+        self.assertEqual(len(results), 3)
+        self.assertFalse(any('error' in r for r in results))
+
+    def test_run_each_yields_results_as_they_finish_with_per_item_errors(self):
+        barrier = threading.Barrier(3, timeout=5)
+        release_slow = threading.Event()
+
+        def call(item):
+            if item == 'slow':
+                release_slow.wait(5)
+            else:
+                barrier.wait()
+            if item == 'bad':
+                raise ValueError(item)
+            return item.upper()
+
+        results = run_each(call, ['slow', 'ok', 'bad', 'ok2'], max_workers=4)
+        first = [next(results) for _ in range(2)]
+        release_slow.set()
+        rest = list(results)
+        barrier.abort()
+
+        self.assertNotIn(0, [index for index, _, _ in first])
+        by_index = {index: (result, error) for index, result, error in first + rest}
+        self.assertEqual(sorted(by_index), [0, 1, 2, 3])
+        self.assertEqual(by_index[0], ('SLOW', None))
+        self.assertEqual(by_index[1], ('OK', None))
+        self.assertIsInstance(by_index[2][1], ValueError)
+
+    def test_parse_seeds(self):
+        self.assertIsNone(parse_seeds(''))
+        self.assertEqual(parse_seeds('1, 2,3'), [1, 2, 3])
+        self.assertEqual(parse_seeds('0'), [0])
+        with self.assertRaises(ValueError):
+            parse_seeds('a,b')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from flask import Flask
+
+import idempotency
+from extensions import db
+from models import GenerationHistory
+
+
+class TestIdempotency(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_fingerprint_ignores_field_order(self):
+        a = idempotency.request_fingerprint('generate-video', prompt='cat', seed=1, model='veo')
+        b = idempotency.request_fingerprint('generate-video', model='veo', seed=1, prompt='cat')
+        c = idempotency.request_fingerprint('generate-video', model='veo', seed=2, prompt='cat')
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, c)
+
+    def test_key_replays_stored_response(self):
+        self.assertIsNone(idempotency.begin('key-1', 'generate-videos', 'hash-a', ttl_hours=24))
+        idempotency.complete('key-1', {'operation_ids': ['op_1']})
+        self.assertEqual(idempotency.begin('key-1', 'generate-videos', 'hash-a', ttl_hours=24), {'operation_ids': ['op_1']})
+
+    def test_key_reused_for_different_request_is_rejected(self):
+        idempotency.begin('key-1', 'generate-videos', 'hash-a', ttl_hours=24)
+        idempotency.complete('key-1', {'operation_ids': ['op_1']})
+        body, status = idempotency.begin('key-1', 'generate-videos', 'hash-b', ttl_hours=24)
+        self.assertEqual(status, 422)
+
+    def test_key_in_progress_returns_conflict(self):
+        idempotency.begin('key-1', 'generate-videos', 'hash-a', ttl_hours=24)
+        body, status = idempotency.begin('key-1', 'generate-videos', 'hash-a', ttl_hours=24, wait_seconds=0.2)
+        self.assertEqual(status, 409)
+
+    def test_released_key_can_be_claimed_again(self):
+        idempotency.begin('key-1', 'generate-videos', 'hash-a', ttl_hours=24)
+        idempotency.release('key-1')
+        self.assertIsNone(idempotency.begin('key-1', 'generate-videos', 'hash-a', ttl_hours=24))
+
+    def test_find_inflight_only_matches_unfinished_rows(self):
+        db.session.add(GenerationHistory(operation_id='op_1', prompt='cat', status='completed', request_fingerprint='f'))
+        db.session.add(GenerationHistory(operation_id='op_2', prompt='cat', status='running', request_fingerprint='f'))
+        db.session.commit()
+        self.assertEqual(idempotency.find_inflight('f').operation_id, 'op_2')
+        self.assertIsNone(idempotency.find_inflight('other'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+from ids import CROCKFORD32, new_operation_id, new_ulid
+
+class TestIds(unittest.TestCase):
+
+    def test_ulid_shape(self):
+        ulid = new_ulid()
+        self.assertEqual(len(ulid), 26)
+        self.assertTrue(all(char in CROCKFORD32 for char in ulid))
+
+    def test_ids_are_strictly_increasing_within_a_millisecond(self):
+        with patch('ids.time.time', return_value=1700000000.0):
+            batch = [new_ulid() for _ in range(1000)]
+        self.assertEqual(batch, sorted(batch))
+        self.assertEqual(len(set(batch)), len(batch))
+
+    def test_clock_going_backwards_keeps_order(self):
+        with patch('ids.time.time', return_value=1700000001.0):
+            first = new_ulid()
+        with patch('ids.time.time', return_value=1700000000.5):
+            second = new_ulid()
+        self.assertLess(first, second)
+
+    def test_unique_across_threads(self):
+        results = []
+        lock = threading.Lock()
+
+        def worker():
+            generated = [new_operation_id('vto_op') for _ in range(500)]
+            with lock:
+                results.extend(generated)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(results)), 4000)
+
+if __name__ == '__main__':
+    unittest.main()
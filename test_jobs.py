@@ -0,0 +1,257 @@
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import requests
+from flask import Flask
+
+import fake_backend
+import jobs
+import storage
+from config import Config
+from extensions import db
+from jobs import Worker
+from models import GenerationHistory, GenerationJob
+
+
+def noop(service, operation_id, payload):
+    pass
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        patcher = patch.dict(jobs.HANDLERS, {'probe': noop})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def expire_lease(self, operation_id):
+        job = GenerationJob.query.filter_by(operation_id=operation_id).one()
+        job.lease_expires_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        db.session.commit()
+
+    def test_jobs_are_claimed_once_in_order(self):
+        jobs.enqueue('probe', 'op_1', {'n': 1})
+        jobs.enqueue('probe', 'op_2', {'n': 2})
+
+        first = jobs.claim('worker-a', lease_seconds=60, max_attempts=3)
+        second = jobs.claim('worker-b', lease_seconds=60, max_attempts=3)
+        self.assertEqual((first.operation_id, first.lease_owner, first.attempts), ('op_1', 'worker-a', 1))
+        self.assertEqual((second.operation_id, second.lease_owner), ('op_2', 'worker-b'))
+        self.assertIsNone(jobs.claim('worker-c', lease_seconds=60, max_attempts=3))
+        self.assertEqual(jobs.queue_counts(), {'running': 2})
+
+    def test_unknown_kind_is_rejected(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('teleport', 'op_1', {})
+
+    def test_expired_lease_is_taken_over_and_old_owner_cannot_finish(self):
+        jobs.enqueue('probe', 'op_1', {})
+        jobs.claim('worker-a', lease_seconds=60, max_attempts=3)
+        self.expire_lease('op_1')
+
+        job = jobs.claim('worker-b', lease_seconds=60, max_attempts=3)
+        self.assertEqual((job.lease_owner, job.attempts), ('worker-b', 2))
+        self.assertEqual(jobs.heartbeat('worker-a', ['op_1'], 60), {'op_1'})
+        self.assertFalse(jobs.finish('worker-a', 'op_1'))
+        self.assertTrue(jobs.finish('worker-b', 'op_1'))
+        self.assertEqual(db.session.get(GenerationJob, job.id).status, 'completed')
+
+    def test_heartbeat_extends_the_lease(self):
+        jobs.enqueue('probe', 'op_1', {})
+        jobs.claim('worker-a', lease_seconds=1, max_attempts=3)
+        self.assertEqual(jobs.heartbeat('worker-a', ['op_1'], 600), set())
+        db.session.expire_all()
+        job = GenerationJob.query.filter_by(operation_id='op_1').one()
+        self.assertGreater(job.lease_expires_at, datetime.datetime.utcnow() + datetime.timedelta(seconds=500))
+
+    def test_handler_that_raises_fails_its_history_row(self):
+        def missing_input(service, operation_id, payload):
+            raise FileNotFoundError("Input image /static/uploads/x.png is no longer stored.")
+
+        db.session.add(GenerationHistory(operation_id='op_1', prompt='cat', status='queued'))
+        db.session.commit()
+        jobs.enqueue('probe', 'op_1', {})
+        worker = Worker(self.app, SimpleNamespace(app=self.app), worker_id='worker-a')
+        job = jobs.claim('worker-a', lease_seconds=60, max_attempts=3)
+        with patch.dict(jobs.HANDLERS, {'probe': missing_input}), self.assertLogs('jobs', level='ERROR'):
+            worker._execute(job.operation_id, job.kind, job.payload)
+
+        db.session.expire_all()
+        history = GenerationHistory.get_by_operation_id('op_1')
+        self.assertEqual((history.status, history.error_message),
+                         ('failed', "Input image /static/uploads/x.png is no longer stored."))
+        self.assertEqual(GenerationJob.query.one().status, 'failed')
+
+    def test_jobs_out_of_attempts_are_failed_with_their_history_row(self):
+        db.session.add(GenerationHistory(operation_id='op_1', prompt='cat', status='running'))
+        db.session.commit()
+        jobs.enqueue('probe', 'op_1', {})
+        jobs.claim('worker-a', lease_seconds=60, max_attempts=1)
+        self.expire_lease('op_1')
+
+        self.assertIsNone(jobs.claim('worker-b', lease_seconds=60, max_attempts=1))
+        self.assertEqual(jobs.reap_abandoned(max_attempts=1), ['op_1'])
+        db.session.expire_all()
+        self.assertEqual(GenerationJob.query.one().status, 'failed')
+        self.assertEqual(GenerationHistory.get_by_operation_id('op_1').status, 'failed')
+
+
+class TestWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        path = os.path.join(tempfile.mkdtemp(), 'history.db')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+        db.init_app(self.app)
+        with self.app.app_context():
+            db.create_all()
+
+    def test_runs_queued_jobs_concurrently_and_marks_them_done(self):
+        seen = []
+
+        def slow(service, operation_id, payload):
+            time.sleep(0.2)
+            seen.append(payload['n'])
+
+        def broken(service, operation_id, payload):
+            seen.append('broken')
+            raise RuntimeError('boom')
+
+        with patch.dict(jobs.HANDLERS, {'slow': slow, 'broken': broken}), self.app.app_context():
+            for n in range(4):
+                jobs.enqueue('slow', f"op_{n}", {'n': n})
+            jobs.enqueue('broken', 'op_broken', {})
+
+        worker = Worker(self.app, SimpleNamespace(app=self.app), worker_id='w', concurrency=4,
+                        poll_interval=0.01, heartbeat_seconds=0.05)
+        with patch.dict(jobs.HANDLERS, {'slow': slow, 'broken': broken}), self.assertLogs('jobs', level='ERROR'):
+            thread = threading.Thread(target=worker.run)
+            start = time.perf_counter()
+            thread.start()
+            while len(seen) < 5 or worker.active_count():
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - start
+            worker.stop()
+            thread.join(5)
+
+        self.assertEqual(sorted(seen, key=str), [0, 1, 2, 3, 'broken'])
+        self.assertLess(elapsed, 0.6)
+        with self.app.app_context():
+            self.assertEqual(jobs.queue_counts(), {'completed': 4, 'failed': 1})
+            self.assertEqual(GenerationJob.query.filter_by(operation_id='op_broken').one().error_message, 'boom')
+
+    def test_operation_is_polled_by_one_instance_and_resumed_after_takeover(self):
+        events = []
+
+        def poll(service, operation_id, payload):
+            with service.app.app_context():
+                lease = jobs.OperationLease(operation_id)
+                resumed = lease.take_remote_operation()
+                if resumed:
+                    events.append(('resumed', service.name, resumed))
+                    return
+                lease.record('operations/1')
+                events.append(('submitted', service.name))
+            try:
+                for _ in range(300):
+                    time.sleep(0.01)
+                    lease.check()
+            except jobs.LeaseLost:
+                events.append(('lost', service.name))
+
+        # Instance "a" stalls: its heartbeat comes too late to keep a 0.2s lease.
+        a = Worker(self.app, SimpleNamespace(app=self.app, name='a'), worker_id='a', lease_seconds=0.2, heartbeat_seconds=1.0)
+        b = Worker(self.app, SimpleNamespace(app=self.app, name='b'), worker_id='b', lease_seconds=0.2, heartbeat_seconds=0.05)
+        self.addCleanup(a.stop)
+        self.addCleanup(b.stop)
+        with patch.dict(jobs.HANDLERS, {'poll': poll}), self.assertLogs('jobs', level='WARNING'):
+            a.start()
+            with self.app.app_context():
+                a.submit('poll', 'op_1', {})
+            b.start()
+            deadline = time.monotonic() + 5
+            while (a.active_count() or len(events) < 3) and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        self.assertEqual(sorted(events), [('lost', 'a'), ('resumed', 'b', 'operations/1'), ('submitted', 'a')])
+        with self.app.app_context():
+            job = GenerationJob.query.one()
+            self.assertEqual((job.status, job.lease_owner, job.attempts), ('completed', 'b', 2))
+
+
+class TestImageVideoTakeover(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        self.addCleanup(os.chdir, cwd)
+        os.makedirs(Config.VIDEO_DIR)
+
+        self.app = Flask(__name__)
+        self.app.config.from_object(Config)
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(self.root, 'history.db')}",
+            STORAGE_MAX_BYTES=0, STORAGE_GCS_FALLBACK=False, DERIVATIVES_ENABLED=False,
+        )
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        server, self.url = fake_backend.start_in_thread(port=0, latency=0, latency_jitter=0, gcs_latency=0, lro_seconds=0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def test_taken_over_job_polls_its_operation_without_the_input_image(self):
+        model = 'veo-3.0-generate-001'
+        with patch.object(Config, 'VERTEX_API_ENDPOINT', self.url):
+            operation = requests.post(
+                f"{self.url}/v1/projects/p/locations/us-central1/publishers/google/models/{model}:predictLongRunning",
+                json={'instances': [{'prompt': 'cat'}]},
+            ).json()['name']
+        payload = {'prompt': 'cat', 'image_path': f"/{storage.UPLOAD_DIR}/evicted.png", 'model_name': model,
+                   'seed': 1, 'aspect_ratio': '16:9', 'negative_prompt': ''}
+        db.session.add(GenerationHistory(operation_id='op_1', prompt='cat', status='running'))
+        db.session.add(GenerationJob(
+            operation_id='op_1', kind='image_video', payload=json.dumps(payload), remote_operation=operation,
+            status='running', attempts=1, lease_owner='dead',
+            lease_expires_at=datetime.datetime.utcnow() - datetime.timedelta(seconds=1),
+        ))
+        db.session.commit()
+
+        worker = Worker(self.app, SimpleNamespace(app=self.app), worker_id='b')
+        job = jobs.claim('b', lease_seconds=60, max_attempts=3)
+        with patch.object(Config, 'VERTEX_API_ENDPOINT', self.url), patch.object(Config, 'LRO_POLL_INTERVAL', 0):
+            worker._execute(job.operation_id, job.kind, job.payload)
+
+        db.session.expire_all()
+        history = GenerationHistory.get_by_operation_id('op_1')
+        self.assertEqual((history.status, history.error_message), ('completed', None))
+        self.assertTrue(os.path.exists(history.video_path.lstrip('/')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from flask import Flask, Response, jsonify
+from werkzeug.serving import make_server
+
+import loadtest
+
+
+class TestLoadtestStats(unittest.TestCase):
+
+    def test_percentiles_use_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 95), 95)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile([7], 99), 7)
+        self.assertIsNone(loadtest.percentile([], 50))
+
+    def test_summary_counts_error_statuses_per_route(self):
+        recorder = loadtest.Recorder()
+        recorder.add('GET /a', 0.1, 200)
+        recorder.add('GET /a', 0.3, 500)
+        recorder.add('POST /b', 0.2, '200-error')
+        recorder.add('POST /b', 0.2, 'ConnectionError')
+        recorder.add_iteration(0.5, False)
+        summary = recorder.summary(wall_seconds=2.0)
+
+        self.assertEqual(summary['requests'], 4)
+        self.assertEqual(summary['errors'], 3)
+        self.assertEqual(summary['throughput_rps'], 2.0)
+        self.assertEqual(summary['routes']['GET /a']['errors'], 1)
+        self.assertEqual(summary['routes']['POST /b']['errors'], 2)
+        self.assertEqual(summary['failed_iterations'], 1)
+
+    def test_compare_flags_regressions_in_both_directions(self):
+        base = {'scenarios': {'s': {'latency': {'p95': 1.0}, 'throughput_rps': 100.0, 'peak_rss_bytes': 100}}}
+        new = {'scenarios': {'s': {'latency': {'p95': 1.05}, 'throughput_rps': 80.0, 'peak_rss_bytes': 150}}}
+        rows = {row['metric']: row for row in loadtest.compare_results(base, new, threshold=0.1)}
+
+        self.assertFalse(rows['latency.p95']['regression'])
+        self.assertTrue(rows['throughput_rps']['regression'])
+        self.assertTrue(rows['peak_rss_bytes']['regression'])
+
+    def test_sampler_records_own_process(self):
+        with loadtest.ResourceSampler(os.getpid(), interval=0.01) as sampler:
+            pass
+        self.assertGreater(sampler.peak_rss_bytes, 0)
+        self.assertGreaterEqual(sampler.peak_threads, 1)
+
+
+class TestRunScenario(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+
+        @app.route('/ok')
+        def ok():
+            return jsonify({'ok': True})
+
+        @app.route('/hidden-error')
+        def hidden_error():
+            return jsonify(({'error': 'boom'}, 500))
+
+        @app.route('/events', methods=['POST'])
+        def events():
+            def stream():
+                yield 'event: chunk\ndata: {"text": "a"}\n\n'
+                time.sleep(0.1)
+                yield 'event: done\ndata: {"final_prompt": "a"}\n\n'
+            return Response(stream(), mimetype='text/event-stream')
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.shutdown)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def test_runs_every_iteration_across_workers(self):
+        def scenario(client, i, payloads, options):
+            client.get('/ok')
+            return loadtest._ok(client.get('/hidden-error'))
+
+        with patch.dict(loadtest.SCENARIOS, {'probe': scenario}):
+            result = loadtest.run_scenario('probe', self.base_url, concurrency=3, iterations=10, options=None, payloads=None, pid=os.getpid())
+
+        self.assertEqual(result['iterations'], 10)
+        self.assertEqual(result['failed_iterations'], 10)
+        self.assertEqual(result['routes']['GET /ok']['count'], 10)
+        self.assertEqual(result['routes']['GET /hidden-error']['errors'], 10)
+        self.assertEqual(result['status_codes'], {'200': 10, '200-error': 10})
+        self.assertIsNotNone(result['latency']['p99'])
+        self.assertIsNotNone(result['peak_rss_bytes'])
+
+    def test_streams_record_time_to_first_chunk_separately(self):
+        def scenario(client, i, payloads, options):
+            events = client.post_event_stream('/events')
+            return [name for name, _ in events] == ['chunk', 'done']
+
+        with patch.dict(loadtest.SCENARIOS, {'probe': scenario}):
+            result = loadtest.run_scenario('probe', self.base_url, concurrency=2, iterations=4, options=None, payloads=None, pid=os.getpid())
+
+        self.assertEqual((result['requests'], result['failed_iterations']), (4, 0))
+        first_chunk = result['time_to_first_chunk']['POST /events (stream)']
+        self.assertEqual(first_chunk['count'], 4)
+        self.assertLess(first_chunk['p50'], result['routes']['POST /events (stream)']['p50'])
+        self.assertGreaterEqual(result['routes']['POST /events (stream)']['p50'], 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import io
+import json
+import logging
+import threading
+import unittest
+
+import logs
+
+
+class TestLogs(unittest.TestCase):
+
+    def make_record(self, message, *args):
+        record = logging.LogRecord('genmedia.test', logging.INFO, __file__, 1, message, args, None)
+        logs.OperationIdFilter().filter(record)
+        return record
+
+    def test_json_formatter_includes_operation_id(self):
+        with logs.bind_operation_id('vto_op_01TEST'):
+            record = self.make_record("Virtual Try-On took %.2fs.", 1.234)
+        entry = json.loads(logs.JsonFormatter().format(record))
+        self.assertEqual(entry['severity'], 'INFO')
+        self.assertEqual(entry['message'], 'Virtual Try-On took 1.23s.')
+        self.assertEqual(entry['operation_id'], 'vto_op_01TEST')
+
+    def test_operation_id_does_not_leak_between_threads(self):
+        logs.set_operation_id('op_main')
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(self.make_record('x').operation_id))
+        thread.start()
+        thread.join()
+        logs.clear_operation_id()
+        self.assertEqual(seen, [None])
+
+    def test_truncate(self):
+        self.assertEqual(logs.truncate('short', 10), 'short')
+        self.assertEqual(logs.truncate('a' * 30, 10), 'aaaaaaaaaa... [20 more chars]')
+
+    def test_payload_sampler_skips_when_debug_disabled_or_unsampled(self):
+        logger = logging.getLogger('genmedia.test.sampler')
+        logger.propagate = False
+        stream = io.StringIO()
+        logger.addHandler(logging.StreamHandler(stream))
+
+        logger.setLevel(logging.INFO)
+        logs.PayloadSampler(sample_rate=1.0).debug(logger, 'content', ['x'] * 1000)
+        logger.setLevel(logging.DEBUG)
+        logs.PayloadSampler(sample_rate=0.0).debug(logger, 'content', ['x'] * 1000)
+        self.assertEqual(stream.getvalue(), '')
+
+        logs.PayloadSampler(sample_rate=1.0, max_chars=20).debug(logger, 'content', ['x'] * 1000)
+        self.assertIn('more chars]', stream.getvalue())
+        self.assertLess(len(stream.getvalue()), 80)
+
+    def test_configure_logging_writes_through_queue_listener(self):
+        listener = logs.configure_logging(level='DEBUG', fmt='json')
+        stream = io.StringIO()
+        listener.handlers[0].setStream(stream)
+        with logs.bind_operation_id('op_queue'):
+            logging.getLogger('genmedia.test.queue').info("queued %s", 'record')
+        listener.stop()
+        entry = json.loads(stream.getvalue().strip())
+        self.assertEqual(entry['message'], 'queued record')
+        self.assertEqual(entry['operation_id'], 'op_queue')
+        listener.start()
+
+
+if __name__ == '__main__':
+    unittest.main()
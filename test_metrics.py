@@ -0,0 +1,140 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+import metrics
+from extensions import db
+from models import GenerationHistory
+from ratelimit import RateLimiter
+from retry import history_retry_recorder
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_histogram_exposition(self):
+        histogram = metrics.Histogram('test_seconds', 'Test latency.', ['model'], buckets=(1, 5), registry=self.registry)
+        histogram.labels(model='veo').observe(0.5)
+        histogram.labels(model='veo').observe(3)
+        histogram.labels(model='veo').observe(10)
+        text = self.registry.render()
+        self.assertIn('# TYPE test_seconds histogram', text)
+        self.assertIn('test_seconds_bucket{model="veo",le="1.0"} 1', text)
+        self.assertIn('test_seconds_bucket{model="veo",le="5.0"} 2', text)
+        self.assertIn('test_seconds_bucket{model="veo",le="+Inf"} 3', text)
+        self.assertIn('test_seconds_sum{model="veo"} 13.5', text)
+        self.assertIn('test_seconds_count{model="veo"} 3', text)
+
+    def test_counter_and_gauge(self):
+        counter = metrics.Counter('test_errors', 'Errors.', ['error_class'], registry=self.registry)
+        gauge = metrics.Gauge('test_in_flight', 'In flight.', registry=self.registry)
+        counter.labels(error_class='Quote"d').inc()
+        gauge.labels().inc()
+        gauge.labels().inc()
+        gauge.labels().dec()
+        text = self.registry.render()
+        self.assertIn('test_errors_total{error_class="Quote\\"d"} 1.0', text)
+        self.assertIn('test_in_flight 1.0', text)
+
+    def test_track_model_call_counts_errors(self):
+        errors = metrics.errors.labels(source='test-model', error_class='ValueError')
+        calls = metrics.model_call_seconds.labels(model='test-model')
+        with self.assertRaises(ValueError):
+            with metrics.track_model_call('test-model'):
+                raise ValueError("bad input")
+        self.assertEqual(errors.value, 1)
+        self.assertEqual(sum(calls.counts), 1)
+
+    def test_track_operation_balances_in_flight_gauge(self):
+        gauge = metrics.in_flight.labels(operation='test-op')
+
+        @metrics.tracked_operation('test-op')
+        def work():
+            self.assertEqual(gauge.value, 1)
+            return 'done'
+
+        self.assertEqual(work(), 'done')
+        self.assertEqual(gauge.value, 0)
+
+    def test_rate_limiter_records_queue_wait(self):
+        limiter = RateLimiter({'test-queue-model': {'per_minute': 6000, 'burst': 1}})
+        limiter.acquire('test-queue-model-001')
+        limiter.acquire('test-queue-model-001')
+        waits = metrics.queue_wait_seconds.labels(model='test-queue-model-001', stage='rate_limit')
+        self.assertEqual(sum(waits.counts), 2)
+        self.assertGreater(waits.sum, 0)
+
+
+class TestStageTimings(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_stages_accumulate_across_resubmits(self):
+        timings = metrics.StageTimings()
+        timings.add('submit', 0.5)
+        timings.add('submit', 0.25)
+        with timings.stage('remote'):
+            pass
+        self.assertEqual(timings.stages['submit'], 0.75)
+        self.assertIn('remote', timings.stages)
+
+    def test_commit_persists_timings_and_observes_db_write(self):
+        timings = metrics.StageTimings.from_json(json.dumps({'upload': 1.5}))
+        timings.add('remote', 42.0)
+        item = GenerationHistory(operation_id='op_1', prompt='cat', status='completed')
+        db.session.add(item)
+        writes = sum(metrics.db_write_seconds.labels().counts)
+        with patch.object(db.session, 'commit', wraps=db.session.commit) as commit:
+            timings.commit(item, db.session)
+
+        self.assertEqual(commit.call_count, 1)
+        self.assertEqual(sum(metrics.db_write_seconds.labels().counts), writes + 1)
+        stored = GenerationHistory.get_by_operation_id('op_1').to_dict()['stage_timings']
+        self.assertEqual(stored, {'upload': 1.5, 'remote': 42.0})
+
+    def test_earlier_status_commits_are_stored_as_db_write_with_the_final_one(self):
+        queued = metrics.StageTimings({'upload': 1.5})
+        queued.insert(GenerationHistory(operation_id='op_1', prompt='cat', status='queued'), db.session)
+        item = GenerationHistory.get_by_operation_id('op_1')
+        self.assertIn('db_write', item.to_dict()['stage_timings'])
+
+        timings = metrics.StageTimings.from_json(item.stage_timings)
+        item.status = 'running'
+        timings.write(db.session)
+        history_retry_recorder(item, db.session, timings)(1, Exception('busy'), 0)
+        self.assertEqual(item.to_dict()['stage_timings'], queued.stages)
+
+        item.status = 'completed'
+        timings.commit(item, db.session)
+        stored = GenerationHistory.get_by_operation_id('op_1').to_dict()['stage_timings']
+        self.assertEqual(stored['upload'], 1.5)
+        self.assertEqual(stored['db_write'], timings.stages['db_write'])
+        self.assertGreaterEqual(stored['db_write'], queued.stages['db_write'])
+        self.assertEqual(item.retry_count, 1)
+
+    def test_summary_orders_stages_and_reports_percentiles(self):
+        rows = [json.dumps({'remote': float(i), 'submit': 0.1}) for i in range(1, 21)] + [None]
+        summary = metrics.summarize_stage_timings(rows)
+        self.assertEqual(list(summary), ['submit', 'remote'])
+        self.assertEqual(summary['remote']['count'], 20)
+        self.assertEqual(summary['remote']['avg'], 10.5)
+        self.assertEqual(summary['remote']['p95'], 20.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
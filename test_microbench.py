@@ -0,0 +1,34 @@
+import unittest
+
+import microbench
+
+
+class TestMicrobench(unittest.TestCase):
+
+    def test_every_benchmark_runs_and_reports_allocations(self):
+        results = microbench.run_benchmarks(list(microbench.BENCHMARKS), ['tiny'], repeat=1, sizes={'tiny': (64, 48)})
+
+        self.assertEqual({r['bench'] for r in results}, set(microbench.BENCHMARKS))
+        for result in results:
+            self.assertGreater(result['p50_ms'], 0)
+            self.assertGreaterEqual(result['py_peak_bytes'], 0)
+        by_name = {r['bench']: r for r in results}
+        self.assertGreaterEqual(by_name['pad_image_and_mask']['pil_images_allocated'], 2)
+        self.assertIsNone(by_name['history_to_dict']['size'])
+
+    def test_photo_like_images_are_cached_and_sized(self):
+        image = microbench.photo_like((40, 30))
+        self.assertEqual(image.size, (40, 30))
+        self.assertEqual(image.mode, 'RGB')
+        self.assertIs(microbench.photo_like((40, 30)), image)
+
+    def test_compare_flags_slower_runs(self):
+        base = {'results': [{'bench': 'b', 'size': '512', 'p50_ms': 10.0, 'py_peak_bytes': 100}]}
+        new = {'results': [{'bench': 'b', 'size': '512', 'p50_ms': 12.0, 'py_peak_bytes': 100}]}
+        rows = {row['metric']: row for row in microbench.compare_results(base, new)}
+        self.assertTrue(rows['p50_ms']['regression'])
+        self.assertFalse(rows['py_peak_bytes']['regression'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import base64
+import os
+import tempfile
+import unittest
+
+from flask import Flask, jsonify
+
+import profiling
+from profiling import profiled
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        self.app.config.update(
+            PROFILING_ENABLED=False,
+            PROFILE_HEADER='X-Profile',
+            PROFILE_DIR=self.profile_dir,
+            PROFILE_MAX_FILES=2,
+        )
+
+        @self.app.route('/encode', methods=['POST'])
+        @profiled('encode')
+        def encode():
+            return jsonify({'data': base64.b64encode(os.urandom(1 << 16)).decode('utf-8')})
+
+        self.client = self.app.test_client()
+
+    def test_not_profiled_without_header(self):
+        response = self.client.post('/encode')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertEqual(profiling.list_profiles(self.profile_dir), [])
+
+    def test_header_enables_profile_and_index(self):
+        response = self.client.post('/encode', headers={'X-Profile': '1'})
+        profile_id = response.headers['X-Profile-Id']
+        profiles = profiling.list_profiles(self.profile_dir)
+        self.assertEqual([p['profile_id'] for p in profiles], [profile_id])
+        self.assertEqual(profiles[0]['endpoint'], 'encode')
+
+        summary = profiling.profile_summary(profiling.profile_path(self.profile_dir, profile_id))
+        self.assertIn('b64encode', summary)
+
+    def test_global_flag_and_pruning(self):
+        self.app.config['PROFILING_ENABLED'] = True
+        ids = [self.client.post('/encode').headers['X-Profile-Id'] for _ in range(3)]
+        kept = [p['profile_id'] for p in profiling.list_profiles(self.profile_dir)]
+        self.assertEqual(kept, ids[:0:-1])
+
+    def test_profile_path_rejects_traversal(self):
+        self.assertIsNone(profiling.profile_path(self.profile_dir, '../../etc/passwd'))
+
+
+if __name__ == '__main__':
+    unittest.main()
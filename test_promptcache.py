@@ -0,0 +1,156 @@
+import base64
+import io
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from PIL import Image
+
+import metrics
+from config import Config
+from promptcache import TTLCache, prompt_cache, prompt_key
+from utils import generate_veo_prompt_internal, stream_veo_prompt_internal
+
+
+def png_base64(size):
+    buf = io.BytesIO()
+    Image.new('RGB', size, (10, 120, 200)).save(buf, format='PNG')
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+class FakeGemini:
+    def __init__(self):
+        self.calls = 0
+        self.contents = []
+        self.models = SimpleNamespace(generate_content=self.generate_content, generate_content_stream=self.generate_content_stream)
+
+    def generate_content(self, model, contents):
+        self.calls += 1
+        self.contents.append(contents)
+        return SimpleNamespace(text=f"answer {self.calls}")
+
+    def generate_content_stream(self, model, contents):
+        self.calls += 1
+        for text in ('{"scene": ', '', '"a cat"}'):
+            yield SimpleNamespace(text=text)
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_least_recently_used_entry_is_dropped_when_full(self):
+        cache = TTLCache(max_entries=2, ttl_seconds=60)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_entries_expire_after_ttl(self):
+        cache = TTLCache(max_entries=10, ttl_seconds=60)
+        with patch('promptcache.time.monotonic', return_value=1000.0):
+            cache.put('a', 1)
+        with patch('promptcache.time.monotonic', return_value=1059.0):
+            self.assertEqual(cache.get('a'), 1)
+        with patch('promptcache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_key_ignores_whitespace_but_not_content(self):
+        self.assertEqual(prompt_key('m', 'Be vivid.\n', '  a cat '), prompt_key('m', 'Be  vivid.', 'a cat'))
+        self.assertNotEqual(prompt_key('m', 'Be vivid.', 'a cat'), prompt_key('m', 'Be vivid.', 'a dog'))
+        self.assertNotEqual(prompt_key('m', 'i', 'p', b'img1'), prompt_key('m', 'i', 'p', b'img2'))
+        self.assertNotEqual(prompt_key('m1', 'i', 'p'), prompt_key('m2', 'i', 'p'))
+
+
+class TestPromptGenerationCache(unittest.TestCase):
+
+    def setUp(self):
+        prompt_cache.clear()
+        self.addCleanup(prompt_cache.clear)
+
+    def counts(self):
+        return {result: metrics.prompt_cache.labels(result=result).value for result in ('hit', 'miss')}
+
+    def test_identical_requests_call_gemini_once_unless_fresh(self):
+        gemini = FakeGemini()
+        before = self.counts()
+
+        first = generate_veo_prompt_internal(gemini, 'a cat', 'Write a video prompt.')
+        second = generate_veo_prompt_internal(gemini, 'a cat ', 'Write a video prompt.')
+        self.assertEqual((first, second, gemini.calls), ('answer 1', 'answer 1', 1))
+
+        fresh = generate_veo_prompt_internal(gemini, 'a cat', 'Write a video prompt.', use_cache=False)
+        self.assertEqual((fresh, gemini.calls), ('answer 2', 2))
+        # A fresh sample replaces the cached answer.
+        self.assertEqual(generate_veo_prompt_internal(gemini, 'a cat', 'Write a video prompt.'), 'answer 2')
+
+        after = self.counts()
+        self.assertEqual((after['hit'] - before['hit'], after['miss'] - before['miss']), (2, 1))
+
+    def test_errors_are_not_cached(self):
+        gemini = FakeGemini()
+        with patch.object(gemini.models, 'generate_content', side_effect=ValueError('bad request')), \
+                self.assertLogs('utils', level='ERROR'):
+            self.assertTrue(generate_veo_prompt_internal(gemini, 'a cat', 'i').startswith('Error'))
+        self.assertEqual(generate_veo_prompt_internal(gemini, 'a cat', 'i'), 'answer 1')
+
+
+class TestPromptImages(unittest.TestCase):
+
+    def setUp(self):
+        prompt_cache.clear()
+        self.addCleanup(prompt_cache.clear)
+
+    def test_small_images_are_sent_inline_without_a_gcs_upload(self):
+        gemini = FakeGemini()
+        with patch('utils.upload_to_gcs') as upload:
+            generate_veo_prompt_internal(gemini, 'a cat', 'i', image_data=png_base64((8, 8)))
+        upload.assert_not_called()
+        image_part = gemini.contents[0][0]
+        self.assertEqual(image_part.inline_data.mime_type, 'image/png')
+        self.assertEqual(image_part.inline_data.data, base64.b64decode(png_base64((8, 8))))
+
+    def test_images_over_the_threshold_are_uploaded(self):
+        gemini = FakeGemini()
+        with patch.object(Config, 'PROMPT_INLINE_IMAGE_MAX_BYTES', 10), \
+                patch('utils.upload_to_gcs', return_value='gs://bucket/prompt-images/x.png') as upload:
+            generate_veo_prompt_internal(gemini, 'a cat', 'i', image_data=png_base64((8, 8)))
+        upload.assert_called_once()
+        self.assertEqual(gemini.contents[0][0].file_data.file_uri, 'gs://bucket/prompt-images/x.png')
+
+
+class TestPromptStreaming(unittest.TestCase):
+
+    def setUp(self):
+        prompt_cache.clear()
+        self.addCleanup(prompt_cache.clear)
+
+    def test_chunks_are_relayed_as_they_arrive_and_the_answer_is_cached(self):
+        gemini = FakeGemini()
+        self.assertEqual(list(stream_veo_prompt_internal(gemini, 'a cat', 'i')), ['{"scene": ', '"a cat"}'])
+        self.assertEqual(list(stream_veo_prompt_internal(gemini, 'a cat', 'i')), ['{"scene": "a cat"}'])
+        self.assertEqual(generate_veo_prompt_internal(gemini, 'a cat', 'i'), '{"scene": "a cat"}')
+        self.assertEqual(gemini.calls, 1)
+
+        list(stream_veo_prompt_internal(gemini, 'a cat', 'i', use_cache=False))
+        self.assertEqual(gemini.calls, 2)
+
+    def test_failure_before_the_first_chunk_is_retried(self):
+        gemini = FakeGemini()
+        stream = gemini.generate_content_stream
+        attempts = []
+
+        def flaky(model, contents):
+            attempts.append(model)
+            if len(attempts) == 1:
+                raise ConnectionError('reset')
+            return stream(model, contents)
+
+        with patch.object(gemini.models, 'generate_content_stream', flaky), \
+                patch('retry.time.sleep'):
+            self.assertEqual(''.join(stream_veo_prompt_internal(gemini, 'a cat', 'i')), '{"scene": "a cat"}')
+        self.assertEqual(len(attempts), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
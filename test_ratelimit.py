@@ -0,0 +1,71 @@
+import threading
+import time
+import unittest
+
+from ratelimit import RateLimiter, RateLimitTimeout, TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_is_served_immediately(self):
+        bucket = TokenBucket(per_minute=60, burst=3)
+        start = time.monotonic()
+        for _ in range(3):
+            self.assertEqual(bucket.acquire(), 0.0)
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    def test_requests_over_the_limit_queue_instead_of_failing(self):
+        bucket = TokenBucket(per_minute=600, burst=1)  # one token every 100ms
+        finished = []
+
+        def worker():
+            bucket.acquire()
+            finished.append(time.monotonic())
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(finished), 4)
+        self.assertGreaterEqual(max(finished) - start, 0.28)
+
+    def test_timeout(self):
+        bucket = TokenBucket(per_minute=1, burst=1)
+        bucket.acquire()
+        with self.assertRaises(RateLimitTimeout):
+            bucket.acquire(timeout=0.1)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_longest_prefix_wins(self):
+        limiter = RateLimiter({
+            'veo-3.0': {'per_minute': 10},
+            'veo-3.0-fast': {'per_minute': 20},
+        })
+        self.assertEqual(limiter.bucket_for('veo-3.0-fast-generate-001').rate * 60, 20)
+        self.assertEqual(limiter.bucket_for('veo-3.0-generate-preview').rate * 60, 10)
+
+    def test_unconfigured_models_are_not_throttled(self):
+        limiter = RateLimiter({'gemini': {'per_minute': 1}})
+        self.assertIsNone(limiter.bucket_for('imagen-4.0-generate-preview-06-06'))
+        self.assertEqual(limiter.acquire('imagen-4.0-generate-preview-06-06'), 0.0)
+
+    def test_configure_replaces_limits(self):
+        limiter = RateLimiter({'gemini': {'per_minute': 1}})
+        limiter.configure({'virtual-try-on': {'per_minute': 30, 'burst': 4}})
+        self.assertEqual(limiter.limits(), {'virtual-try-on': {'per_minute': 30.0, 'burst': 4.0}})
+
+    def test_invalid_limits_are_rejected_and_the_old_ones_kept(self):
+        limiter = RateLimiter({'gemini': {'per_minute': 1}})
+        for limits in ({'veo': {'per_minute': 0}}, {'veo': {'per_minute': -5}}, {'veo': {'per_minute': 'ten'}},
+                       {'veo': {'per_minute': 10, 'burst': 0}}, {'veo': 10}, ['veo']):
+            with self.assertRaises(ValueError):
+                limiter.configure(limits)
+        self.assertEqual(limiter.limits(), {'gemini': {'per_minute': 1.0, 'burst': 1.0}})
+
+
+if __name__ == '__main__':
+    unittest.main()
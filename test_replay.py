@@ -0,0 +1,116 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+import loadtest
+import replay
+
+
+class TestReplayTraces(unittest.TestCase):
+
+    def test_history_rows_map_back_to_their_routes(self):
+        rows = [
+            {'operation_id': 'op_1754451932703_0', 'prompt': 'a lion'},
+            {'operation_id': 'img_op_1', 'prompt': 'waves', 'video_path': '/static/videos/img_op_1.mp4'},
+            {'operation_id': 'img_op_2', 'prompt': 'flowers', 'status': 'completed', 'image_path': '/static/uploads/img_op_2.png'},
+            {'operation_id': 'vto_op_1', 'operation_type': 'vto', 'input_payload': json.dumps({'prompt': 'p', 'sample_count': 1, 'person_image_uri': 'gs://b/p.png'})},
+            {'operation_id': 'veo_edit_op_1', 'operation_type': 'veo_edit', 'input_payload': json.dumps({
+                'video_gcs': 'gs://b/v.mp4', 'mask_gcs': 'gs://b/m.png', 'parameters': {'aspectRatio': '16:9', 'enhancePrompt': True},
+            })},
+            {'operation_id': 'batch_1', 'operation_type': 'batch_vto'},
+        ]
+        requests = [replay.request_from_history(row) for row in rows]
+
+        self.assertEqual(requests[0], {'method': 'POST', 'path': '/generate-videos', 'json': {'prompts': ['a lion']}})
+        self.assertEqual(requests[1]['path'], '/generate-image-video')
+        self.assertEqual(requests[2]['path'], '/generate-editor-image')
+        self.assertEqual(requests[3]['form']['person_image_uri'], 'gs://b/p.png')
+        self.assertEqual(requests[3]['files'], {'product_image': 'image'})
+        self.assertEqual(requests[4]['form']['enhance_prompt'], 'true')
+        self.assertIsNone(requests[5])
+
+    def test_loads_history_database_in_arrival_order(self):
+        path = os.path.join(tempfile.mkdtemp(), 'history.db')
+        connection = sqlite3.connect(path)
+        connection.execute('CREATE TABLE generation_history (operation_id TEXT, prompt TEXT, status TEXT, video_path TEXT, '
+                           'image_path TEXT, timestamp DATETIME, input_payload TEXT, operation_type TEXT)')
+        connection.executemany('INSERT INTO generation_history VALUES (?, ?, ?, NULL, NULL, ?, NULL, NULL)', [
+            ('op_2', 'second', 'completed', '2025-08-06 03:14:10.000000'),
+            ('op_1', 'first', 'completed', '2025-08-06 03:14:08.500000'),
+        ])
+        connection.commit()
+        connection.close()
+
+        trace = replay.load_history_trace(path)
+        self.assertEqual([r['json']['prompts'][0] for r in trace], ['first', 'second'])
+        self.assertAlmostEqual(trace[1]['timestamp'] - trace[0]['timestamp'], 1.5)
+
+    def test_log_lines_without_path_or_timestamp_are_skipped(self):
+        path = os.path.join(tempfile.mkdtemp(), 'requests.jsonl')
+        with open(path, 'w') as f:
+            f.write(json.dumps({'request_id': 'not-a-request'}) + '\n')
+            f.write(json.dumps({'timestamp': '2025-08-06T03:14:09Z', 'path': '/get-generation-history'}) + '\n')
+            f.write(json.dumps({'timestamp': 1754450048, 'path': '/generate-prompt', 'json': {'user_prompt': 'x'}}) + '\n')
+        trace = replay.load_log_trace(path)
+        self.assertEqual([(r['method'], r['path']) for r in trace], [('POST', '/generate-prompt'), ('GET', '/get-generation-history')])
+
+    def test_schedule_scales_caps_gaps_and_repeats(self):
+        trace = [{'timestamp': 0}, {'timestamp': 10}, {'timestamp': 1000}]
+        self.assertEqual([offset for offset, _ in replay.schedule(trace, speed=10)], [0.0, 1.0, 100.0])
+        self.assertEqual([offset for offset, _ in replay.schedule(trace, speed=1, max_gap=30)], [0.0, 10.0, 40.0])
+        offsets = [offset for offset, _ in replay.schedule(trace, speed=1, max_gap=30, repeat=2)]
+        self.assertEqual(offsets, [0.0, 10.0, 40.0, 60.0, 70.0, 100.0])
+
+    def test_parse_metrics(self):
+        samples = replay.parse_metrics('# HELP x y\ngenmedia_queue_depth{queue="generation"} 3.0\ngenmedia_in_flight{operation="vto"} 2\n')
+        self.assertEqual(replay._sum_matching(samples, 'genmedia_queue_depth{'), 3.0)
+        self.assertEqual(samples['genmedia_in_flight{operation="vto"}'], 2.0)
+
+
+class TestReplayRun(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        self.statuses = {}
+
+        @app.route('/generate-videos', methods=['POST'])
+        def generate_videos():
+            operation_id = f"op_{len(self.statuses)}"
+            self.statuses[operation_id] = 'completed'
+            return jsonify({'operation_ids': [operation_id], 'prompts': request.json['prompts']})
+
+        @app.route('/video-status/<operation_id>')
+        def video_status(operation_id):
+            return jsonify({'status': self.statuses[operation_id]})
+
+        @app.route('/metrics')
+        def metrics():
+            return 'genmedia_queue_depth{queue="generation"} 1.0\n'
+
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        self.base_url = f"http://127.0.0.1:{server.server_port}"
+
+    def test_replays_open_loop_and_waits_for_async_operations(self):
+        trace = [{'timestamp': t, 'method': 'POST', 'path': '/generate-videos', 'json': {'prompts': [str(t)]}} for t in range(5)]
+        options = SimpleNamespace(max_inflight=8, poll_interval=0.01, completion_timeout=5)
+        report = replay.replay(replay.schedule(trace, speed=50), self.base_url, loadtest.Payloads(16), options, pid=os.getpid())
+
+        self.assertEqual(report['iterations'], 5)
+        self.assertEqual(report['failed_iterations'], 0)
+        self.assertEqual(report['routes']['POST /generate-videos']['count'], 5)
+        self.assertEqual(report['routes']['completion /generate-videos']['count'], 5)
+        self.assertEqual(report['queue']['peak_queue_depth'], 1.0)
+        self.assertEqual(report['dispatch_lag']['count'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+
+import requests
+
+import veo_editing
+from retry import RetryPolicy, RetryableOperationError, is_retryable, is_retryable_operation_error, is_safe_to_resubmit
+
+
+class FaultInjectingHandler(BaseHTTPRequestHandler):
+    """Answers POSTs with the next scripted (status, body) fault, then with success."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            status, body = server.faults.pop(0) if server.faults else (200, server.success_body)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestRetryAgainstFaultyServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FaultInjectingHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.faults = []
+        self.server.success_body = {'name': 'operations/123', 'done': True, 'response': {'videos': []}}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1/models/veo:fetchPredictOperation"
+        self.policy = RetryPolicy(max_attempts=4, base_delay=0.001, max_delay=0.01)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def post(self):
+        response = requests.post(self.url, json={})
+        response.raise_for_status()
+        return response.json()
+
+    def test_recovers_from_transient_faults(self):
+        self.server.faults = [(429, {'error': 'quota'}), (503, {'error': 'unavailable'})]
+        retries = []
+        result = self.policy.call(self.post, on_retry=lambda attempt, exc, delay: retries.append(attempt))
+        self.assertTrue(result['done'])
+        self.assertEqual(retries, [1, 2])
+        self.assertEqual(self.server.requests, 3)
+
+    def test_non_retryable_error_fails_fast(self):
+        self.server.faults = [(400, {'error': 'bad request'})]
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.policy.call(self.post)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_gives_up_after_max_attempts(self):
+        self.server.faults = [(503, {})] * 10
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.policy.call(self.post)
+        self.assertEqual(self.server.requests, 4)
+
+    @patch('backends.google.auth.default')
+    def test_fetch_operation_survives_503(self, mock_auth):
+        mock_auth.return_value = (MagicMock(token='token'), 'project')
+        self.server.faults = [(503, {}), (502, {})]
+        retries = []
+        op = veo_editing.fetch_operation(
+            self.url, 'operations/123', retry_policy=self.policy,
+            on_retry=lambda attempt, exc, delay: retries.append(attempt), poll_interval=0,
+        )
+        self.assertNotIn('error', op)
+        self.assertEqual(len(retries), 2)
+
+
+class TestClassification(unittest.TestCase):
+
+    def test_is_retryable(self):
+        self.assertTrue(is_retryable(requests.exceptions.ConnectionError()))
+        self.assertTrue(is_retryable(RetryableOperationError("code 8")))
+        api_error = Exception("Resource exhausted")
+        api_error.code = 429
+        self.assertTrue(is_retryable(api_error))
+        self.assertFalse(is_retryable(ValueError("bad input")))
+
+    def test_submits_are_only_retried_when_never_accepted(self):
+        quota = Exception("Resource exhausted")
+        quota.code = 429
+        self.assertTrue(is_safe_to_resubmit(quota))
+        with self.assertRaises(requests.exceptions.ConnectionError) as refused:
+            requests.post('http://127.0.0.1:9/v1/models/veo:predictLongRunning', json={}, timeout=5)
+        self.assertTrue(is_safe_to_resubmit(refused.exception))
+
+        server_error = Exception("Internal")
+        server_error.code = 500
+        self.assertFalse(is_safe_to_resubmit(server_error))
+        self.assertFalse(is_safe_to_resubmit(requests.exceptions.ReadTimeout()))
+        self.assertFalse(is_safe_to_resubmit(requests.exceptions.ConnectionError("Connection reset by peer")))
+
+    def test_is_retryable_operation_error(self):
+        self.assertTrue(is_retryable_operation_error({'code': 8, 'message': 'Resource exhausted'}))
+        self.assertFalse(is_retryable_operation_error({'code': 3, 'message': 'Invalid argument'}))
+
+    def test_backoff_is_capped(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5)
+        self.assertTrue(all(0 <= policy.backoff(10) <= 5 for _ in range(100)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+import backends
+import fake_backend
+import microbench
+from config import Config
+from promptcache import prompt_cache
+
+# prism builds its prediction client at import time; see microbench.import_media_module.
+microbench.import_media_module('prism')
+import routes  # noqa: E402
+from services import AppService  # noqa: E402
+
+
+class TestPromptRoutes(unittest.TestCase):
+    """Prompt routes end to end, against Gemini on the fake backend."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server, url = fake_backend.start_in_thread(port=0, latency=0, latency_jitter=0, stream_chunk_interval=0)
+        app = Flask(__name__)
+        app.config.from_object(Config)
+        app.config['TESTING'] = True
+        cls.service = AppService(app)
+        with patch.object(Config, 'VERTEX_API_ENDPOINT', url):
+            cls.service.client = backends.genai_client('p', 'us-central1')
+        # The blueprint is module-level, so its routes can only be set up once per process.
+        routes.initialize_routes(app, cls.service)
+        cls.client = app.test_client()
+        cls.url = url
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        prompt_cache.clear()
+        self.addCleanup(prompt_cache.clear)
+        self.addCleanup(self.configure_fake, failure_rate=0.0, stream_chunks=fake_backend.DEFAULT_CONFIG['stream_chunks'])
+
+    def configure_fake(self, **values):
+        self.server.backend.update_config(values)
+
+    def ndjson(self, response):
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    def events(self, response):
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        frames = response.get_data(as_text=True).split('\n\n')
+        self.assertEqual(frames[-1], '')
+        events = []
+        for frame in frames[:-1]:
+            event, data = frame.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    def test_prompt_streams_chunks_then_the_whole_answer(self):
+        self.configure_fake(stream_chunks=3)
+        for kwargs in ({'json': {'user_prompt': 'a cat', 'system_instructions': 'i', 'stream': True}},
+                       {'json': {'user_prompt': 'a cat', 'system_instructions': 'i', 'fresh': True},
+                        'headers': {'Accept': 'text/event-stream'}}):
+            events = self.events(self.client.post('/generate-prompt', **kwargs))
+
+            self.assertEqual([name for name, _ in events], ['chunk', 'chunk', 'chunk', 'done'])
+            self.assertEqual(events[-1][1], {'final_prompt': ''.join(data['text'] for _, data in events[:-1])})
+
+        events = self.events(self.client.post('/refine-prompt', json={
+            'current_prompt': 'a cat', 'refine_instruction': 'at night', 'stream': True,
+        }))
+        self.assertEqual(events[-1][0], 'done')
+        self.assertIn('refined_prompt', events[-1][1])
+
+    def test_prompt_stream_reports_errors_as_an_event(self):
+        self.configure_fake(failure_rate=1.0, failure_status=400)
+        with self.assertLogs('services', level='ERROR'):
+            events = self.events(self.client.post('/generate-prompt', json={
+                'user_prompt': 'a cat', 'system_instructions': 'i', 'stream': True, 'fresh': True,
+            }))
+        self.assertEqual([name for name, _ in events], ['error'])
+
+    def test_prompt_without_stream_returns_json(self):
+        response = self.client.post('/generate-prompt', json={'user_prompt': 'a cat', 'system_instructions': 'i'})
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertIn('a cat', json.loads(response.get_json()['final_prompt'])['prompt'])
+
+        response = self.client.post('/generate-prompt', json={'user_prompt': '', 'system_instructions': 'i', 'stream': True})
+        self.assertEqual((response.status_code, response.mimetype), (400, 'application/json'))
+
+    def test_generate_prompts_streams_one_line_per_prompt_then_a_summary(self):
+        response = self.client.post('/generate-prompts', json={
+            'prompts': ['a cat', {'user_prompt': 'a dog'}], 'system_instructions': 'Write a Veo prompt.',
+        })
+        lines = self.ndjson(response)
+
+        self.assertEqual(lines[-1], {'done': True, 'completed': 2, 'failed': 0})
+        items = sorted(lines[:-1], key=lambda line: line['index'])
+        self.assertEqual([item['user_prompt'] for item in items], ['a cat', 'a dog'])
+        for item in items:
+            self.assertIn(item['user_prompt'], json.loads(item['final_prompt'])['prompt'])
+
+    def test_generate_prompts_reports_failed_items(self):
+        self.configure_fake(failure_rate=1.0, failure_status=400)
+        with self.assertLogs('services', level='WARNING'):
+            lines = self.ndjson(self.client.post('/generate-prompts', json={
+                'prompts': ['a cat', 'a dog'], 'system_instructions': 'Write a Veo prompt.', 'fresh': True,
+            }))
+
+        self.assertEqual(lines[-1], {'done': True, 'completed': 0, 'failed': 2})
+        self.assertTrue(all(line['error'].startswith('Error generating prompt') for line in lines[:-1]))
+
+    def test_generate_prompts_validates_the_request(self):
+        response = self.client.post('/generate-prompts', json={'prompts': [], 'system_instructions': 'i'})
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+import fake_backend
+import storage
+from config import Config
+from extensions import db
+from models import GenerationHistory, StoredFile
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        # Index keys are paths relative to the app root, so run inside a scratch root.
+        self.root = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        self.addCleanup(os.chdir, cwd)
+        os.makedirs(storage.UPLOAD_DIR)
+        os.makedirs(Config.VIDEO_DIR)
+
+        self.app = Flask(__name__)
+        self.app.config.from_object(Config)
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI='sqlite://', STORAGE_MAX_BYTES=0, STORAGE_GCS_FALLBACK=False, DERIVATIVES_ENABLED=False,
+            GCS_BUCKET_NAME='bucket', PROJECT_ID='p',
+        )
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def save(self, data, accessed_minutes_ago):
+        key = storage.save(storage.UPLOAD_DIR, data, '.png').lstrip('/')
+        record = StoredFile.query.filter_by(path=key).one()
+        record.last_access = datetime.datetime.utcnow() - datetime.timedelta(minutes=accessed_minutes_ago)
+        db.session.commit()
+        return key
+
+    def test_save_shards_by_content_hash_and_deduplicates(self):
+        digest = hashlib.sha256(b'12345').hexdigest()
+        url = storage.save(storage.UPLOAD_DIR, b'12345', '.png')
+        self.assertEqual(url, f"/static/uploads/{digest[:2]}/{digest[2:4]}/{digest}.png")
+        self.assertEqual(storage.save(storage.UPLOAD_DIR, b'12345', '.png'), url)
+        with open(url.lstrip('/'), 'rb') as f:
+            self.assertEqual(f.read(), b'12345')
+        self.assertEqual(os.listdir(os.path.dirname(url.lstrip('/'))), [f"{digest}.png"])
+        self.assertEqual((StoredFile.query.count(), storage.local_bytes()), (1, 5))
+
+    def test_failed_write_leaves_no_partial_file(self):
+        with patch('storage.os.replace', side_effect=OSError('disk full')), self.assertRaises(OSError):
+            storage.save(storage.UPLOAD_DIR, b'12345', '.png')
+        self.assertEqual([files for _, _, files in os.walk(storage.UPLOAD_DIR) if files], [])
+        self.assertEqual(StoredFile.query.count(), 0)
+
+    def test_save_file_moves_a_download_into_the_store(self):
+        for _ in range(2):
+            with open('static/videos/op.mp4.part', 'wb') as f:
+                f.write(b'video')
+            url = storage.save_file(Config.VIDEO_DIR, 'static/videos/op.mp4.part', '.mp4')
+        self.assertFalse(os.path.exists('static/videos/op.mp4.part'))
+        self.assertTrue(url.endswith(f"{hashlib.sha256(b'video').hexdigest()}.mp4"))
+        self.assertTrue(os.path.exists(url.lstrip('/')))
+
+    def test_evicts_least_recently_used_files_first(self):
+        old = self.save(b'o' * 100, accessed_minutes_ago=30)
+        new = self.save(b'n' * 100, accessed_minutes_ago=1)
+        mid = self.save(b'm' * 100, accessed_minutes_ago=10)
+        storage.touch(f"/{old}")
+
+        self.assertEqual(storage.evict(150), [mid, new])
+        self.assertTrue(os.path.exists(old))
+        self.assertEqual([r.path for r in StoredFile.query], [old])
+        self.assertIsNone(storage.ensure_local(f"/{new}"))
+
+    def test_evicted_files_are_restored_from_gcs(self):
+        server, url = fake_backend.start_in_thread(port=0, latency=0, latency_jitter=0, gcs_latency=0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.app.config['STORAGE_GCS_FALLBACK'] = True
+        a = self.save(b'a' * 100, accessed_minutes_ago=5)
+        self.save(b'b' * 100, accessed_minutes_ago=1)
+
+        with patch.object(Config, 'GCS_API_ENDPOINT', url):
+            self.assertEqual(storage.evict(100), [a])
+            self.assertFalse(os.path.exists(a))
+            record = StoredFile.query.filter_by(path=a).one()
+            self.assertEqual((record.is_local, record.gcs_uri), (False, f"gs://bucket/artifacts/{a}"))
+
+            self.assertEqual(storage.ensure_local(f"/{a}"), a)
+        with open(a, 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 100)
+        self.assertTrue(StoredFile.query.filter_by(path=a).one().is_local)
+
+    def test_media_supports_ranges_and_immutable_caching(self):
+        self.app.add_url_rule('/static/uploads/<path:filename>', 'media',
+                              lambda filename: storage.send_media(storage.UPLOAD_DIR, filename))
+        url = storage.save(storage.UPLOAD_DIR, b'0123456789', '.mp4')
+        digest = hashlib.sha256(b'0123456789').hexdigest()
+        client = self.app.test_client()
+
+        response = client.get(url)
+        self.assertEqual((response.status_code, response.data), (200, b'0123456789'))
+        self.assertEqual(response.headers['ETag'], f'"{digest}"')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+
+        response = client.get(url, headers={'Range': 'bytes=2-5'})
+        self.assertEqual((response.status_code, response.data), (206, b'2345'))
+        self.assertEqual(response.headers['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(client.get(url, headers={'If-None-Match': f'"{digest}"'}).status_code, 304)
+
+        self.assertEqual(client.get('/static/uploads/missing.png').status_code, 404)
+        self.assertEqual(client.get('/static/uploads/../../etc/passwd').status_code, 404)
+
+    def test_reconcile_adopts_referenced_files_and_only_deletes_orphans_when_asked(self):
+        for name in ('kept.png', 'orphan.png', 'fresh.png'):
+            with open(os.path.join(storage.UPLOAD_DIR, name), 'wb') as f:
+                f.write(b'x')
+        hour_ago = time.time() - 3600
+        os.utime('static/uploads/kept.png', (hour_ago, hour_ago))
+        os.utime('static/uploads/orphan.png', (hour_ago, hour_ago))
+        db.session.add(GenerationHistory(operation_id='op_1', prompt='p', status='completed',
+                                         output_payload=json.dumps({'edited_image_path': '/static/uploads/kept.png'})))
+        db.session.add(StoredFile(path='static/uploads/gone.png', size=10))
+        db.session.commit()
+
+        counts = storage.reconcile(grace_seconds=600)
+
+        self.assertEqual(counts, {'adopted': 1, 'orphaned': 1, 'deleted': 0, 'dropped': 1})
+        self.assertEqual(sorted(os.listdir(storage.UPLOAD_DIR)), ['fresh.png', 'kept.png', 'orphan.png'])
+
+        counts = storage.reconcile(grace_seconds=600, delete_orphans=True)
+
+        self.assertEqual(counts, {'adopted': 0, 'orphaned': 1, 'deleted': 1, 'dropped': 0})
+        self.assertEqual(sorted(os.listdir(storage.UPLOAD_DIR)), ['fresh.png', 'kept.png'])
+        self.assertEqual([r.path for r in StoredFile.query], ['static/uploads/kept.png'])
+
+
+if __name__ == '__main__':
+    unittest.main()
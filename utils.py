@@ -1,85 +1,184 @@
 import base64
+import datetime
 import io
 import json
+import logging
 import os
 import time
 import requests
-import google.auth
-import google.auth.transport.requests
-from google.cloud import storage
 from google.genai import types
 from PIL import Image
 from config import Config
 from extensions import db
 from models import GenerationHistory
+from ids import new_ulid
+import backends
+import jobs
+import logs
+import metrics
+import storage
+from promptcache import prompt_cache, prompt_key
+from ratelimit import rate_limiter
+from retry import (
+    default_policy,
+    resubmit_policy,
+    submit_policy,
+    history_retry_recorder,
+    is_retryable_operation_error,
+    RetryableOperationError,
+)
 import vertexai
 from google import genai
 from segmentation import initialize_segmentation_model
 from vto import get_vto_client
 import imagenedit
 
+logger = logging.getLogger(__name__)
+
 def upload_to_gcs(file_bytes, destination_blob_name):
     """Uploads a file to the bucket."""
     try:
-        storage_client = storage.Client(project=Config.PROJECT_ID)
+        storage_client = backends.storage_client(Config.PROJECT_ID)
         bucket = storage_client.bucket(Config.GCS_BUCKET_NAME)
         blob = bucket.blob(destination_blob_name)
-        blob.upload_from_string(file_bytes)
+        with metrics.track_gcs('upload', len(file_bytes)):
+            default_policy.call(blob.upload_from_string, file_bytes)
         return f"gs://{Config.GCS_BUCKET_NAME}/{destination_blob_name}"
     except Exception as e:
-        print(f"Error uploading to GCS: {e}")
+        logger.error("Error uploading %s to GCS: %s", destination_blob_name, e)
         return None
 
 def download_from_gcs(bucket_name, source_blob_name, destination_file_name):
     """Downloads a file from the bucket."""
     try:
-        storage_client = storage.Client(project=Config.PROJECT_ID)
+        storage_client = backends.storage_client(Config.PROJECT_ID)
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(source_blob_name)
-        blob.download_to_filename(destination_file_name)
+        with metrics.track_gcs('download') as transfer:
+            default_policy.call(blob.download_to_filename, destination_file_name)
+            transfer.bytes = os.path.getsize(destination_file_name)
         return destination_file_name
     except Exception as e:
-        print(f"Error downloading from GCS: {e}")
+        logger.error("Error downloading gs://%s/%s from GCS: %s", bucket_name, source_blob_name, e)
         return None
 
-def generate_veo_prompt_internal(client, user_prompt, system_instructions, image_data=None):
-    print(f"--- [DEBUG] Starting VEO Prompt Generation ---")
+def format_operation_error(error):
+    """Formats a long-running operation error given as a dict or an object."""
+    if isinstance(error, dict):
+        return f"Code: {error.get('code')}, Message: {error.get('message')}"
+    return f"Code: {error.code}, Message: {error.message}"
+
+def _prompt_contents(user_prompt, system_instructions, image_bytes):
+    """The Gemini request for a prompt; None if the image could not be uploaded."""
+    content = [
+        f"{system_instructions}\n\nUser Prompt: {user_prompt}\n\nGenerate the final prompt in a valid JSON format."
+    ]
+    if image_bytes:
+        # Image.open only parses the header here.
+        img = Image.open(io.BytesIO(image_bytes))
+        mime_type = Image.MIME.get(img.format)
+        if not mime_type:
+            mime_type = f"image/{img.format.lower()}"
+        if len(image_bytes) <= Config.PROMPT_INLINE_IMAGE_MAX_BYTES:
+            # Small images go inline in the request, saving a GCS upload before every call.
+            content.insert(0, types.Part.from_bytes(data=image_bytes, mime_type=mime_type))
+        else:
+            # Create a unique name for the GCS blob
+            blob_name = f"prompt-images/{new_ulid()}.png"
+            gcs_uri = upload_to_gcs(image_bytes, blob_name)
+            if not gcs_uri:
+                return None
+            content.insert(0, types.Part.from_uri(file_uri=gcs_uri, mime_type=mime_type))
+    logs.payload_sampler.debug(logger, "Sending request to Vertex AI with content", content)
+    return content
+
+def generate_veo_prompt_internal(client, user_prompt, system_instructions, image_data=None, use_cache=True):
+    """
+    Asks Gemini for a prompt. Identical requests are answered from the prompt
+    cache unless `use_cache` is False, which samples a fresh answer (and caches it).
+    """
     if not client or not Config.GEMINI_MODEL:
-        print(f"[DEBUG] VEO prompt generation failed: Gemini model not initialized.")
+        logger.warning("VEO prompt generation failed: Gemini model not initialized.")
         return "Error: Gemini model not initialized."
     try:
-        print(f"[DEBUG] Generating VEO prompt with model: {Config.GEMINI_MODEL}")
-        content = [
-            f"{system_instructions}\n\nUser Prompt: {user_prompt}\n\nGenerate the final prompt in a valid JSON format."
-        ]
-        if image_data:
-            image_bytes = base64.b64decode(image_data)
-            
-            # Create a unique name for the GCS blob
-            blob_name = f"prompt-images/{int(time.time() * 1000)}.png"
-            gcs_uri = upload_to_gcs(image_bytes, blob_name)
+        image_bytes = base64.b64decode(image_data) if image_data else None
+        cache_key = prompt_key(Config.GEMINI_MODEL, system_instructions, user_prompt, image_bytes)
+        if use_cache:
+            cached = prompt_cache.get(cache_key)
+            if cached is not None:
+                return cached
 
-            if gcs_uri:
-                img = Image.open(io.BytesIO(image_bytes))
-                mime_type = Image.MIME.get(img.format)
-                if not mime_type:
-                    mime_type = f"image/{img.format.lower()}"
-                
-                content.insert(0, types.Part.from_uri(file_uri=gcs_uri, mime_type=mime_type))
-            else:
-                return "Error: Failed to upload image to Google Cloud Storage."
+        logger.debug("Generating VEO prompt with model %s", Config.GEMINI_MODEL)
+        content = _prompt_contents(user_prompt, system_instructions, image_bytes)
+        if content is None:
+            return "Error: Failed to upload image to Google Cloud Storage."
+
+        def generate():
+            rate_limiter.acquire(Config.GEMINI_MODEL)
+            return client.models.generate_content(model=Config.GEMINI_MODEL, contents=content)
 
-        print(f"[DEBUG] Sending request to Vertex AI with content: {content}")
-        response = client.models.generate_content(model=Config.GEMINI_MODEL, contents=content)
-        print(f"[DEBUG] Received response from Vertex AI.")
+        with metrics.track_model_call(Config.GEMINI_MODEL):
+            response = default_policy.call(generate)
+        logger.debug("Received response from Vertex AI.")
+        # Failures return early or raise, so only real answers are cached.
+        if response.text:
+            prompt_cache.put(cache_key, response.text)
         return response.text
     except Exception as e:
-        print(f"--- [DEBUG] ERROR during VEO prompt generation: {e} ---")
+        logger.exception("Error during VEO prompt generation: %s", e)
         return f"Error generating prompt: {e}"
 
+def stream_veo_prompt_internal(client, user_prompt, system_instructions, image_data=None, use_cache=True):
+    """
+    Like generate_veo_prompt_internal, but yields the answer in pieces as Gemini
+    produces them (a cached answer comes as one piece). Raises on failure.
+    """
+    if not client or not Config.GEMINI_MODEL:
+        raise RuntimeError("Gemini model not initialized.")
+    image_bytes = base64.b64decode(image_data) if image_data else None
+    cache_key = prompt_key(Config.GEMINI_MODEL, system_instructions, user_prompt, image_bytes)
+    if use_cache:
+        cached = prompt_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    logger.debug("Streaming VEO prompt with model %s", Config.GEMINI_MODEL)
+    content = _prompt_contents(user_prompt, system_instructions, image_bytes)
+    if content is None:
+        raise RuntimeError("Failed to upload image to Google Cloud Storage.")
+
+    def start():
+        rate_limiter.acquire(Config.GEMINI_MODEL)
+        stream = client.models.generate_content_stream(model=Config.GEMINI_MODEL, contents=content)
+        return stream, next(stream, None)
+
+    parts = []
+    with metrics.track_model_call(Config.GEMINI_MODEL):
+        # Only the wait for the first chunk is retried: after that, text has reached the caller.
+        stream, chunk = default_policy.call(start)
+        while chunk is not None:
+            if chunk.text:
+                parts.append(chunk.text)
+                yield chunk.text
+            chunk = next(stream, None)
+    if parts:
+        prompt_cache.put(cache_key, ''.join(parts))
+
+def record_worker_wait(history_item, model_name, timings):
+    """Records how long a history row waited between being queued and a worker picking it up."""
+    if history_item.timestamp:
+        waited = max((datetime.datetime.utcnow() - history_item.timestamp).total_seconds(), 0.0)
+        metrics.queue_wait_seconds.labels(model=model_name, stage='worker').observe(waited)
+        timings.add('queue_wait', waited)
+
+@metrics.tracked_operation('video')
 def generate_video_internal(app_context, client, prompt, operation_id, model_name, seed, aspect_ratio, negative_prompt):
+    logs.set_operation_id(operation_id)
     with app_context:
-        history_item = GenerationHistory.query.filter_by(operation_id=operation_id).first()
+        history_item = GenerationHistory.get_by_operation_id(operation_id)
+        timings = metrics.StageTimings.from_json(history_item.stage_timings)
+        record_worker_wait(history_item, model_name, timings)
         if not client:
             history_item.status = 'failed'
             history_item.error_message = "Vertex AI client not initialized."
@@ -87,50 +186,82 @@ def generate_video_internal(app_context, client, prompt, operation_id, model_nam
             return
         try:
             history_item.status = 'running'
-            db.session.commit()
-            operation = client.models.generate_videos(
-                model=model_name, prompt=prompt,
-                config=types.GenerateVideosConfig(
-                    aspect_ratio=aspect_ratio,
-                    resolution="1080p",
-                    number_of_videos=1,
-                    seed=seed,
-                    negative_prompt=negative_prompt
+            timings.write(db.session)
+            on_retry = history_retry_recorder(history_item, db.session, timings)
+            lease = jobs.OperationLease(operation_id)
+
+            def submit():
+                rate_limiter.acquire(model_name)
+                return client.models.generate_videos(
+                    model=model_name, prompt=prompt,
+                    config=types.GenerateVideosConfig(
+                        aspect_ratio=aspect_ratio,
+                        resolution="1080p",
+                        number_of_videos=1,
+                        seed=seed,
+                        negative_prompt=negative_prompt
+                    )
                 )
-            )
-            while not operation.done:
-                time.sleep(15)
-                operation = client.operations.get(operation)
 
-            if hasattr(operation, 'error') and operation.error:
+            def submit_and_wait():
+                resumed = lease.take_remote_operation()
+                if resumed:
+                    operation = types.GenerateVideosOperation(name=resumed)
+                else:
+                    with metrics.track_model_call(model_name), timings.stage('submit'):
+                        operation = submit_policy.call(submit, on_retry=on_retry)
+                    lease.record(operation.name)
+                with timings.stage('remote') as timer:
+                    while not operation.done:
+                        time.sleep(backends.poll_interval(15))
+                        lease.check()
+                        operation = default_policy.call(client.operations.get, operation, on_retry=on_retry)
+                metrics.operation_completion_seconds.labels(model=model_name).observe(timer.seconds)
+                if operation.error:
+                    metrics.record_error(model_name, 'OperationError')
+                if operation.error and is_retryable_operation_error(operation.error):
+                    raise RetryableOperationError(format_operation_error(operation.error))
+                return operation
+
+            operation = resubmit_policy.call(submit_and_wait, on_retry=on_retry)
+
+            if operation.error:
                 history_item.status = 'failed'
-                error_info = operation.error
-                history_item.error_message = f"Code: {error_info.code}, Message: {error_info.message}"
+                history_item.error_message = format_operation_error(operation.error)
             elif operation.result and operation.result.generated_videos:
                 generated_video = operation.result.generated_videos[0]
                 video_bytes = generated_video.video.video_bytes
-                local_path = os.path.join(Config.VIDEO_DIR, f"{operation_id}.mp4")
-                with open(local_path, "wb") as f:
-                    f.write(video_bytes)
+                with timings.stage('download'):
+                    history_item.video_path = storage.save(Config.VIDEO_DIR, video_bytes, '.mp4')
                 history_item.status = 'completed'
-                history_item.video_path = f"/{local_path}"
             else:
                 history_item.status = 'failed'
                 history_item.error_message = "Operation finished with no error but no video was generated."
+        except jobs.LeaseLost as e:
+            logger.warning("%s", e)
+            return
         except Exception as e:
+            metrics.record_error('video', type(e).__name__)
             history_item.status = 'failed'
             history_item.error_message = str(e)
-        db.session.commit()
+        timings.commit(history_item, db.session)
 
+@metrics.tracked_operation('image_video')
 def generate_image_video_internal(app_context, prompt, operation_id, image_bytes, model_name, seed, aspect_ratio, negative_prompt):
+    """
+    Generates a video from an image and records it on the history row.
+    `image_bytes` may also be a function returning the bytes; it is then only
+    called when a new operation has to be submitted.
+    """
+    logs.set_operation_id(operation_id)
     with app_context:
-        history_item = GenerationHistory.query.filter_by(operation_id=operation_id).first()
-        
+        history_item = GenerationHistory.get_by_operation_id(operation_id)
+        timings = metrics.StageTimings.from_json(history_item.stage_timings)
+        record_worker_wait(history_item, model_name, timings)
+        on_retry = history_retry_recorder(history_item, db.session, timings)
+
         try:
-            creds, _ = google.auth.default(scopes=['httpshttps://www.googleapis.com/auth/cloud-platform'])
-            auth_req = google.auth.transport.requests.Request()
-            creds.refresh(auth_req)
-            token = creds.token
+            token = backends.access_token(scopes=['https://www.googleapis.com/auth/cloud-platform'])
         except Exception as e:
             history_item.status = 'failed'
             history_item.error_message = f"Failed to get authentication token: {e}"
@@ -139,71 +270,93 @@ def generate_image_video_internal(app_context, prompt, operation_id, image_bytes
 
         try:
             history_item.status = 'running'
-            db.session.commit()
-
-            try:
-                img = Image.open(io.BytesIO(image_bytes))
-                mime_type = Image.MIME.get(img.format)
-                if not mime_type:
-                    mime_type = f"image/{img.format.lower()}"
-            except Exception as img_e:
-                history_item.status = 'failed'
-                history_item.error_message = f"Could not identify image format: {img_e}"
-                db.session.commit()
-                return
+            timings.write(db.session)
 
-            encoded_image = base64.b64encode(image_bytes).decode('utf-8')
+            api_base = backends.vertex_base_url(Config.LOCATION)
+            url = f"{api_base}/v1/projects/{Config.PROJECT_ID}/locations/{Config.LOCATION}/publishers/google/models/{model_name}:predictLongRunning"
 
-            api_endpoint = "us-central1-aiplatform.googleapis.com"
-            url = f"https://{api_endpoint}/v1/projects/{Config.PROJECT_ID}/locations/{Config.LOCATION}/publishers/google/models/{model_name}:predictLongRunning"
+            def build_request_body():
+                data = image_bytes() if callable(image_bytes) else image_bytes
+                try:
+                    img = Image.open(io.BytesIO(data))
+                    mime_type = Image.MIME.get(img.format)
+                    if not mime_type:
+                        mime_type = f"image/{img.format.lower()}"
+                except Exception as img_e:
+                    raise ValueError(f"Could not identify image format: {img_e}")
 
-            request_body = {
-                "instances": [{"prompt": prompt, "image": {"bytesBase64Encoded": encoded_image, "mimeType": mime_type}}],
-                "parameters": {
-                    "aspectRatio": aspect_ratio, "sampleCount": 1, "durationSeconds": "8",
-                    "personGeneration": "allow_all", "addWatermark": True, "includeRaiReason": True,
-                    "generateAudio": True, "resolution": "1080p", "seed": seed, "negativePrompt": negative_prompt
+                encoded_image = base64.b64encode(data).decode('utf-8')
+                return {
+                    "instances": [{"prompt": prompt, "image": {"bytesBase64Encoded": encoded_image, "mimeType": mime_type}}],
+                    "parameters": {
+                        "aspectRatio": aspect_ratio, "sampleCount": 1, "durationSeconds": "8",
+                        "personGeneration": "allow_all", "addWatermark": True, "includeRaiReason": True,
+                        "generateAudio": True, "resolution": "1080p", "seed": seed, "negativePrompt": negative_prompt
+                    }
                 }
-            }
+
+            request_body = None
 
             headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
 
-            response = requests.post(url, json=request_body, headers=headers)
-            response.raise_for_status()
+            fetch_url = f"{api_base}/v1/projects/{Config.PROJECT_ID}/locations/{Config.LOCATION}/publishers/google/models/{model_name}:fetchPredictOperation"
+
+            def post(endpoint, body):
+                response = requests.post(endpoint, json=body, headers=headers)
+                response.raise_for_status()
+                return response
+
+            def submit():
+                nonlocal request_body
+                if request_body is None:
+                    request_body = build_request_body()
+                rate_limiter.acquire(model_name)
+                return post(url, request_body)
+
+            lease = jobs.OperationLease(operation_id)
 
-            operation_data = response.json()
-            operation_name = operation_data.get('name')
-            if not operation_name:
+            def submit_and_wait():
+                operation_name, response = lease.take_remote_operation(), None
+                if not operation_name:
+                    with metrics.track_model_call(model_name), timings.stage('submit'):
+                        response = submit_policy.call(submit, on_retry=on_retry)
+                    operation_name = response.json().get('name')
+                    if not operation_name:
+                        return None, response
+                    lease.record(operation_name)
+                fetch_body = {"operationName": operation_name}
+                with timings.stage('remote') as timer:
+                    while True:
+                        time.sleep(backends.poll_interval(20))
+                        lease.check()
+                        op_data = default_policy.call(post, fetch_url, fetch_body, on_retry=on_retry).json()
+                        if op_data.get('done'):
+                            break
+                metrics.operation_completion_seconds.labels(model=model_name).observe(timer.seconds)
+                if op_data.get('error'):
+                    metrics.record_error(model_name, 'OperationError')
+                if op_data.get('error') and is_retryable_operation_error(op_data['error']):
+                    raise RetryableOperationError(format_operation_error(op_data['error']))
+                return op_data, response
+
+            op_data, response = resubmit_policy.call(submit_and_wait, on_retry=on_retry)
+
+            if op_data is None:
                 history_item.status = 'failed'
                 history_item.error_message = f"Failed to start operation: {response.text}"
-                db.session.commit()
+                timings.commit(history_item, db.session)
                 return
-            
-            fetch_url = f"https://{api_endpoint}/v1/projects/{Config.PROJECT_ID}/locations/{Config.LOCATION}/publishers/google/models/{model_name}:fetchPredictOperation"
-            fetch_body = {"operationName": operation_name}
-
-            while True:
-                time.sleep(20)
-                op_response = requests.post(fetch_url, json=fetch_body, headers=headers)
-                op_response.raise_for_status()
-                op_data = op_response.json()
-                if op_data.get('done'):
-                    break
-            
+
             if 'error' in op_data and op_data['error']:
                 history_item.status = 'failed'
-                error_info = op_data['error']
-                history_item.error_message = f"Code: {error_info.get('code')}, Message: {error_info.get('message')}"
+                history_item.error_message = format_operation_error(op_data['error'])
             elif 'response' in op_data and op_data['response']:
                 videos = op_data['response'].get('videos', [])
                 if videos and isinstance(videos, list) and len(videos) > 0 and 'bytesBase64Encoded' in videos[0]:
                     video_data_base64 = videos[0]['bytesBase64Encoded']
-                    video_bytes = base64.b64decode(video_data_base64)
-                    local_path = os.path.join(Config.VIDEO_DIR, f"{operation_id}.mp4")
-                    with open(local_path, "wb") as f:
-                        f.write(video_bytes)
+                    with timings.stage('download'):
+                        history_item.video_path = storage.save(Config.VIDEO_DIR, base64.b64decode(video_data_base64), '.mp4')
                     history_item.status = 'completed'
-                    history_item.video_path = f"/{local_path}"
                 else:
                     history_item.status = 'failed'
                     history_item.error_message = f"No video data in response. Full response: {json.dumps(op_data.get('response'))}"
@@ -211,10 +364,15 @@ def generate_image_video_internal(app_context, prompt, operation_id, image_bytes
                 history_item.status = 'failed'
                 history_item.error_message = f"Operation finished with an unknown state: {op_data}"
 
+        except jobs.LeaseLost as e:
+            logger.warning("%s", e)
+            return
         except requests.exceptions.RequestException as req_e:
+            metrics.record_error('image_video', type(req_e).__name__)
             history_item.status = 'failed'
             history_item.error_message = f"HTTP Request failed: {req_e}. Response: {req_e.response.text if req_e.response else 'No response'}"
         except Exception as e:
+            metrics.record_error('image_video', type(e).__name__)
             history_item.status = 'failed'
             history_item.error_message = str(e)
-        db.session.commit()
+        timings.commit(history_item, db.session)
@@ -13,33 +13,39 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import logging
 import time
-import google.auth
-import google.auth.transport.requests
 import requests
-from google.cloud import storage
 import os
+import metrics
+import backends
+from logs import payload_sampler
+from ratelimit import rate_limiter
+from retry import default_policy, submit_policy
+from jobs import LeaseLost
+
+VEO_EDIT_MODEL = "veo-2.0-generate-exp"
+
+logger = logging.getLogger(__name__)
 
 def upload_to_gcs(project_id, bucket_name, source_file_name, destination_blob_name):
     """Uploads a file to the bucket."""
     try:
-        storage_client = storage.Client(project=project_id)
+        storage_client = backends.storage_client(project_id)
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(destination_blob_name)
-        blob.upload_from_filename(source_file_name)
+        with metrics.track_gcs('upload', os.path.getsize(source_file_name)):
+            default_policy.call(blob.upload_from_filename, source_file_name)
         return f"gs://{bucket_name}/{destination_blob_name}"
     except Exception as e:
-        print(f"Error uploading to GCS: {e}")
+        logger.error("Error uploading %s to GCS: %s", source_file_name, e)
         return None
 
 def send_request_to_google_api(api_endpoint, data=None):
     """
     Sends an HTTP request to a Google API endpoint.
     """
-    creds, project = google.auth.default()
-    auth_req = google.auth.transport.requests.Request()
-    creds.refresh(auth_req)
-    access_token = creds.token
+    access_token = backends.access_token()
 
     headers = {
         "Authorization": f"Bearer {access_token}",
@@ -77,18 +83,32 @@ def compose_videogen_request(
     return request
 
 
-def fetch_operation(fetch_endpoint, lro_name):
+def fetch_operation(fetch_endpoint, lro_name, retry_policy=default_policy, on_retry=None, poll_interval=None, model=VEO_EDIT_MODEL, lease=None):
     request = {"operationName": lro_name}
+    if poll_interval is None:
+        poll_interval = backends.poll_interval(10)
+    timer = metrics.Timer()
     for i in range(30):
         try:
-            resp = send_request_to_google_api(fetch_endpoint, request)
+            # Transient errors (429/5xx, connection resets) are retried; only
+            # non-retryable or exhausted errors end the operation.
+            resp = retry_policy.call(send_request_to_google_api, fetch_endpoint, request, on_retry=on_retry)
             if "done" in resp and resp["done"]:
+                metrics.operation_completion_seconds.labels(model=model).observe(timer.stop())
+                if resp.get("error"):
+                    metrics.record_error(model, "OperationError")
                 return resp
-            time.sleep(10)
+            time.sleep(poll_interval)
+            if lease:
+                lease.check()
+        except LeaseLost:
+            raise
         except Exception as e:
-            print(f"Error fetching operation status: {e}")
+            metrics.record_error(model, type(e).__name__)
+            logger.error("Error fetching status of operation %s: %s", lro_name, e)
             # Return a failed operation structure
             return {"done": True, "error": {"message": str(e)}}
+    metrics.record_error(model, "Timeout")
     return {"done": True, "error": {"message": "Operation timed out."}}
 
 
@@ -104,8 +124,18 @@ def generate_video(
     mask_gcs: str = "",
     mask_mime_type: str = "",
     mask_mode: str = "",
+    on_retry=None,
+    timings=None,
+    lease=None,
 ):
-    video_model = f"https://{location}-aiplatform.googleapis.com/v1beta1/projects/{project_id}/locations/{location}/publishers/google/models/veo-2.0-generate-exp"
+    """
+    Submits a Veo edit and polls it to completion. With a jobs.OperationLease,
+    the operation name is recorded once submitted, an operation submitted by a
+    previous owner of the job is resumed instead, and polling stops with
+    LeaseLost if another process takes the job over.
+    """
+    timings = timings if timings is not None else metrics.StageTimings()
+    video_model = f"{backends.vertex_base_url(location)}/v1beta1/projects/{project_id}/locations/{location}/publishers/google/models/{VEO_EDIT_MODEL}"
     prediction_endpoint = f"{video_model}:predictLongRunning"
     fetch_endpoint = f"{video_model}:fetchPredictOperation"
 
@@ -120,6 +150,21 @@ def generate_video(
         mask_mime_type=mask_mime_type,
         mask_mode=mask_mode,
     )
-    resp = send_request_to_google_api(prediction_endpoint, req)
-    print(f"Started VEO editing operation: {resp}")
-    return fetch_operation(fetch_endpoint, resp["name"])
+
+    def submit():
+        rate_limiter.acquire(VEO_EDIT_MODEL)
+        return send_request_to_google_api(prediction_endpoint, req)
+
+    operation_name = lease.take_remote_operation() if lease else None
+    if operation_name:
+        logger.info("Resuming VEO editing operation %s", operation_name)
+    else:
+        with metrics.track_model_call(VEO_EDIT_MODEL), timings.stage("submit"):
+            resp = submit_policy.call(submit, on_retry=on_retry)
+        logger.info("Started VEO editing operation %s", resp.get("name"))
+        payload_sampler.debug(logger, "VEO editing submit response", resp)
+        operation_name = resp["name"]
+        if lease:
+            lease.record(operation_name)
+    with timings.stage("remote"):
+        return fetch_operation(fetch_endpoint, operation_name, on_retry=on_retry, lease=lease)
@@ -1,14 +1,18 @@
 import base64
 import io
-import timeit
-from google.cloud import aiplatform
+import logging
 from PIL import Image
+import backends
+import metrics
+from ratelimit import rate_limiter
+from retry import default_policy
+
+logger = logging.getLogger(__name__)
 
 def get_vto_client(location="us-central1"):
     """Initializes the VTO PredictionServiceClient."""
     api_regional_endpoint = f"{location}-autopush-aiplatform.sandbox.googleapis.com"
-    client_options = {"api_endpoint": api_regional_endpoint}
-    return aiplatform.gapic.PredictionServiceClient(client_options=client_options)
+    return backends.prediction_client(api_regional_endpoint)
 
 def call_virtual_try_on(
     client,
@@ -70,14 +74,17 @@ def call_virtual_try_on(
     if seed:
         parameters["seed"] = seed
 
-    start = timeit.default_timer()
-    response = client.predict(
-        endpoint=model_endpoint,
-        instances=[instance],
-        parameters=parameters
-    )
-    end = timeit.default_timer()
-    print(f"Virtual Try-On took {end - start:.2f}s.")
+    def predict():
+        rate_limiter.acquire(model_endpoint_name)
+        return client.predict(
+            endpoint=model_endpoint,
+            instances=[instance],
+            parameters=parameters
+        )
+
+    with metrics.track_model_call(model_endpoint_name) as timer:
+        response = default_policy.call(predict)
+    logger.info("Virtual Try-On took %.2fs.", timer.seconds)
 
     return response
 